@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# bench/import_time.py - Time how long composer takes to start: importing the
+# CLI, creating an Index and building a one-page site, each in a fresh
+# interpreter. Also lists which optional backends ended up imported.
+#
+# Usage: python bench/import_time.py [REPEAT]
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+BACKENDS = ['docutils', 'jinja2', 'mako', 'markdown', 'pygments', 'werkzeug']
+
+SCRIPTS = [
+    ('python', 'pass'),
+    ('import', 'import composer.command'),
+    ('index', 'import composer.index; composer.index.Index()'),
+]
+
+
+def run(script, repeat):
+    timings = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in xrange(repeat):
+            start = time.time()
+            subprocess.check_call([sys.executable, '-c', script], cwd=ROOT, stdout=devnull, stderr=devnull)
+            timings.append(time.time() - start)
+    return min(timings)
+
+
+def make_site(path):
+    with open(os.path.join(path, 'page.md'), 'w') as fp:
+        fp.write('# Hello\n')
+
+    with open(os.path.join(path, 'index.json'), 'w') as fp:
+        json.dump({'routes': [{'url': '/', 'file': 'page.md', 'filters': ['markdown']}]}, fp)
+
+    return os.path.join(path, 'index.json')
+
+
+def main(repeat=10):
+    path = tempfile.mkdtemp(prefix='composer-bench-')
+    try:
+        index_path = make_site(path)
+        build = ("import sys; sys.argv = ['composer', 'build', %r, '--build-path', %r]\n"
+                 "from composer.command import main; main()") % (index_path, os.path.join(path, 'build'))
+
+        for name, script in SCRIPTS + [('build', build)]:
+            print "%-8s %8.1fms" % (name, run(script, repeat) * 1000)
+
+        imported = subprocess.check_output([sys.executable, '-c', (
+            "import sys; import composer.command, composer.index; composer.index.Index()\n"
+            "print ' '.join(m for m in %r if m in sys.modules)") % BACKENDS], cwd=ROOT).split()
+        print "Backends imported by Index(): %s" % (', '.join(imported) or 'none')
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
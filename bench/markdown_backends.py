@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# bench/markdown_backends.py - Time converting the posts of a synthetic site
+# (see sitegen.py) with each way of using the installed Markdown backends: a
+# new converter per document, one converter which is never reset (which leaks
+# state between documents), the Markdown filter's reset converter, and its
+# batch conversion.
+#
+# Usage: python bench/markdown_backends.py [--posts N] [--repeat R]
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from composer.filters import Markdown, markdown, markdown2
+from composer.index import Index
+
+from sitegen import generate_post
+
+
+EXTENSIONS = ['markdown.extensions.fenced_code']
+EXTRAS = ['fenced-code-blocks']
+
+
+def get_cases():
+    cases = []
+
+    if markdown:
+        cases.extend([
+            ('markdown/new', lambda docs: [markdown.Markdown(extensions=EXTENSIONS).convert(doc) for doc in docs]),
+            ('markdown/unreset', lambda docs: map(markdown.Markdown(extensions=EXTENSIONS).convert, docs)),
+        ])
+
+        f = Markdown(Index(), extensions=EXTENSIONS)
+        cases.extend([
+            ('markdown/filter', lambda docs: map(f, docs)),
+            ('markdown/batch', f.convert_many),
+        ])
+
+    if markdown2:
+        f2 = Markdown(Index(), backend='markdown2', extras=EXTRAS)
+        cases.extend([
+            ('markdown2/filter', lambda docs: map(f2, docs)),
+            ('markdown2/batch', f2.convert_many),
+        ])
+
+    return cases
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare Markdown backends on synthetic posts.")
+    parser.add_argument('--posts', type=int, default=500)
+    parser.add_argument('--code-blocks', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rand = random.Random(0)
+    docs = [generate_post(rand, code_blocks=args.code_blocks) for _ in xrange(args.posts)]
+
+    for name, convert in get_cases():
+        timings = []
+        for _ in xrange(args.repeat):
+            start = time.time()
+            convert(docs)
+            timings.append(time.time() - start)
+
+        best = min(timings)
+        print '%-18s %10.4fs  %10.1f docs/s' % (name, best, len(docs) / best)
+
+    missing = [name for name, module in [('markdown', markdown), ('markdown2', markdown2)] if not module]
+    if missing:
+        print "Not installed: %s" % ', '.join(missing)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
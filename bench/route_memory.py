@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# bench/route_memory.py - Compare the per-route memory overhead of the route
+# cache with __dict__ routes and unshared data (how Routes used to be) against
+# the current __slots__ routes with interned filters and shared contexts.
+#
+# Usage: python bench/route_memory.py [NUM_ROUTES]
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from composer.index import Index
+
+
+class DictRoute(object):
+    def __init__(self, url=None, file=None, filters=None, context=None, content=None):
+        self.url = url
+        self.file = file
+        self.filters = filters or []
+        self.context = context
+        self.content = None
+
+
+def generate_index_dict(num_routes):
+    return {'routes': [
+        {
+            'url': '/post/%d' % i,
+            'file': 'posts/%d.md' % i,
+            'filters': ['markdown', 'pygments', 'post'],
+            'context': {'title': 'Hello', 'section': 'posts'},
+        } for i in xrange(num_routes)
+    ]}
+
+
+def deep_size(objs):
+    """
+    Total size of the given objects and everything they reference, counting
+    shared objects once.
+    """
+    seen = set()
+    size = 0
+    stack = list(objs)
+
+    while stack:
+        o = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+
+        if isinstance(o, dict):
+            stack.extend(o.iterkeys())
+            stack.extend(o.itervalues())
+        elif isinstance(o, (list, tuple)):
+            stack.extend(o)
+        elif hasattr(o, '__slots__'):
+            # Reading a __dict__ slot creates the dict, routes don't use it.
+            stack.extend(getattr(o, attr) for attr in o.__slots__ if attr != '__dict__')
+        elif hasattr(o, '__dict__'):
+            stack.append(o.__dict__)
+
+    return size
+
+
+def main(num_routes=100000):
+    index = Index.from_dict(generate_index_dict(num_routes))
+    routes = list(index.routes)
+
+    # Recreate the old representation from a fresh parse.
+    old_routes = [DictRoute(**route_kw) for route_kw in generate_index_dict(num_routes)['routes']]
+
+    # Url and file strings are the same in both, leave them out.
+    strings = [r.url for r in routes] + [r.file for r in routes]
+    baseline = deep_size(strings)
+    old_strings = [r.url for r in old_routes] + [r.file for r in old_routes]
+    old_baseline = deep_size(old_strings)
+
+    old_size = deep_size(old_routes + old_strings) - old_baseline
+    new_size = deep_size(routes + strings) - baseline
+
+    print "Routes:           %d" % num_routes
+    print "Before per route: %d bytes" % (old_size / num_routes)
+    print "After per route:  %d bytes" % (new_size / num_routes)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# bench/sitegen.py - Generate a synthetic site of configurable size to
+# benchmark against.
+#
+# The site has Markdown posts with fenced code blocks rendered through
+# Pygments and a MakoContainer layout, Jinja2 pages extending a base
+# template and a nested static tree. Its index.json is written to the root of
+# the site. The same arguments always generate the same site.
+#
+# Usage: python bench/sitegen.py PATH [--posts N] [--pages N] [--static N]
+
+import json
+import os
+import random
+import sys
+
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+         'incididunt ut labore et dolore magna aliqua enim ad minim veniam quis nostrud').split()
+
+CODE_BLOCKS = [
+    ('python', 'def fib(n):\n    a, b = 0, 1\n    for i in range(n):\n        a, b = b, a + b\n    return a\n'),
+    ('javascript', 'function fib(n) {\n  var a = 0, b = 1;\n  while (n--) { var t = a; a = b; b = t + b; }\n  return a;\n}\n'),
+    ('c', 'int fib(int n) {\n    int a = 0, b = 1;\n    while (n--) { int t = a; a = b; b = t + b; }\n    return a;\n}\n'),
+]
+
+POST_TEMPLATE = """\
+<html>
+    <head><title>${route.context['title']}</title></head>
+    <body>
+        <h1>${route.context['title']}</h1>
+        ${body}
+    </body>
+</html>
+"""
+
+PAGE_LAYOUT = """\
+<html>
+    <head><title>{% block title %}{% endblock %}</title></head>
+    <body>{% block body %}{% endblock %}</body>
+</html>
+"""
+
+
+def _sentence(rand, num_words):
+    return ' '.join(rand.choice(WORDS) for _ in xrange(num_words)).capitalize() + '.'
+
+
+def _paragraph(rand):
+    return ' '.join(_sentence(rand, rand.randint(5, 15)) for _ in xrange(rand.randint(2, 6)))
+
+
+def _write(path, content):
+    dir_path = os.path.dirname(path)
+    if not os.path.exists(dir_path):
+        os.makedirs(dir_path)
+
+    with open(path, 'wb') as fp:
+        fp.write(content)
+
+
+def generate_post(rand, num_paragraphs=6, code_blocks=2):
+    parts = ['# %s' % _sentence(rand, 4)]
+
+    for i in xrange(num_paragraphs):
+        parts.append(_paragraph(rand))
+        if i % 3 == 1:
+            parts.append('\n'.join('* %s' % _sentence(rand, 3) for _ in xrange(4)))
+
+    for i in xrange(code_blocks):
+        language, code = rand.choice(CODE_BLOCKS)
+        parts.append('```%s\n%s```' % (language, code))
+        parts.append(_paragraph(rand))
+
+    return '\n\n'.join(parts) + '\n'
+
+
+def generate_page(rand):
+    paragraphs = '\n'.join('<p>%s</p>' % _paragraph(rand) for _ in xrange(4))
+    return ('{%% extends "layout.html" %%}\n'
+            '{%% block title %%}%s{%% endblock %%}\n'
+            '{%% block body %%}\n{{ route.url }}\n%s\n{%% endblock %%}\n') % (_sentence(rand, 3), paragraphs)
+
+
+def generate_site(path, num_posts=500, num_pages=50, num_static=200, code_blocks=2, seed=0):
+    """
+    Generate a site under ``path`` and return the path of its index.json.
+
+    :param num_static:
+        Number of files in the static tree, spread across nested directories
+        with sizes from a few bytes to ~64KB.
+    """
+    rand = random.Random(seed)
+    path = os.path.abspath(path)
+
+    _write(os.path.join(path, 'templates', 'post.mako'), POST_TEMPLATE)
+    _write(os.path.join(path, 'templates', 'layout.html'), PAGE_LAYOUT)
+
+    routes = []
+
+    for i in xrange(num_posts):
+        file = 'posts/%d/%d.md' % (i // 100, i)
+        _write(os.path.join(path, file), generate_post(rand, code_blocks=code_blocks))
+        routes.append({
+            'url': '/post/%d' % i,
+            'file': file,
+            'filters': ['markdown', 'pygments', 'post'],
+            'context': {'title': 'Post %d' % i},
+        })
+
+    for i in xrange(num_pages):
+        file = 'pages/%d.html' % i
+        _write(os.path.join(path, file), generate_page(rand))
+        routes.append({
+            'url': '/page/%d.html' % i,
+            'file': file,
+            'filters': ['jinja2'],
+        })
+
+    for i in xrange(num_static):
+        size = int(2 ** rand.uniform(4, 16))
+        file = 'static/%d/%d/%d.bin' % (i % 10, i % 7, i)
+        _write(os.path.join(path, file), os.urandom(size))
+
+    index = {
+        'routes': routes,
+        'static': [{'url': '/static', 'file': 'static'}],
+        'filters': {
+            'markdown': {
+                'class': 'composer.filters:Markdown',
+                'kwargs': {'extensions': ['markdown.extensions.fenced_code']},
+            },
+            'pygments': {
+                'class': 'composer.filters:Pygments',
+                'kwargs': {},
+            },
+            'post': {
+                'class': 'composer.filters:MakoContainer',
+                'kwargs': {'template': 'templates/post.mako', 'directories': ['.']},
+            },
+            'jinja2': {
+                'class': 'composer.filters:Jinja2',
+                'kwargs': {'searchpaths': [os.path.join(path, 'templates')]},
+            },
+        },
+    }
+
+    index_path = os.path.join(path, 'index.json')
+    with open(index_path, 'w') as fp:
+        json.dump(index, fp, indent=2)
+
+    return index_path
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic site to benchmark against.")
+    parser.add_argument('path')
+    parser.add_argument('--posts', type=int, default=500)
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--static', type=int, default=200)
+    parser.add_argument('--code-blocks', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    index_path = generate_site(args.path, num_posts=args.posts, num_pages=args.pages,
+                               num_static=args.static, code_blocks=args.code_blocks, seed=args.seed)
+    print index_path
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# bench/suite.py - Time index loading, route lookups, full and no-op builds and
+# WSGI requests against a synthetic site (see sitegen.py).
+#
+# Reports are saved as JSON with the git revision they were taken at, so that
+# two revisions can be compared:
+#
+#   $ git checkout old && python bench/suite.py --output old.json
+#   $ git checkout new && python bench/suite.py --output new.json --compare old.json
+#
+# Usage: python bench/suite.py [--posts N] [--pages N] [--static N] [--repeat R]
+#                              [--only NAME,...] [--output FILE] [--compare FILE]
+
+import gc
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from composer.command import build_command, load_index
+from composer.writer import WSGIWriter
+
+from sitegen import generate_site
+
+
+def get_revision():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(fn, repeat):
+    """
+    Call ``fn`` ``repeat`` times and return the timings in seconds, along with
+    the number of operations it reported doing in each call.
+    """
+    timings = []
+    ops = 1
+
+    for _ in xrange(repeat):
+        gc.collect()
+        start = time.time()
+        ops = fn() or 1
+        timings.append(time.time() - start)
+
+    return timings, ops
+
+
+class Suite(object):
+    def __init__(self, index_path, build_path, num_lookups=10000, num_requests=500, jobs=1):
+        self.index_path = index_path
+        self.build_path = build_path
+        self.num_lookups = num_lookups
+        self.num_requests = num_requests
+        self.jobs = jobs
+
+        self.urls = [route.url for route in self.load_index().routes]
+
+    def load_index(self):
+        return load_index(self.index_path)
+
+    def clean_build(self):
+        if os.path.exists(self.build_path):
+            shutil.rmtree(self.build_path)
+
+    def _build(self, **kw):
+        index = self.load_index()
+        build_command(index, build_path=self.build_path, jobs=self.jobs,
+                      index_args=(self.index_path, 'auto', None), **kw)
+        return len(self.urls)
+
+    def bench_index_load(self):
+        return sum(1 for _ in self.load_index().routes)
+
+    def bench_get_route(self):
+        index = self.load_index()
+        index.get_route('/') # Prime the route cache.
+
+        urls = random.Random(0).sample(self.urls * (self.num_lookups // len(self.urls) + 1), self.num_lookups)
+        for url in urls:
+            index.get_route(url)
+
+        return len(urls)
+
+    def bench_build_full(self):
+        return self._build(clean=True)
+
+    def bench_build_noop(self):
+        return self._build(incremental=True)
+
+    def _requests(self, app, urls):
+        def start_response(status, headers):
+            pass
+
+        for url in urls:
+            ''.join(app({'PATH_INFO': url, 'REQUEST_METHOD': 'GET'}, start_response))
+
+        return len(urls)
+
+    def bench_wsgi_cold(self):
+        app = WSGIWriter(self.load_index())
+        return self._requests(app, self.urls[:self.num_requests])
+
+    def bench_wsgi_warm(self):
+        return self._requests(self.warm_app, self.urls[:self.num_requests])
+
+    def setup_wsgi_warm(self):
+        self.warm_app = WSGIWriter(self.load_index())
+        self._requests(self.warm_app, self.urls[:self.num_requests])
+
+    def setup_build_noop(self):
+        # Leave a manifest behind for the no-op builds to check against.
+        self._build(incremental=True)
+
+    benchmarks = [
+        ('index_load', bench_index_load, None),
+        ('get_route', bench_get_route, None),
+        ('build_full', bench_build_full, clean_build),
+        ('build_noop', bench_build_noop, setup_build_noop),
+        ('wsgi_cold', bench_wsgi_cold, None),
+        ('wsgi_warm', bench_wsgi_warm, setup_wsgi_warm),
+    ]
+
+    def run(self, repeat=3, only=None):
+        results = {}
+
+        for name, fn, setup in self.benchmarks:
+            if only and name not in only:
+                continue
+
+            if setup:
+                setup(self)
+
+            timings, ops = measure(lambda: fn(self), repeat)
+            results[name] = {
+                'best': min(timings),
+                'mean': sum(timings) / len(timings),
+                'ops': ops,
+            }
+            print_result(name, results[name])
+
+        return results
+
+
+def print_result(name, result, old=None):
+    line = '%-12s %10.4fs  %10.1f ops/s' % (name, result['best'], result['ops'] / result['best'])
+    if old:
+        change = (result['best'] - old['best']) / old['best'] * 100
+        line += '  (was %.4fs, %+.1f%%)' % (old['best'], change)
+    print line
+
+
+def compare(report, old_report):
+    print
+    print "Compared to %s:" % (old_report.get('revision') or 'previous report')
+    if old_report.get('params') != report.get('params'):
+        print "Warning: The reports were taken with different parameters."
+
+    for name, result in sorted(report['results'].iteritems()):
+        print_result(name, result, old_report['results'].get(name))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark Composer against a synthetic site.")
+    parser.add_argument('--posts', type=int, default=500)
+    parser.add_argument('--pages', type=int, default=50)
+    parser.add_argument('--static', type=int, default=200)
+    parser.add_argument('--code-blocks', type=int, default=2)
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-j', '--jobs', type=int, default=1)
+    parser.add_argument('--only', help="Comma-separated benchmarks to run.")
+    parser.add_argument('--site', help="Generate the site here and keep it, rather than in a temporary directory.")
+    parser.add_argument('--output', help="Write the report as JSON into this file.")
+    parser.add_argument('--compare', help="Compare with a report from a previous --output.")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+
+    params = {
+        'posts': args.posts,
+        'pages': args.pages,
+        'static': args.static,
+        'code_blocks': args.code_blocks,
+        'lookups': args.lookups,
+        'requests': args.requests,
+        'jobs': args.jobs,
+    }
+
+    path = args.site or tempfile.mkdtemp(prefix='composer-bench-')
+    cwd = os.getcwd()
+    try:
+        index_path = generate_site(path, num_posts=args.posts, num_pages=args.pages,
+                                   num_static=args.static, code_blocks=args.code_blocks)
+
+        # Layouts are looked up relative to the working directory.
+        os.chdir(path)
+
+        suite = Suite(index_path, os.path.join(path, 'build'), num_lookups=args.lookups,
+                      num_requests=args.requests, jobs=args.jobs)
+        results = suite.run(repeat=args.repeat, only=args.only and args.only.split(','))
+    finally:
+        os.chdir(cwd)
+        if not args.site:
+            shutil.rmtree(path)
+
+    report = {
+        'revision': get_revision(),
+        'python': platform.python_version(),
+        'params': params,
+        'results': results,
+    }
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(report, json.load(fp))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,308 @@
+# composer/cache.py
+# Copyright 2011 Andrey Petrov
+#
+# This module is part of Composer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+_file_mode = None
+
+
+def makedirs(path):
+    """
+    Create the directory ``path`` and its parents unless it exists, which
+    it's fine for another process to do at the same time.
+    """
+    if os.path.isdir(path):
+        return
+
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
+
+def _get_file_mode():
+    # Temporary files are created private, give them the usual mode.
+    global _file_mode
+    if _file_mode is None:
+        umask = os.umask(0)
+        os.umask(umask)
+        _file_mode = 0666 & ~umask
+    return _file_mode
+
+
+class _Unchanged(Exception):
+    pass
+
+
+@contextmanager
+def atomic_file(path, times=None):
+    """
+    Open a temporary file next to ``path`` for writing and rename it to
+    ``path`` once the block is done, so that nobody (such as another process
+    sharing a cache) ever sees a partial file. Nothing is changed if the
+    block raises.
+
+    :param times:
+        ``(atime, mtime)`` to give the file.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.composer-')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            yield fp
+
+        os.chmod(tmp_path, _get_file_mode())
+        if times:
+            os.utime(tmp_path, times)
+        os.rename(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+def atomic_write(path, data, skip_unchanged=False, times=None):
+    """
+    Write ``data`` into ``path`` through ``atomic_file``.
+
+    :param data:
+        Byte string or iterable of byte strings, which are written as they
+        come so they can be rendered lazily.
+
+    :param skip_unchanged:
+        Compare with the existing file while writing, and leave it as it is
+        if it's identical.
+
+    :returns: False if the file was unchanged, otherwise True.
+    """
+    if isinstance(data, basestring):
+        data = [data]
+
+    existing = None
+    if skip_unchanged:
+        try:
+            existing = open(path, 'rb')
+        except IOError:
+            pass
+
+    try:
+        with atomic_file(path, times) as fp:
+            is_same = existing is not None
+            for chunk in data:
+                fp.write(chunk)
+                if is_same:
+                    is_same = existing.read(len(chunk)) == chunk
+
+            if is_same and existing.read(1) == '':
+                raise _Unchanged()
+    except _Unchanged:
+        return False
+    finally:
+        if existing:
+            existing.close()
+
+    return True
+
+
+def content_key(*parts):
+    """
+    Hex digest of the given strings, suitable for content-addressed caching.
+    Unicode parts are utf8-encoded first.
+    """
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode('utf8')
+        h.update(part)
+        h.update('\0')
+    return h.hexdigest()
+
+
+def hash_object(o):
+    """
+    Stable digest of a JSON-able object (such as a Route context or a filter's
+    kwargs). Unserializable values fall back to their ``repr``.
+    """
+    s = json.dumps(o, sort_keys=True, default=repr)
+    return hashlib.sha1(s).hexdigest()
+
+
+class LRUCache(object):
+    """
+    Thread-safe in-memory cache which holds up to ``maxsize`` items, evicting
+    the least recently used item first.
+
+    The ``hits`` and ``misses`` counters are updated by ``get``.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class DiskCache(object):
+    """
+    Content-addressed cache of strings stored as files under ``path``, holding
+    up to ``max_size`` bytes and evicting the least recently used entries
+    first.
+
+    Entries are written atomically so several processes can share the same
+    ``path``, though each only evicts based on what it has seen. Unicode and
+    byte strings are both preserved.
+    """
+    def __init__(self, path, max_size=256*1024*1024):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict() # key -> size, oldest first
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self._scan()
+
+    def __getstate__(self):
+        # Other processes get their own view of the same directory.
+        return {'path': self.path, 'max_size': self.max_size}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _scan(self):
+        if not os.path.exists(self.path):
+            makedirs(self.path)
+            return
+
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for filename in filenames:
+                if filename.startswith(('.composer-', 'tmp')): # Being written.
+                    continue
+                stat = os.stat(os.path.join(dirpath, filename))
+                entries.append((stat.st_mtime, filename, stat.st_size))
+
+        for mtime, key, size in sorted(entries):
+            self._entries[key] = size
+            self._size += size
+
+    def _key_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key, default=None):
+        path = self._key_path(key)
+
+        try:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+            os.utime(path, None)
+        except (IOError, OSError):
+            with self._lock:
+                self.misses += 1
+                self._size -= self._entries.pop(key, 0)
+            return default
+
+        with self._lock:
+            self.hits += 1
+            self._entries[key] = self._entries.pop(key, len(data))
+
+        kind, data = data[:1], data[1:]
+        if kind == 'u':
+            return data.decode('utf8')
+        return data
+
+    def set(self, key, value):
+        if isinstance(value, unicode):
+            data = 'u' + value.encode('utf8')
+        else:
+            data = 'b' + value
+
+        path = self._key_path(key)
+        makedirs(os.path.dirname(path))
+        atomic_write(path, data)
+
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._size += len(data)
+
+            while self._size > self.max_size and len(self._entries) > 1:
+                old_key, size = self._entries.popitem(last=False)
+                self._size -= size
+                try:
+                    os.remove(self._key_path(old_key))
+                except OSError:
+                    pass
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+
+        with self._lock:
+            self._size -= self._entries.pop(key, 0)
+            try:
+                os.remove(self._key_path(key))
+            except OSError:
+                pass
+
+        return value
+
+    def clear(self):
+        with self._lock:
+            for key in self._entries:
+                try:
+                    os.remove(self._key_path(key))
+                except OSError:
+                    pass
+
+            self._entries.clear()
+            self._size = 0
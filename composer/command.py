@@ -10,35 +10,407 @@ import argparse
 import logging
 import os
 import json
+import sys
+import traceback
 
+from contextlib import contextmanager
+
+from .cache import DiskCache
 from .index import Index, import_object
-from .server import serve
+from .profiler import Profiler
 
 
 log = logging.getLogger(__name__)
 
-def serve_command(index, **kw):
-    serve(index, use_reloader=True, **kw)
+def _guess_index_type(index_path, index_type='auto'):
+    if index_type != 'auto':
+        return index_type
+
+    log.debug("Unspecified index type, trying to guess based on value provided: %s", index_path)
+
+    if index_path.endswith('json'):
+        return 'json'
+
+    if index_path.endswith(('.sqlite', '.db')):
+        return 'sqlite'
+
+    if ':' in index_path:
+        return 'object'
+
+    raise ValueError("Couldn't guess the type of index: %s" % index_path)
+
+
+def load_index(index_path, index_type='auto', base_path=None, reload_module=False):
+    """
+    Load an Index from a JSON file, a sqlite file (see ``Index.to_sqlite``) or
+    from a Python object path like ``foo.bar:MyIndex``.
+
+    :param reload_module:
+        Reload the Python module of an object index if it was already
+        imported.
+
+    :raises ValueError: If ``index_type`` is 'auto' and the type can't be
+        guessed from ``index_path``.
+    """
+    index_type = _guess_index_type(index_path, index_type)
+
+    if index_type == 'json':
+        log.debug("Loading index from json.")
+
+        data = json.load(open(index_path))
+        if base_path is None:
+            base_path = os.path.dirname(index_path)
+        return Index.from_dict(data, base_path=base_path)
+
+    if index_type == 'sqlite':
+        log.debug("Loading index from sqlite.")
+
+        if base_path is None:
+            base_path = os.path.dirname(index_path)
+        return Index.from_sqlite(index_path, base_path=base_path)
+
+    if index_type == 'object':
+        log.debug("Loading index from Python object.")
+
+        module = index_path.split(':', 1)[0]
+        if reload_module and module in sys.modules:
+            reload(sys.modules[module])
+
+        IndexCls = import_object(index_path)
+        if base_path is None:
+            base_path = os.path.curdir
+        return IndexCls(base_path=base_path)
+
+    raise ValueError("Unknown index type: %s" % index_type)
+
+
+def _get_index_source(index_path, index_type='auto', base_path=None):
+    """
+    Path of the file which an index is loaded from, the module's source file
+    for object indexes.
+    """
+    if _guess_index_type(index_path, index_type) != 'object':
+        return index_path
+
+    module = sys.modules[index_path.split(':', 1)[0]]
+    return os.path.splitext(module.__file__)[0] + '.py'
+
+
+def serve_command(index, watch=False, index_args=None, **kw):
+    from .server import serve
+
+    if not watch:
+        return serve(index, use_reloader=True, **kw)
+
+    reload_index = lambda: load_index(*index_args, reload_module=True)
+    reload_paths = [_get_index_source(*index_args)]
+
+    serve(index, use_reloader=False, watch=True, reload_index=reload_index, reload_paths=reload_paths, **kw)
+
+
+# Build workers rebuild their own Index once and keep it around for all the
+# batches of routes they get handed.
+_worker_writer = None
+_worker_profiler = None
+
+
+def _init_build_worker(index_args, build_path, writer_kw, profile):
+    global _worker_writer, _worker_profiler
+    from .writer import FileWriter
+
+    index = load_index(*index_args)
+    _worker_writer = FileWriter(index, build_path=build_path, **writer_kw)
+
+    if profile:
+        _worker_profiler = Profiler()
+        _worker_writer.subscribe(_worker_profiler)
+
+
+def _build_worker_batch(routes):
+    dependencies = _worker_writer.index.dependencies
+    _worker_writer.num_written = _worker_writer.num_skipped = _worker_writer.num_compressed = 0
+
+    results = []
+    for route in routes:
+        try:
+            _worker_writer.materialize_route(route)
+            results.append((route.url, None, list(dependencies.get_dependencies(route.url))))
+        except Exception:
+            results.append((route.url, traceback.format_exc(), None))
+
+    _worker_writer.flush()
+
+    profile = None
+    if _worker_profiler:
+        profile = _worker_profiler.to_dict()
+        _worker_profiler.reset()
+
+    return results, _worker_writer.num_written, _worker_writer.num_skipped, _worker_writer.num_compressed, profile
+
+
+def _iter_batches(items, size):
+    for i in xrange(0, len(items), size):
+        yield items[i:i+size]
+
+
+def _build_parallel(routes, writer, jobs, index_args, writer_kw, profiler=None):
+    """
+    Render ``routes`` across a pool of ``jobs`` worker processes. The number
+    of files the workers wrote, skipped and compressed are added to
+    ``writer``'s counts, and their timings to ``profiler``.
+
+    :returns: Iterator of ``(url, error, dependencies)`` tuples where
+        ``error`` is None or the formatted traceback of a failed render.
+    """
+    import multiprocessing
+
+    batch_size = max(1, min(100, len(routes) // (jobs * 4)))
+
+    log.info("Rendering %d routes with %d workers.", len(routes), jobs)
+
+    pool = multiprocessing.Pool(jobs, _init_build_worker, (index_args, writer.build_path, writer_kw, bool(profiler)))
+    try:
+        batches = _iter_batches(routes, batch_size)
+        for results, num_written, num_skipped, num_compressed, profile in pool.imap_unordered(_build_worker_batch, batches):
+            writer.num_written += num_written
+            writer.num_skipped += num_skipped
+            writer.num_compressed += num_compressed
+            if profile:
+                profiler.merge(profile)
+            for r in results:
+                yield r
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _encodings_arg(value):
+    from .compress import get_encodings
+
+    try:
+        return get_encodings(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def _shard_arg(value):
+    from .shard import parse_shard
+
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+@contextmanager
+def _null_phase(name):
+    yield
 
 
-def build_command(index, build_path='build', clean=False):
-    from distutils.dir_util import copy_tree, remove_tree
+def _sync_static(index, writer, static_mode='copy', static_jobs=4, state_path=None):
+    from .sync import StaticSync
+
+    static_sync = StaticSync(mode=static_mode, jobs=static_jobs, state_path=state_path)
+    for static in index.static:
+        log.info("Syncing static url: %s", static.url)
+        url_path = writer.materialize_url(static.url)
+        static_sync.sync(static.file, url_path)
+
+    log.info("Static files: %d updated, %d unchanged, %d removed.",
+             static_sync.num_copied, static_sync.num_skipped, static_sync.num_removed)
+
+
+def build_command(index, build_path='build', clean=False, incremental=False, jobs=1, index_args=None,
+                  static_mode='copy', static_jobs=4, profiler=None, shard=None, state_path=None,
+                  **writer_kw):
+    """
+    :param jobs:
+        Number of worker processes to render routes with.
+
+    :param static_mode:
+        How to sync static files into the build, one of 'copy', 'link' or
+        'reflink'. See ``StaticSync``.
+
+    :param static_jobs:
+        Number of threads to sync static files with.
+
+    :param profiler:
+        ``Profiler`` to record the timings of the build into.
+
+    :param shard:
+        ``(shard, num_shards)`` to only build the routes of that shard (see
+        ``composer.shard.get_shard``) and record them for ``merge_command``.
+        Static files are left to the merge.
+
+    :param index_args:
+        Arguments for ``load_index`` which each worker uses to rebuild the
+        Index. Required when ``jobs`` is more than 1.
+
+    :param state_path:
+        Directory to keep the bookkeeping of the build in, such as the
+        manifest of incremental builds. Defaults to a directory next to
+        ``build_path`` (see ``composer.manifest.get_state_path``).
+
+    Remaining keyword arguments are passed to the ``FileWriter``.
+
+    :returns: List of ``(url, error)`` tuples for routes which failed to
+        render, where ``error`` is the formatted traceback.
+    """
+    from distutils.dir_util import remove_tree
+    from .manifest import BuildManifest, get_state_path
+    from .shard import ShardRecord, get_shard
     from .writer import FileWriter
 
+    if jobs > 1 and not index_args:
+        raise ValueError("Building with multiple jobs requires index_args to rebuild the index in each worker.")
+
+    if state_path is None:
+        state_path = get_state_path(build_path)
+
     if clean:
         log.info("Cleaning build path: %s", build_path)
-        if os.path.exists(build_path):
-            remove_tree(build_path)
+        for path in [build_path, state_path]:
+            if os.path.exists(path):
+                remove_tree(path)
+
+    writer = FileWriter(index, build_path=build_path, **writer_kw)
+
+    routes = index.routes
+    phase = _null_phase
+    if profiler:
+        writer.subscribe(profiler)
+        routes = profiler.iter_phase('index', routes)
+        phase = profiler.phase
+
+    if shard:
+        log.info("Building shard %d/%d.", *shard)
+        routes = (route for route in routes if get_shard(route.url, shard[1]) == shard[0])
+
+    manifest = None
+    if incremental:
+        manifest = BuildManifest(os.path.join(state_path, BuildManifest.filename),
+                                 legacy_path=os.path.join(build_path, BuildManifest.legacy_filename))
+
+    urls = []
+    pending = []
+    failures = []
+    num_skipped = 0
+    num_removed = 0
+
+    try:
+        for route in routes:
+            urls.append(route.url)
+
+            file_path = writer.get_file_path(route.url)
+            if manifest is not None and manifest.is_current(route, index, file_path):
+                log.debug("Skipping unchanged route: %s", route.url)
+                num_skipped += 1
+                writer.compress_file(file_path, only_missing=True)
+                continue
+
+            if jobs > 1:
+                pending.append(route)
+                continue
+
+            try:
+                file_path = writer.materialize_route(route)
+            except Exception:
+                failures.append((route.url, traceback.format_exc()))
+                continue
+
+            if manifest is not None:
+                manifest.update(route, index, file_path, index.dependencies.get_dependencies(route.url))
+
+        if pending:
+            pending_routes = dict((route.url, route) for route in pending)
+
+            for url, error, dependencies in _build_parallel(pending, writer, jobs, index_args, writer_kw, profiler):
+                if error:
+                    failures.append((url, error))
+                    continue
+
+                route = pending_routes[url]
+                index.dependencies.set(url, dependencies)
+                if manifest is not None:
+                    manifest.update(route, index, writer.get_file_path(url), dependencies)
+
+        if manifest is not None:
+            num_removed = len(manifest.remove_stale(urls))
+
+        with phase('compress'):
+            writer.flush()
+
+    finally:
+        if manifest is not None:
+            manifest.save()
+            log.info("Skipped %d unchanged routes out of %d.", num_skipped, len(urls))
+
+    log.info("Wrote %d files, skipped %d identical files, removed %d stale files.",
+             writer.num_written, writer.num_skipped, num_removed)
+    if writer.compress:
+        log.info("Compressed %d files with %s.", writer.num_compressed, ', '.join(writer.compress))
+
+    if failures:
+        log.error("Failed to render %d out of %d routes:", len(failures), len(urls))
+        for url, error in failures:
+            log.error("Failed route: %s\n%s", url, error)
+
+    if shard:
+        failed_urls = set(url for url, error in failures)
+        outputs = dict((url, os.path.relpath(writer.get_file_path(url), build_path))
+                       for url in urls if url not in failed_urls)
+        ShardRecord(shard[0], shard[1], outputs).save(build_path)
+        return failures
+
+    with phase('static'):
+        _sync_static(index, writer, static_mode, static_jobs, state_path)
+
+    return failures
+
+
+def merge_command(index, shard_paths, build_path='build', clean=False, static_mode='copy', static_jobs=4,
+                  state_path=None):
+    """
+    Put the outputs of sharded builds (see ``build_command``) together into
+    ``build_path`` along with the static files, after checking that every
+    route of the index was built by exactly one shard.
+
+    :param static_mode:
+        How to put files into the build, one of 'copy', 'link' or 'reflink'.
+        Links are the fastest when the shards are on the same filesystem.
+
+    :param state_path:
+        Directory to keep the bookkeeping of the build in (see
+        ``build_command``).
+
+    :raises composer.shard.ShardError: If the shards can't be merged.
+    """
+    from distutils.dir_util import remove_tree
+    from .manifest import get_state_path
+    from .shard import merge_shards
+    from .sync import StaticSync
+    from .writer import FileWriter
+
+    if state_path is None:
+        state_path = get_state_path(build_path)
+
+    if clean:
+        log.info("Cleaning build path: %s", build_path)
+        for path in [build_path, state_path]:
+            if os.path.exists(path):
+                remove_tree(path)
 
     writer = FileWriter(index, build_path=build_path)
 
-    for route in index.routes:
-        writer(route.url)
+    sync = StaticSync(mode=static_mode, jobs=static_jobs)
+    merge_shards(index, shard_paths, build_path, sync)
+    log.info("Merged %d shards: %d files updated, %d unchanged.",
+             len(shard_paths), sync.num_copied, sync.num_skipped)
 
-    for static in index.static:
-        log.info("Copying static url: %s", static.url)
-        url_path = writer.materialize_url(static.url)
-        copy_tree(static.file, url_path)
+    _sync_static(index, writer, static_mode, static_jobs, state_path)
 
 
 def main():
@@ -59,20 +431,112 @@ def main():
     serve_parser.add_argument('--port', dest='serve_port', metavar='PORT', default=8080, type=int,
                               help='(Default: %(default)s)')
 
+    serve_parser.add_argument('--watch', dest='watch', action='store_true',
+                              help="Apply file changes from within the server instead of restarting "
+                                   "it, only reloading the index when the index file or indexer "
+                                   "module changes.")
+
+    serve_parser.add_argument('--watch-exclude', dest='watch_exclude', metavar='GLOB', action='append',
+                              default=[],
+                              help="Glob of files to ignore while watching, relative to the index's "
+                                   "base path (such as 'build/*'). Can be given more than once.")
+
+    serve_parser.add_argument('--stream', dest='stream', action='store_true',
+                              help="Send pages as they're rendered instead of rendering them whole "
+                                   "first. Useful for very large pages.")
+
+    serve_parser.add_argument('--workers', dest='workers', metavar='N', default=0, type=int,
+                              help="Handle requests concurrently, rendering up to N routes at a "
+                                   "time. (Default: one request at a time)")
+
     # Build:
 
     build_parser = command_parser.add_parser('build',
                                              help="Compose the index into a static build of the website, ready for deploying.")
 
-    build_parser.add_argument('--build-path', dest='build_path', metavar="DIR", default='./build',
-                              help="Path to build into. (Default: %(default)s)")
+    build_parser.add_argument('--incremental', dest='incremental', action='store_true',
+                              help="Skip routes whose inputs haven't changed since the last "
+                                   "build and remove outputs of routes which are gone.")
+
+    build_parser.add_argument('--atomic', dest='atomic', action='store_true',
+                              help="Write files through a temporary file and rename, so "
+                                   "interrupted builds never leave partial files.")
+
+    build_parser.add_argument('--skip-unchanged', dest='skip_unchanged', action='store_true',
+                              help="Don't rewrite output files whose content is identical, "
+                                   "preserving their mtime.")
 
-    build_parser.add_argument('--clean', dest='clean', action='store_true',
-                              help='Delete contents of build path before building into it.')
+    build_parser.add_argument('-j', '--jobs', dest='jobs', metavar='N', default=1, type=int,
+                              help="Number of worker processes to render routes with. (Default: %(default)s)")
 
-    # Both:
+    build_parser.add_argument('--shard', dest='shard', metavar='K/N', type=_shard_arg,
+                              help="Only build the K-th of N shards of the routes (by a stable hash "
+                                   "of their url), to be put together with `merge`. Static files "
+                                   "are left to the merge.")
+
+    # Merge:
+
+    merge_parser = command_parser.add_parser('merge',
+                                             help="Put the outputs of sharded builds together into a complete build.")
+
+    merge_parser.set_defaults(profile=False, profile_output=None, render_cache_path=None)
+
+    # Build and merge:
+
+    for p in [build_parser, merge_parser]:
+        p.add_argument('--build-path', dest='build_path', metavar="DIR", default='./build',
+                       help="Path to build into. (Default: %(default)s)")
+
+        p.add_argument('--clean', dest='clean', action='store_true',
+                       help='Delete contents of build path before building into it.')
+
+        p.add_argument('--state-path', dest='state_path', metavar='DIR',
+                       help="Path to keep the bookkeeping of builds in, such as the manifest "
+                            "of --incremental and records of synced static files. (Default: BUILD_PATH's name in a .composer-state "
+                            "directory next to it)")
+
+        p.add_argument('--static-mode', dest='static_mode', default='copy',
+                       choices=['copy', 'link', 'reflink'],
+                       help="How to put changed static files into the build path: copy "
+                            "them, hard link them or make copy-on-write reflinks. "
+                            "(Default: %(default)s)")
+
+        p.add_argument('--static-jobs', dest='static_jobs', metavar='N', default=4, type=int,
+                       help="Number of threads to sync static files with. (Default: %(default)s)")
+
+    build_parser.add_argument('--compress-jobs', dest='compress_jobs', metavar='N', default=4, type=int,
+                              help="Number of threads to compress files with. (Default: %(default)s)")
+
+    # Serve and build:
 
     for p in [serve_parser, build_parser]:
+        p.add_argument('--profile', dest='profile', action='store_true',
+                       help="Time each phase, route and filter and log the slowest ones "
+                            "when done.")
+
+        p.add_argument('--profile-top', dest='profile_top', metavar='N', default=10, type=int,
+                       help="Number of slowest routes and filters to log. (Default: %(default)s)")
+
+        p.add_argument('--profile-output', dest='profile_output', metavar='FILE',
+                       help="Write the full profile into FILE, as CSV if it ends with .csv or "
+                            "else as JSON.")
+
+        p.add_argument('--render-cache', dest='render_cache_path', metavar='DIR',
+                       help="Memoize the output of pure filters (like markdown and pygments) "
+                            "in this directory across runs.")
+
+        p.add_argument('--compress', dest='compress', metavar='ENCODINGS', default=(), type=_encodings_arg,
+                       help="Comma-separated Content-Encodings to precompress pages with, "
+                            "like 'gzip,br'. Builds write them next to each page (like "
+                            "index.html.gz), the server sends them to clients which accept "
+                            "them. br and zstd need the brotli and zstandard packages.")
+
+        p.add_argument('--render-cache-size', dest='render_cache_size', metavar='MB', default=256, type=int,
+                       help="Size limit of the render cache. (Default: %(default)s)")
+
+    # All:
+
+    for p in [serve_parser, build_parser, merge_parser]:
         p.add_argument(dest='index_path', metavar="INDEX",
                        help="")
 
@@ -80,11 +544,14 @@ def main():
                        help="Treat relative paths in the Index from this path. (Default: Path of json index file or cwd when index type is object)")
 
         p.add_argument('--index-type', dest='index_type', default='auto',
-                       choices=['auto', 'json', 'object'],
+                       choices=['auto', 'json', 'sqlite', 'object'],
                        help="How to interpret the INDEX value. 'auto' will try "
-                            "to guess, 'object' is a Python dotted object path "
+                            "to guess, 'sqlite' is a database written by "
+                            "Index.to_sqlite, 'object' is a Python dotted object path "
                             "like 'foo.bar:MyIndex'. (Default: %(default)s)")
 
+    merge_parser.add_argument(dest='shard_paths', metavar='SHARD_PATH', nargs='+',
+                              help="Build paths of all the shards.")
 
     args = parser.parse_args()
 
@@ -94,36 +561,55 @@ def main():
     if args.verbose > 0:
         log.setLevel(logging.DEBUG)
 
-    # FIXME: Make this next part prettier.
-
-    extra_files = []
-
-    if args.index_type == 'auto':
-        log.debug("Unspecified index type, trying to guess based on value provided: %s", args.index_path)
-
-    if args.index_type == 'json' or args.index_path.endswith('json'): # JSON
-        log.debug("Loading index from json.")
-
-        data = json.load(open(args.index_path))
-        base_path = os.path.dirname(args.index_path)
-        index = Index.from_dict(data, base_path=base_path)
-        extra_files += [base_path]
-
-    elif args.index_type == 'object' or ':' in args.index_path: # Object
-        log.debug("Loading index from Python object.")
-
-        IndexCls = import_object(args.index_path)
-        index = IndexCls(base_path=os.path.curdir)
-
-    else:
+    index_args = (args.index_path, args.index_type, args.base_path)
+    try:
+        index = load_index(*index_args)
+    except ValueError:
         parser.error("Couldn't guess the type of your index file, try specifying `--index-type`.")
 
+    render_cache = None
+    if args.render_cache_path:
+        render_cache = DiskCache(args.render_cache_path, max_size=args.render_cache_size * 1024 * 1024)
+
+    profiler = None
+    if args.profile or args.profile_output:
+        profiler = Profiler()
 
+    failures = None
     if args.command == 'serve':
-        serve_command(index, extra_files=[args.index_path], host=args.serve_host, port=args.serve_port)
+        serve_command(index, extra_files=[args.index_path], host=args.serve_host, port=args.serve_port,
+                      render_cache=render_cache, watch=args.watch, index_args=index_args,
+                      stream=args.stream, workers=args.workers, compress=args.compress,
+                      profiler=profiler, watch_exclude=args.watch_exclude)
 
     elif args.command == 'build':
-        build_command(index, build_path=args.build_path, clean=args.clean)
+        failures = build_command(index, build_path=args.build_path, clean=args.clean,
+                                 incremental=args.incremental, jobs=args.jobs, index_args=index_args,
+                                 static_mode=args.static_mode, static_jobs=args.static_jobs,
+                                 profiler=profiler, render_cache=render_cache, atomic=args.atomic,
+                                 skip_unchanged=args.skip_unchanged, shard=args.shard,
+                                 compress=args.compress, compress_jobs=args.compress_jobs,
+                                 state_path=args.state_path)
+
+    elif args.command == 'merge':
+        from .shard import ShardError
+
+        try:
+            merge_command(index, args.shard_paths, build_path=args.build_path, clean=args.clean,
+                          static_mode=args.static_mode, static_jobs=args.static_jobs,
+                          state_path=args.state_path)
+        except ShardError as e:
+            log.error("%s", e)
+            sys.exit(1)
+
+    if profiler and profiler.phases:
+        log.info("Profile:\n%s", profiler.report(top=args.profile_top))
+        if args.profile_output:
+            profiler.write(args.profile_output)
+            log.info("Wrote profile: %s", args.profile_output)
+
+    if failures:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,117 @@
+# composer/compress.py
+# Copyright 2011 Andrey Petrov
+#
+# This module is part of Composer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import gzip
+import io
+
+from .filters import is_available
+
+
+def gzip_compress(data):
+    buf = io.BytesIO()
+    # No mtime so that the same content always compresses to the same bytes.
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0) as fp:
+        fp.write(data)
+    return buf.getvalue()
+
+
+def brotli_compress(data):
+    import brotli
+    return brotli.compress(data)
+
+
+def zstd_compress(data):
+    import zstandard
+    return zstandard.ZstdCompressor(level=19).compress(data)
+
+
+# Content-Encoding -> (file extension, compress function, required package)
+ENCODINGS = {
+    'gzip': ('.gz', gzip_compress, None),
+    'br': ('.br', brotli_compress, 'brotli'),
+    'zstd': ('.zst', zstd_compress, 'zstandard'),
+}
+
+EXTENSIONS = tuple(ext for ext, _, _ in ENCODINGS.itervalues())
+
+COMPRESSIBLE_TYPES = set([
+    'application/atom+xml',
+    'application/javascript',
+    'application/json',
+    'application/rss+xml',
+    'application/vnd.ms-fontobject',
+    'application/wasm',
+    'application/x-font-ttf',
+    'application/x-javascript',
+    'application/xhtml+xml',
+    'application/xml',
+    'font/otf',
+    'font/ttf',
+    'image/svg+xml',
+    'image/x-icon',
+])
+
+
+def is_compressible(content_type):
+    if not content_type:
+        return False
+
+    return content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES
+
+
+def get_encodings(names):
+    """
+    Validate a list (or comma-separated string) of encoding names like
+    'gzip,br' and return them as a tuple.
+
+    :raises ValueError: If an encoding is unknown or its package isn't
+        installed.
+    """
+    if isinstance(names, basestring):
+        names = [name.strip() for name in names.split(',') if name.strip()]
+
+    for name in names:
+        if name not in ENCODINGS:
+            raise ValueError("Unknown encoding: %s (Choose from: %s)" % (name, ', '.join(sorted(ENCODINGS))))
+
+        package = ENCODINGS[name][2]
+        if package and not is_available(package):
+            raise ValueError("The %s encoding requires the '%s' package to be installed." % (name, package))
+
+    return tuple(names)
+
+
+def compress(data, encoding):
+    return ENCODINGS[encoding][1](data)
+
+
+def choose_encoding(accept_encoding, encodings):
+    """
+    Get the first of ``encodings`` which the ``Accept-Encoding`` header value
+    allows, or None.
+    """
+    if not accept_encoding:
+        return None
+
+    accepted = {}
+    for part in accept_encoding.split(','):
+        params = part.strip().split(';')
+        q = 1.0
+        for param in params[1:]:
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[params[0].strip().lower()] = q
+
+    for encoding in encodings:
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > 0:
+            return encoding
+
+    return None
@@ -0,0 +1,87 @@
+# composer/deps.py
+# Copyright 2011 Andrey Petrov
+#
+# This module is part of Composer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import os
+import threading
+
+from contextlib import contextmanager
+
+
+_local = threading.local()
+
+
+def record(path):
+    """
+    Record ``path`` as a dependency of the route currently being rendered in
+    this thread, if any. Filters should call this for every file they read
+    (templates, includes, data files).
+    """
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        stack[-1].add(os.path.abspath(path))
+
+
+@contextmanager
+def recording(paths=None):
+    """
+    Collect the paths passed to ``record`` within the block into a set, or
+    into ``paths`` if given.
+    """
+    stack = _local.__dict__.setdefault('stack', [])
+    if paths is None:
+        paths = set()
+    stack.append(paths)
+    try:
+        yield paths
+    finally:
+        stack.pop()
+
+
+class DependencyGraph(object):
+    """
+    Which files each route url was rendered from, and in reverse, which route
+    urls depend on each file.
+    """
+    def __init__(self):
+        self._dependencies = {} # url -> frozenset of paths
+        self._dependents = {} # path -> set of urls
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._dependencies)
+
+    def set(self, url, paths):
+        paths = frozenset(os.path.abspath(p) for p in paths)
+
+        with self._lock:
+            self._remove(url)
+            self._dependencies[url] = paths
+            for path in paths:
+                self._dependents.setdefault(path, set()).add(url)
+
+    def _remove(self, url):
+        for path in self._dependencies.pop(url, ()):
+            urls = self._dependents.get(path)
+            urls.discard(url)
+            if not urls:
+                del self._dependents[path]
+
+    def remove(self, url):
+        with self._lock:
+            self._remove(url)
+
+    def get_dependencies(self, url):
+        return self._dependencies.get(url, frozenset())
+
+    def get_dependents(self, paths):
+        """
+        Get the set of urls which depend on any of the given paths.
+        """
+        urls = set()
+        with self._lock:
+            for path in paths:
+                urls.update(self._dependents.get(os.path.abspath(path), ()))
+        return urls
@@ -4,41 +4,68 @@
 # This module is part of Composer and is released under
 # the MIT License: http://www.opensource.org/licenses/mit-license.php
 
+import logging
 import os
+import pkgutil
 import re
+import threading
+import types
 
+from . import deps
+from .cache import DiskCache, LRUCache, atomic_file, atomic_write, content_key, makedirs
 
-try:
-    import markdown
-except ImportError:
-    markdown = False
 
-try:
-    import mako.lookup
-    import mako.template
-except ImportError:
-    mako = False
+log = logging.getLogger(__name__)
 
-try:
-    import docutils.core
-except ImportError:
-    docutils = False
 
-try:
-    import jinja2
-except ImportError:
-    jinja2 = False
+def is_available(package):
+    "Check whether ``package`` can be imported, without importing it."
+    try:
+        return pkgutil.find_loader(package) is not None
+    except ImportError:
+        return False
 
-try:
-    import pygments
-    import pygments.lexers
-    import pygments.formatters
-except ImportError:
-    pygments = False
+
+class _LazyModule(object):
+    """
+    Stand-in for an optional backend package which is only imported (along
+    with the given submodules) once one of its attributes is used, so that
+    importing the filters doesn't import every backend. It's true if the
+    package is installed.
+    """
+    def __init__(self, name, *submodules):
+        self._name = name
+        self._submodules = submodules
+        self._is_available = None
+
+    def __nonzero__(self):
+        if self._is_available is None:
+            self._is_available = is_available(self._name)
+        return self._is_available
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+
+        module = __import__(self._name)
+        for name in self._submodules:
+            __import__(name)
+
+        value = getattr(module, attr)
+        setattr(self, attr, value) # Skip __getattr__ from now on.
+        return value
+
+
+markdown = _LazyModule('markdown')
+markdown2 = _LazyModule('markdown2')
+mako = _LazyModule('mako', 'mako.codegen', 'mako.lookup', 'mako.runtime', 'mako.template')
+docutils = _LazyModule('docutils', 'docutils.core')
+jinja2 = _LazyModule('jinja2')
+pygments = _LazyModule('pygments', 'pygments.lexers', 'pygments.formatters')
 
 
 __all__ = ['Filter',
-           'Mako', 'MakoContainer', 'Jinja2',
+           'Mako', 'MakoContainer', 'Jinja2', 'Jinja2Container',
            'RestructuredText', 'Markdown',
            'Pygments']
 
@@ -46,7 +73,103 @@ __all__ = ['Filter',
 _Default = object()
 
 
+def join_chunks(chunks):
+    """
+    Join an iterable of chunks of content into one string, decoding utf8 byte
+    strings if they're mixed with unicode ones.
+    """
+    chunks = list(chunks)
+    if len(chunks) == 1:
+        return chunks[0]
+
+    if any(isinstance(chunk, unicode) for chunk in chunks):
+        return u''.join(chunk.decode('utf8') if isinstance(chunk, str) else chunk for chunk in chunks)
+
+    return ''.join(chunks)
+
+
+class _ChunkBuffer(list):
+    "Mako output buffer which keeps the rendered fragments as they are."
+    write = list.append
+
+
+_recording_classes = {}
+
+
+def _get_recording_lookup_class():
+    cls = _recording_classes.get('mako')
+    if cls is None:
+        class _RecordingTemplateLookup(mako.lookup.TemplateLookup):
+            "TemplateLookup which records the templates it loads as dependencies."
+
+            def get_template(self, uri):
+                t = super(_RecordingTemplateLookup, self).get_template(uri)
+                if t.filename:
+                    deps.record(t.filename)
+                return t
+
+        cls = _recording_classes['mako'] = _RecordingTemplateLookup
+
+    return cls
+
+
+def _get_recording_environment_class():
+    cls = _recording_classes.get('jinja2')
+    if cls is None:
+        class _RecordingEnvironment(jinja2.Environment):
+            "Environment which records the templates it loads as dependencies."
+
+            def _load_template(self, name, globals):
+                t = super(_RecordingEnvironment, self)._load_template(name, globals)
+                if t.filename:
+                    deps.record(t.filename)
+                return t
+
+        cls = _recording_classes['jinja2'] = _RecordingEnvironment
+
+    return cls
+
+
+def _get_atomic_bytecode_cache_class():
+    cls = _recording_classes.get('jinja2_bytecode_cache')
+    if cls is None:
+        class _AtomicBytecodeCache(jinja2.FileSystemBytecodeCache):
+            """
+            FileSystemBytecodeCache which writes through a tempfile, so that
+            concurrent builds sharing the directory never load partial
+            bytecode.
+            """
+            def dump_bytecode(self, bucket):
+                with atomic_file(self._get_cache_filename(bucket)) as fp:
+                    bucket.write_bytecode(fp)
+
+        cls = _recording_classes['jinja2_bytecode_cache'] = _AtomicBytecodeCache
+
+    return cls
+
+
 class Filter(object):
+    """
+    Filters which are ``pure`` promise that their output depends only on the
+    content and their own kwargs (not on the route or the index), which lets
+    the Writer memoize them in its ``render_cache``.
+
+    Filters can also implement ``stream(chunks, route=None)``, which takes an
+    iterable of chunks of content and returns an iterable of chunks of output
+    (unicode or utf8 strings), so the Writer never holds their whole output
+    at once. Filters without it are given the joined content instead.
+
+    Filters list the optional packages they need in ``requires``, default
+    filters whose packages aren't installed aren't registered.
+
+    Filters which are ``binary`` work on utf8 byte strings rather than
+    unicode, so that routes whose filters are all binary are read from their
+    files without decoding them.
+    """
+    pure = False
+    binary = False
+    requires = ()
+
     def __init__(self, index):
         self.index = index
 
@@ -62,20 +185,97 @@ class Filter(object):
 
 
 class Markdown(Filter):
-    def __init__(self, index, extensions=None, extension_configs=None):
-        if not markdown:
-            raise ImportError("Markdown filter requires the 'markdown' package to be installed.")
+    """
+    Render the content as Markdown.
+
+    Converters are expensive to create and aren't thread-safe, so each thread
+    (and so each build worker) keeps its own and resets it between documents,
+    so that state like reference links and footnotes doesn't leak from one
+    page into the next.
+
+    :param backend:
+        'markdown' for Python-Markdown (with ``extensions`` and
+        ``extension_configs``) or 'markdown2' for the faster markdown2 (with
+        ``extras``). Their output differs slightly.
+    """
+    pure = True
+    requires = ('markdown',)
+
+    backends = {
+        'markdown': markdown,
+        'markdown2': markdown2,
+    }
+
+    def __init__(self, index, extensions=None, extension_configs=None, backend='markdown', extras=None):
+        if backend not in self.backends:
+            raise ValueError("Unknown Markdown backend: %s (Choose from: %s)" % (backend, ', '.join(sorted(self.backends))))
+
+        if not self.backends[backend]:
+            raise ImportError("Markdown filter requires the '%s' package to be installed." % backend)
 
         super(Markdown, self).__init__(index)
 
-        self.converter = markdown.Markdown(extensions=extensions or [], extension_configs=extension_configs or {}).convert
+        self.backend = backend
+        self.markdown_kw = dict(extensions=extensions or [], extension_configs=extension_configs or {})
+        self.extras = extras or []
+        self._local = threading.local()
+
+    def _create_converter(self):
+        if self.backend == 'markdown2':
+            return markdown2.Markdown(extras=self.extras)
+
+        return markdown.Markdown(**self.markdown_kw)
+
+    @property
+    def converter(self):
+        "Converter of the current thread, created on first use."
+        md = getattr(self._local, 'md', None)
+        if md is None:
+            md = self._local.md = self._create_converter()
+        return md
+
+    def _convert(self, md, content):
+        if self.backend == 'markdown2':
+            # Resets itself, and returns a unicode subclass with extra attributes.
+            return unicode(md.convert(content))
+
+        try:
+            return md.convert(content)
+        finally:
+            md.reset()
+
+    def convert_many(self, contents):
+        """
+        Convert each of ``contents`` with the same converter.
+
+        :returns: List of the converted contents, in order.
+        """
+        md = self.converter
+        return [self._convert(md, content) for content in contents]
 
     def __call__(self, content, route=None):
-        return self.converter(content)
+        return self._convert(self.converter, content)
 
 
 class Mako(Filter):
-    def __init__(self, index, **template_kw):
+    """
+    Render the content as a Mako template.
+
+    Compiled templates are kept in ``template_cache``, an LRU cache of up to
+    ``template_cache_size`` templates keyed by the content and the lookup
+    configuration. If a ``module_directory`` is given (relative to the Index's
+    ``base_path``), the compiled modules of content templates are also kept
+    there (alongside those of the lookup's templates) so that later builds can
+    skip compiling them. It defaults to 'mako' in the Index's ``cache_path``,
+    if it has one.
+
+    Modules are written atomically, so builds can share the directory, and
+    recompiled when their template's mtime changes or when they were compiled
+    by another version of Mako.
+    """
+    requires = ('mako',)
+
+    def __init__(self, index, template_cache_size=256, **template_kw):
         if not mako:
             raise ImportError("Mako filter requires the 'Mako' package to be installed.")
 
@@ -83,15 +283,92 @@ class Mako(Filter):
 
         kw = dict(input_encoding='utf-8', output_encoding='utf-8', encoding_errors='replace')
         kw.update(template_kw)
+        kw['module_directory'] = kw.get('module_directory') and index.absolute_path(kw['module_directory']) or \
+            index.get_cache_path('mako')
+        if not kw['module_directory']:
+            del kw['module_directory']
 
         self.template_kw = kw
-        self.lookup = mako.lookup.TemplateLookup(**self.template_kw)
+        self.lookup = _get_recording_lookup_class()(**self.template_kw)
+
+        self.template_cache = LRUCache(template_cache_size)
+        self._config_key = repr(sorted(self.template_kw.items()))
+
+    def _load_module(self, module_path, key):
+        """
+        Load a compiled module without registering it in ``sys.modules``, so
+        that it's dropped along with its template from ``template_cache``.
+
+        :returns: The module, or None if it doesn't exist or was compiled by
+            another version of Mako.
+        """
+        try:
+            with open(module_path, 'rb') as fp:
+                source = fp.read()
+        except IOError:
+            return
+
+        module = types.ModuleType('_composer_mako_' + key)
+        module.__file__ = module_path
+        exec compile(source, module_path, 'exec') in module.__dict__
+
+        if getattr(module, '_magic_number', None) != mako.codegen.MAGIC_NUMBER:
+            log.debug("Recompiling Mako module of another version: %s", module_path)
+            return
+
+        return module
+
+    def _load_module_template(self, content, key):
+        module_directory = self.template_kw.get('module_directory')
+        template_kw = dict(lookup=self.lookup, output_encoding='utf-8', encoding_errors='replace')
+
+        module_path = os.path.join(module_directory, '_composer', key + '.py')
+        module = self._load_module(module_path, key)
+        if module is not None:
+            return mako.template.ModuleTemplate(module, **template_kw)
+
+        t = mako.template.Template(content, input_encoding='utf-8', **template_kw)
+
+        # Written atomically so that concurrent builds never see a partial
+        # module.
+        makedirs(os.path.dirname(module_path))
+        atomic_write(module_path, '# -*- coding: utf-8 -*-\n' + t.code)
+
+        return t
+
+    def get_template(self, content):
+        key = content_key(self._config_key, content)
+
+        t = self.template_cache.get(key)
+        if t is not None:
+            return t
+
+        if self.template_kw.get('module_directory'):
+            t = self._load_module_template(content, key)
+        else:
+            t = mako.template.Template(content, lookup=self.lookup, input_encoding='utf-8', output_encoding='utf-8', encoding_errors='replace')
+
+        self.template_cache.set(key, t)
+        return t
+
+    def _render_chunks(self, t, **data):
+        buf = _ChunkBuffer()
+        t.render_context(mako.runtime.Context(buf, **data))
+
+        # Same as the utf8 output of __call__, for filters which don't stream.
+        return [chunk.encode('utf8') if isinstance(chunk, unicode) else chunk for chunk in buf]
 
     def __call__(self, content, route=None):
-        t = mako.template.Template(content, lookup=self.lookup, input_encoding='utf-8', output_encoding='utf-8', encoding_errors='replace')
+        t = self.get_template(content)
 
         return str(t.render(index=self.index, route=route))
 
+    def stream(self, chunks, route=None):
+        # Mako can't render lazily, but keeping its output as fragments saves
+        # joining and encoding it into one more copy.
+        t = self.get_template(join_chunks(chunks))
+        return self._render_chunks(t, index=self.index, route=route)
+
 
 class MakoContainer(Mako):
     """
@@ -104,18 +381,26 @@ class MakoContainer(Mako):
 
         super(MakoContainer, self).__init__(index, **lookup_kw)
 
-        template = os.path.relpath(self.index.absolute_path(template), '.')
-
-        self.template = self.lookup.get_template(template)
+        self.template_uri = os.path.relpath(self.index.absolute_path(template), '.')
+        self.template = self.lookup.get_template(self.template_uri)
 
     def __call__(self, content, route=None):
-        return str(self.template.render(index=self.index, body=content, route=route, cache_enabled=False))
+        # Going through the lookup picks up changes to the template.
+        t = self.lookup.get_template(self.template_uri)
+        return str(t.render(index=self.index, body=content, route=route, cache_enabled=False))
+
+    def stream(self, chunks, route=None):
+        t = self.lookup.get_template(self.template_uri)
+        return self._render_chunks(t, index=self.index, body=join_chunks(chunks), route=route, cache_enabled=False)
 
 
 class RestructuredText(Filter):
     # FIXME: This is untested and probably not Best Practices compliant. Someone
     # who seriously uses RST should make this filter better.
 
+    pure = True
+    requires = ('docutils',)
+
     def __init__(self, index, **rst_kw):
         if not docutils:
             raise ImportError("RestructuredText filter requires the 'docutils' package to be installed.")
@@ -129,12 +414,24 @@ class RestructuredText(Filter):
 
 
 class Jinja2(Filter):
-    # FIXME: This is untested and probably not Best Practices compliant. Someone
-    # who seriously uses Jinja2 should make this filter better.
-
-    # TODO: Make a Jinja2Container version of this Filter (similar to MakoContainer)
+    """
+    Render the content as a Jinja2 template, with templates from
+    ``searchpaths`` available to extend and include.
+
+    Compiled templates are kept in ``template_cache``, an LRU cache of up to
+    ``template_cache_size`` templates keyed by the content. If a
+    ``bytecode_cache_path`` is given, the bytecode of content templates and of
+    the loaded templates is also kept there so that later builds can skip
+    compiling them. It defaults to 'jinja2' in the Index's ``cache_path``, if
+    it has one.
+
+    Bytecode is written atomically, so builds can share the directory, and
+    is only used for a template with the same source. Loaded templates are
+    reloaded when their mtime changes.
+    """
+    requires = ('jinja2',)
 
-    def __init__(self, index, searchpaths=None):
+    def __init__(self, index, searchpaths=None, template_cache_size=256, bytecode_cache_path=None):
         super(Jinja2, self).__init__(index)
 
         if not jinja2:
@@ -146,20 +443,96 @@ class Jinja2(Filter):
 
         # TODO: Add support for more loaders?
 
-        self.jinja_env = jinja2.Environment(loader=jinja2.ChoiceLoader(loaders))
+        bytecode_cache = None
+        bytecode_cache_path = bytecode_cache_path and index.absolute_path(bytecode_cache_path) or \
+            index.get_cache_path('jinja2')
+        if bytecode_cache_path:
+            makedirs(bytecode_cache_path)
+            bytecode_cache = _get_atomic_bytecode_cache_class()(bytecode_cache_path)
+
+        self.jinja_env = _get_recording_environment_class()(loader=jinja2.ChoiceLoader(loaders),
+                                                            bytecode_cache=bytecode_cache)
+
+        self.template_cache = LRUCache(template_cache_size)
+        self._config_key = repr(searchpaths)
+
+    def _load_string_template(self, content, key):
+        # Like jinja2.BaseLoader.load, which from_string skips.
+        env = self.jinja_env
+        bucket = env.bytecode_cache.get_bucket(env, key, None, content)
+        if bucket.code is None:
+            bucket.code = env.compile(content)
+            env.bytecode_cache.set_bucket(bucket)
+
+        return env.template_class.from_code(env, bucket.code, env.make_globals(None))
+
+    def get_template(self, content):
+        key = content_key(self._config_key, content)
+
+        t = self.template_cache.get(key)
+        if t is None:
+            if self.jinja_env.bytecode_cache is not None:
+                t = self._load_string_template(content, key)
+            else:
+                t = self.jinja_env.from_string(content)
+            self.template_cache.set(key, t)
+
+        return t
 
     def __call__(self, content, route=None):
-        t = self.jinja_env.from_string(content)
+        t = self.get_template(content)
         return t.render(index=self.index, route=route)
 
+    def stream(self, chunks, route=None):
+        t = self.get_template(join_chunks(chunks))
+        return t.generate(index=self.index, route=route)
+
+
+class Jinja2Container(Jinja2):
+    """
+    Similar to Jinja2 except it loads the template from a given ``template``
+    (relative to the Index's ``base_path``) and pipes the ``content`` into the
+    ``body`` context variable. Templates next to it can be extended and
+    included by name.
+    """
+    def __init__(self, index, template, **kw):
+        if not jinja2:
+            raise ImportError("Jinja2Container filter requires the 'Jinja2' package to be installed.")
+
+        super(Jinja2Container, self).__init__(index, **kw)
+
+        template_path = self.index.absolute_path(template)
+        self.jinja_env.loader.loaders.insert(0, jinja2.FileSystemLoader(os.path.dirname(template_path)))
+
+        self.template_name = os.path.basename(template_path)
+        self.template = self.jinja_env.get_template(self.template_name)
+
+    def __call__(self, content, route=None):
+        # Going through the environment picks up changes to the template.
+        t = self.jinja_env.get_template(self.template_name)
+        return t.render(index=self.index, body=content, route=route)
+
+    def stream(self, chunks, route=None):
+        t = self.jinja_env.get_template(self.template_name)
+        return t.generate(index=self.index, body=join_chunks(chunks), route=route)
+
 
 class Pygments(Filter):
     """
     Pygmentize Github-style fenced codeblocks.
 
+    Lexers are created once per language and share a single formatter.
+    Highlighted blocks are kept in ``block_cache``, an LRU cache of up to
+    ``cache_size`` blocks keyed by the language and code, and optionally on
+    disk under ``cache_path`` (by default 'pygments' in the Index's
+    ``cache_path``, if it has one) so unchanged blocks are never lexed again.
+
     Based on code in http://misaka.61924.nl/
     """
-    def __init__(self, index):
+    pure = True
+    requires = ('pygments',)
+
+    def __init__(self, index, cache_size=1024, cache_path=None):
         if not pygments:
             raise ImportError("Pygments filter requires the 'pygments' package to be installed.")
 
@@ -169,19 +542,49 @@ class Pygments(Filter):
             r'<pre(?: lang="([a-z0-9]+)")?><code(?: class="([a-z0-9]+).*?")?>(.*?)</code></pre>',
             re.IGNORECASE | re.DOTALL)
 
+        self._lexers = {}
+        self._formatter = pygments.formatters.HtmlFormatter()
+
+        self.block_cache = LRUCache(cache_size)
+        self.disk_cache = None
+        cache_path = cache_path and self.index.absolute_path(cache_path) or index.get_cache_path('pygments')
+        if cache_path:
+            self.disk_cache = DiskCache(cache_path)
+
     def _unescape_html(self, html):
         html = html.replace('&lt;', '<')
         html = html.replace('&gt;', '>')
         html = html.replace('&amp;', '&')
         return html.replace('"', '"')
 
+    def _get_lexer(self, language):
+        lexer = self._lexers.get(language)
+        if lexer is None:
+            lexer = self._lexers[language] = pygments.lexers.get_lexer_by_name(language)
+        return lexer
+
     def _highlight_match(self, match):
         language, classname, code = match.groups()
         if (language or classname) is None:
             return match.group(0)
-        return pygments.highlight(self._unescape_html(code),
-            pygments.lexers.get_lexer_by_name(language or classname),
-            pygments.formatters.HtmlFormatter())
+
+        language = language or classname
+        key = content_key(language, code)
+
+        html = self.block_cache.get(key)
+        if html is not None:
+            return html
+
+        if self.disk_cache is not None:
+            html = self.disk_cache.get(key)
+
+        if html is None:
+            html = pygments.highlight(self._unescape_html(code), self._get_lexer(language), self._formatter)
+            if self.disk_cache is not None:
+                self.disk_cache.set(key, html)
+
+        self.block_cache.set(key, html)
+        return html
 
     def __call__(self, content, route=None):
         return str(self._re_codeblock.sub(self._highlight_match, content))
@@ -4,30 +4,114 @@
 # This module is part of Composer and is released under
 # the MIT License: http://www.opensource.org/licenses/mit-license.php
 
+import collections
+import json
 import logging
 import os
 import re
 import fnmatch
+import stat
+import threading
 
-from .filters import default_filters
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+from .cache import LRUCache
+from .deps import DependencyGraph
+from .filters import default_filters, is_available
+from .routing import RouteTable, normalize_url
 
 
 log = logging.getLogger(__name__)
 
 ##
 
-# TODO: Use this to add route prev/current/next tracking?
-def iter_consume(i, num=0):
-    if num < 0:
-        for _ in xrange(-num):
-            yield None
+_patterns_cache = {}
+
+def _translate_glob(glob):
+    r = fnmatch.translate(glob)
+    if r.endswith('(?ms)'):
+        # Python 2 puts the flags at the end, which can't be combined.
+        r = r[:-len('(?ms)')]
+    return r
+
+
+def compile_patterns(patterns):
+    """
+    Compile a list of string globs and regular expression objects into a
+    single ``match(path)`` function, or None if there are no patterns.
+
+    Globs are combined into one regular expression. Compiled pattern sets are
+    cached, so they're only compiled once no matter how often they're used.
+    """
+    if not patterns:
+        return None
+
+    key = tuple(p if isinstance(p, basestring) else (p.pattern, p.flags) for p in patterns)
+    match = _patterns_cache.get(key)
+    if match is not None:
+        return match
+
+    globs = [p for p in patterns if isinstance(p, basestring)]
+    regexps = [p for p in patterns if not isinstance(p, basestring)]
+
+    if globs:
+        combined = '|'.join('(?:%s)' % _translate_glob(g) for g in globs)
+        regexps.insert(0, re.compile(combined, re.MULTILINE | re.DOTALL))
+
+    if len(regexps) == 1:
+        match = regexps[0].match
+    else:
+        match = lambda path: any(r.match(path) for r in regexps)
+
+    _patterns_cache[key] = match
+    return match
+
 
-    elif num > 0:
-        for _ in xrange(num):
-            next(i)
+def _list_dir(path, with_stat=False):
+    """
+    Yield ``(name, is_dir, stat_result)`` for each entry in ``path``, following
+    symlinks. ``stat_result`` is None for directories or unless
+    ``with_stat``.
+    """
+    if scandir is not None:
+        try:
+            entries = scandir(path)
+        except OSError:
+            return
+
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+                st = with_stat and not is_dir and entry.stat() or None
+            except OSError:
+                continue # Broken symlink.
+            yield entry.name, is_dir, st
+        return
+
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return
+
+    for name in names:
+        full_path = os.path.join(path, name)
+        if not with_stat:
+            yield name, os.path.isdir(full_path), None
+            continue
+
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            continue # Broken symlink.
 
-    for o in i:
-        yield o
+        is_dir = stat.S_ISDIR(st.st_mode)
+        yield name, is_dir, not is_dir and st or None
 
 
 def import_object(path):
@@ -35,6 +119,48 @@ def import_object(path):
     o = __import__(module, fromlist=[obj])
     return getattr(o, obj)
 
+
+_filter_chains = {}
+
+def intern_filters(filters):
+    """
+    Get a shared tuple for the given list of filter ids, so that routes with
+    the same filters don't each hold a copy of them.
+    """
+    if not filters:
+        return ()
+
+    filters = tuple(filters)
+    return _filter_chains.setdefault(filters, filters)
+
+
+class _RouteFilters(list):
+    """
+    List of a route's filter ids, which stores any change to it back into the
+    route as a shared tuple (see ``intern_filters``).
+    """
+    __slots__ = ('_route',)
+
+    def __init__(self, route):
+        list.__init__(self, route._filters)
+        self._route = route
+
+
+def _store_filters(name):
+    method = getattr(list, name)
+
+    def wrapper(self, *args, **kw):
+        r = method(self, *args, **kw)
+        self._route._filters = intern_filters(self)
+        return r
+
+    wrapper.__name__ = name
+    return wrapper
+
+for _name in ['append', 'extend', 'insert', 'remove', 'pop', 'reverse', 'sort', '__setitem__',
+              '__delitem__', '__setslice__', '__delslice__', '__iadd__', '__imul__']:
+    setattr(_RouteFilters, _name, _store_filters(_name))
+
 ##
 
 class Route(object):
@@ -46,7 +172,8 @@ class Route(object):
         Path of the while used to populate ``content`` if ``content` is None.
 
     :param filters:
-        List of filter ids.
+        List of filter ids. Stored as a shared tuple (see ``intern_filters``)
+        but read and changed as a list.
 
     :param context:
         Object passed into each filter.
@@ -55,19 +182,200 @@ class Route(object):
         Fixed content to start the route with. If set, ignores the ``file``
         param.
     """
+    # There can be hundreds of thousands of these. Other attributes can still
+    # be set, their __dict__ is only created then.
+    __slots__ = ('url', 'file', '_filters', 'context', 'content', '__dict__')
+
     def __init__(self, url=None, file=None, filters=None, context=None, content=None):
         self.url = url
         self.file = file
-        self.filters = filters or []
+        self._filters = intern_filters(filters)
         self.context = context
         self.content = None
 
+    @property
+    def filters(self):
+        return _RouteFilters(self)
+
+    @filters.setter
+    def filters(self, filters):
+        self._filters = intern_filters(filters)
+
 
 class Static(object):
+    __slots__ = ('url', 'file', '__dict__')
+
     def __init__(self, url, file):
         self.url = url
         self.file = file
 
+class FilterRegistry(collections.MutableMapping):
+    """
+    Filters of an Index by id. Filters are registered with their class and
+    kwargs, and only instantiated the first time they're looked up (such as
+    by the first route which uses them).
+
+    All the mapping methods go through the registered ids, so ``get``,
+    ``keys`` and iterating create the filters which don't exist yet too.
+    """
+    def __init__(self, index):
+        self.index = index
+        self.factories = {} # id -> (filter_cls, filter_kwargs)
+        self._filters = {} # id -> filter
+        # Reentrant, since a filter's constructor can look up other filters.
+        self._lock = threading.RLock()
+
+    def register(self, id, filter_cls, filter_kwargs):
+        with self._lock:
+            self._filters.pop(id, None)
+            self.factories[id] = filter_cls, filter_kwargs
+
+    def __getitem__(self, id):
+        filter = self._filters.get(id)
+        if filter is not None:
+            return filter
+
+        with self._lock:
+            filter = self._filters.get(id)
+            if filter is None: # Not created by another thread meanwhile.
+                filter_cls, filter_kwargs = self.factories[id]
+                log.debug("Creating filter: %s", id)
+                filter = self._filters[id] = filter_cls(self.index, **filter_kwargs)
+            return filter
+
+    def __setitem__(self, id, filter):
+        "Register an already instantiated filter."
+        with self._lock:
+            self.factories[id] = type(filter), {}
+            self._filters[id] = filter
+
+    def __delitem__(self, id):
+        with self._lock:
+            del self.factories[id]
+            self._filters.pop(id, None)
+
+    def __contains__(self, id):
+        return id in self.factories
+
+    def __iter__(self):
+        return iter(self.factories)
+
+    def __len__(self):
+        return len(self.factories)
+
+
+def _context_getter(key):
+    """
+    Turn a context key into a function which gets it from a route's context,
+    callables are returned as they are.
+    """
+    if key is None or callable(key):
+        return key
+
+    return lambda route: (route.context or {}).get(key)
+
+
+class Collection(object):
+    """
+    Ordered sequence of routes, such as all the posts by date, with lookups of
+    a route's position and neighbours by url in constant time.
+
+    Built by the Index (see ``Index.register_collection``), so that listing
+    and prev/next links don't need to scan ``Index.routes`` for every page.
+
+    :param routes:
+        List of routes, in order.
+
+    :param groups:
+        Dictionary of group key to ``Collection`` of the routes in that group.
+    """
+    def __init__(self, routes, groups=None):
+        self.routes = routes
+        self.groups = groups or {}
+
+        self._positions = dict((normalize_url(route.url), i) for i, route in enumerate(routes))
+
+    def __len__(self):
+        return len(self.routes)
+
+    def __iter__(self):
+        return iter(self.routes)
+
+    def __getitem__(self, i):
+        return self.routes[i]
+
+    def __contains__(self, url):
+        return normalize_url(url) in self._positions
+
+    def position(self, url):
+        "Position of the route with ``url`` in the collection, or None."
+        return self._positions.get(normalize_url(url))
+
+    def prev(self, url):
+        "Route before the one with ``url``, or None."
+        i = self.position(url)
+        if i:
+            return self.routes[i - 1]
+
+    def next(self, url):
+        "Route after the one with ``url``, or None."
+        i = self.position(url)
+        if i is not None and i + 1 < len(self.routes):
+            return self.routes[i + 1]
+
+    def page(self, num, per_page):
+        "Routes on page ``num`` (counting from 1) of ``per_page`` routes each."
+        start = (num - 1) * per_page
+        return self.routes[start:start + per_page]
+
+    def num_pages(self, per_page):
+        return max(1, (len(self.routes) + per_page - 1) // per_page)
+
+    def group(self, key):
+        "``Collection`` of the routes in the group ``key``, empty if there's none."
+        group = self.groups.get(key)
+        if group is None:
+            return Collection([])
+        return group
+
+
+class CollectionSpec(object):
+    """
+    Which routes go into a collection and how they're ordered and grouped, see
+    ``Index.register_collection``.
+    """
+    def __init__(self, include_only=None, sort_key=None, reverse=False, group_by=None):
+        self.include_only = compile_patterns(include_only)
+        self.sort_key = _context_getter(sort_key)
+        self.reverse = reverse
+        self.group_by = _context_getter(group_by)
+
+    def match(self, route):
+        return not self.include_only or self.include_only(route.url)
+
+    def build(self, routes):
+        "Get the ``Collection`` of the matching ``routes``, in the order of the Index."
+        if self.sort_key:
+            # Stable, so routes with equal keys stay in the order of the Index.
+            routes.sort(key=self.sort_key, reverse=self.reverse)
+        elif self.reverse:
+            routes.reverse()
+
+        if not self.group_by:
+            return Collection(routes)
+
+        grouped = {}
+        for route in routes:
+            keys = self.group_by(route)
+            if not isinstance(keys, (list, tuple, set)):
+                keys = [keys]
+            for key in keys:
+                if key is not None:
+                    grouped.setdefault(key, []).append(route)
+
+        groups = dict((key, Collection(group_routes)) for key, group_routes in grouped.iteritems())
+        return Collection(routes, groups)
+
 ##
 
 class Index(object):
@@ -75,25 +383,41 @@ class Index(object):
     :param base_path:
         Base path that the rest of the file paths should be resolved in
         relation to.
+
+    :param cache_path:
+        Directory for filters to keep compiled templates and other caches in
+        across builds (see ``get_cache_path``), relative to ``base_path``.
+        Builds running at the same time can share it.
     """
-    def __init__(self, base_path='', base_url='/'):
+    def __init__(self, base_path='', base_url='/', cache_path=None):
         self.base_path = os.path.abspath(base_path)
         self.base_url = '/'
+        self.cache_path = cache_path and self.absolute_path(cache_path)
 
-        self.filters = {}
+        self.filters = FilterRegistry(self)
         self._filters_kwargs_cache = {} # For exporting
         self._register_default_filters()
         self._register_filters()
 
         self._route_cache = None
 
+        self._collection_specs = {}
+        self._collections_conf = {} # For exporting
+        self._collections = None
+        self._collections_lock = threading.Lock()
+        self._register_collections()
+
+        # Files which each route was rendered from, recorded by the Writer.
+        self.dependencies = DependencyGraph()
+
     def _register_default_filters(self):
         for filter_id, filter_cls in default_filters.iteritems():
-            try:
-                self.register_filter(filter_id, filter_cls)
-                log.debug("Registered default filter: %s", filter_id)
-            except ImportError:
+            if not all(is_available(package) for package in filter_cls.requires):
                 log.debug("Skipping default filter due to missing dependency package: %s", filter_id)
+                continue
+
+            self.register_filter(filter_id, filter_cls)
+            log.debug("Registered default filter: %s", filter_id)
 
     def _register_filters(self):
         "Stub."
@@ -101,8 +425,8 @@ class Index(object):
 
     def register_filter(self, id, filter_cls, filter_kwargs=None):
         """
-        Instantiate the filter and register it under the given id for this
-        Index.
+        Register the filter under the given id for this Index. It's
+        instantiated the first time it's used.
 
         :param id:
             Id of filter used to reference it in routes.
@@ -114,31 +438,105 @@ class Index(object):
         :param filter_kwargs:
             Dictionary of keyword arguments passed into ``filter_cls``.
 
-        :returns: Instantiated filter object in respect to this Index.
+        :returns: None. The filter is looked up (and created) with
+            ``index.filters[id]``.
         """
         filter_kwargs = filter_kwargs or {}
-        self.filters[id] = filter = filter_cls(self, **filter_kwargs)
+        self.filters.register(id, filter_cls, filter_kwargs)
         self._filters_kwargs_cache[id] = filter_kwargs
-        return filter
 
-    def _compile_globs(self, globs_or_regexps):
-        if not globs_or_regexps:
-            return []
+    def _register_collections(self):
+        "Stub."
+        pass
+
+    def register_collection(self, id, include_only=None, sort_key=None, reverse=False, group_by=None):
+        """
+        Register a collection of routes which is built in a single pass over
+        ``routes`` the first time one is used, and rebuilt after the route
+        cache changes. See ``Collection``.
 
-        return [re.compile(fnmatch.translate(s)) for s in globs_or_regexps if isinstance(s, basestring)]
+        For example, posts from newest to oldest and grouped by tag::
 
-    def _prune_paths(self, paths, exclude, include_only):
-        for path in paths:
-            if include_only and not any(r.match(path) for r in include_only):
-                continue
-            if exclude and any(r.match(path) for r in exclude):
-                continue
-            yield path
+            index.register_collection('posts', include_only=['/post/*'],
+                                      sort_key='date', reverse=True, group_by='tags')
+
+        :param id:
+            Id to get the collection with from ``collections``.
+
+        :param include_only:
+            List of string globs or regular expression objects which a route's
+            url must match in order to be included. All routes by default.
+
+        :param sort_key:
+            Route context key or callable which gets the route to order the
+            routes by. The order of the Index by default.
+
+        :param reverse:
+            Order the routes in reverse.
+
+        :param group_by:
+            Route context key or callable which gets the route to group the
+            routes by. Lists (such as of tags) put the route into each group.
+        """
+        self._collection_specs[id] = CollectionSpec(include_only, sort_key, reverse, group_by)
+        self._collections_conf[id] = {
+            'include_only': include_only,
+            'sort_key': sort_key,
+            'reverse': reverse,
+            'group_by': group_by,
+        }
+        self._collections = None
+
+    @property
+    def collections(self):
+        """
+        Dictionary of collection id to ``Collection``.
+        """
+        collections = self._collections
+        if collections is not None:
+            return collections
+
+        with self._collections_lock:
+            if self._collections is None:
+                self._collections = self._build_collections()
+            return self._collections
+
+    def _build_collections(self):
+        specs = self._collection_specs.items()
+        matched = dict((id, []) for id, spec in specs)
+
+        if specs:
+            # Include the routes added and removed since the route cache was
+            # generated, if there is one.
+            if self._route_cache is not None:
+                routes = self._route_cache.itervalues()
+            else:
+                routes = self.routes
+
+            for route in routes:
+                for id, spec in specs:
+                    if spec.match(route):
+                        matched[id].append(route)
+
+        collections = dict((id, spec.build(matched[id])) for id, spec in specs)
+        log.debug("Built %d collections.", len(collections))
+        return collections
+
+    def get_cache_path(self, name):
+        """
+        Path of the ``name`` directory in ``cache_path`` for a filter to keep
+        its cache in, or None if the Index has no ``cache_path``.
+        """
+        if self.cache_path:
+            return os.path.join(self.cache_path, name)
 
-    def walk(self, start='.', exclude=None, include_only=None):
+    def walk(self, start='.', exclude=None, include_only=None, stat=False):
         """
         Walk and yield relative paths from the Index's ``base_path``.
 
+        Directories which are excluded in their entirety by a glob ending in
+        ``*`` (such as ``node_modules/*``) are not descended into.
+
         :param exclude:
             List of string globs or regular expression objects to omit.
 
@@ -148,18 +546,43 @@ class Index(object):
 
         :param start:
             Path to start from relative to ``base_path``
+
+        :param stat:
+            Yield ``(path, stat_result)`` tuples instead, reusing what was
+            already fetched while listing directories where possible.
         """
-        # Compile globs into regexps
-        exclude = self._compile_globs(exclude)
-        include_only = self._compile_globs(include_only)
+        exclude_globs = [p for p in exclude or () if isinstance(p, basestring)]
+        prune = compile_patterns([p for p in exclude_globs if p.endswith('*')])
+        exclude = compile_patterns(exclude)
+        include_only = compile_patterns(include_only)
 
         start_path = self.absolute_path(start)
 
-        for dirpath, dirnames, filenames in os.walk(start_path, followlinks=True):
-            filenames = (self.relative_path(os.path.join(dirpath, f)) for f in filenames)
-            filenames = self._prune_paths(filenames, exclude, include_only)
-            for file in filenames:
-                yield file
+        prefix = self.relative_path(start_path)
+        prefix = '' if prefix == '.' else prefix + os.sep
+
+        stack = [(start_path, prefix)]
+        while stack:
+            dir_path, rel_dir = stack.pop()
+
+            subdirs = []
+            for name, is_dir, st in _list_dir(dir_path, stat):
+                path = rel_dir + name
+
+                if is_dir:
+                    if not (prune and prune(path + os.sep)):
+                        subdirs.append((os.path.join(dir_path, name), path + os.sep))
+                    continue
+
+                if include_only and not include_only(path):
+                    continue
+                if exclude and exclude(path):
+                    continue
+
+                yield (path, st) if stat else path
+
+            # Descend in listing order, like os.walk.
+            stack.extend(reversed(subdirs))
 
     def absolute_url(self, url):
         return os.path.join(self.base_url, url)
@@ -189,20 +612,108 @@ class Index(object):
         pass
 
     def _refresh_route_cache(self):
-        self._route_cache = {}
+        if self._route_cache is not None:
+            # Routes may have changed since the collections were built.
+            self._collections = None
 
-        for count, route in enumerate(self.routes):
-            url = route.url.lstrip('/')
-            log.debug("Refreshing route cache: /%s", url)
-            self._route_cache[url] = route
+        self._route_cache = RouteTable(self.routes)
 
-        log.info("Cached %d routes.", count+1)
+        log.info("Cached %d routes.", len(self._route_cache))
 
     def get_route(self, url):
+        """
+        Get the route of ``url`` or of any of its variants which materialize
+        into the same file (see ``composer.routing.normalize_url``), such as
+        with a trailing slash or ``index.html``.
+        """
+        if self._route_cache is None:
+            self._refresh_route_cache()
+
+        return self._route_cache.get(url)
+
+    def list_routes(self, prefix=''):
+        """
+        Iterate over the route at the url ``prefix`` and the routes under it,
+        ordered by url segments.
+        """
+        if self._route_cache is None:
+            self._refresh_route_cache()
+
+        return self._route_cache.iter_routes(prefix)
+
+    def list_dir(self, prefix=''):
+        """
+        List the url segments directly under ``prefix``, like a directory, as
+        sorted ``(name, has_children)`` tuples.
+        """
+        if self._route_cache is None:
+            self._refresh_route_cache()
+
+        return self._route_cache.list_dir(prefix)
+
+    def find_routes(self, pattern):
+        """
+        Iterate over the routes whose url matches the glob ``pattern`` (like
+        ``/post/2011/*``, where ``*`` also matches slashes), only looking at
+        the routes under the part of it before the first wildcard.
+        """
+        key = normalize_url(pattern)
+
+        prefix = []
+        for segment in key.split('/'):
+            if any(c in segment for c in '*?['):
+                break
+            prefix.append(segment)
+
+        match = compile_patterns([key])
+        for route in self.list_routes('/'.join(prefix)):
+            if match(normalize_url(route.url)):
+                yield route
+
+    def add_route(self, route):
+        """
+        Add (or replace) a route in the route cache without regenerating it.
+        """
         if self._route_cache is None:
             self._refresh_route_cache()
 
-        return self._route_cache.get(url.lstrip('/'))
+        self._route_cache.add(route)
+        self._collections = None
+
+    def remove_route(self, url):
+        """
+        Remove a route from the route cache without regenerating it.
+
+        :returns: The removed route or None.
+        """
+        if self._route_cache is None:
+            self._refresh_route_cache()
+
+        self._collections = None
+        return self._route_cache.remove(url)
+
+    def refresh_routes(self):
+        """
+        Regenerate the route cache.
+
+        :returns: Tuple of sets ``(added, removed, changed)`` of normalized
+            urls (see ``composer.routing.normalize_url``) compared to the
+            previous route cache.
+        """
+        old_cache = self._route_cache or RouteTable()
+        self._refresh_route_cache()
+        new_cache = self._route_cache
+
+        added = set(new_cache) - set(old_cache)
+        removed = set(old_cache) - set(new_cache)
+        changed = set()
+
+        for url in set(new_cache) & set(old_cache):
+            old, new = old_cache.get(url), new_cache.get(url)
+            if (old.file, old.filters, old.context) != (new.file, new.filters, new.context):
+                changed.add(url)
+
+        return added, removed, changed
 
     @property
     def routes(self):
@@ -214,10 +725,29 @@ class Index(object):
 
     @staticmethod
     def from_dict(d, **kw):
+        kw.setdefault('cache_path', d.get('cache_path'))
         index = Index(**kw)
 
+        # Routes often have equal contexts, only keep one copy of each. The
+        # routes are copied so that ``d`` isn't changed or kept around.
+        routes = []
+        contexts = {}
+        for route_kw in d.get('routes', []):
+            route_kw = dict(route_kw)
+            context = route_kw.get('context')
+            if context is not None:
+                try:
+                    key = json.dumps(context, sort_keys=True)
+                except (TypeError, ValueError):
+                    pass # Not JSON (like dates), keep it as it is.
+                else:
+                    route_kw['context'] = contexts.setdefault(key, context)
+            routes.append(route_kw)
+
+        static = list(d.get('static', []))
+
         def _generate_routes():
-            for route_kw in d.get('routes', []):
+            for route_kw in routes:
                 r = Route(**route_kw)
                 r.file = index.absolute_path(r.file)
                 yield r
@@ -225,7 +755,7 @@ class Index(object):
         index._generate_routes = _generate_routes
 
         def _generate_static():
-            for static_kw in d.get('static', []):
+            for static_kw in static:
                 s = Static(**static_kw)
                 s.file = index.absolute_path(s.file)
                 yield s
@@ -236,6 +766,9 @@ class Index(object):
             filter_cls = import_object(filter_conf['class'])
             index.register_filter(filter_id, filter_cls, filter_kwargs=filter_conf.get('kwargs'))
 
+        for collection_id, collection_conf in d.get('collections', {}).iteritems():
+            index.register_collection(collection_id, **collection_conf)
+
         return index
 
     def to_dict(self):
@@ -244,13 +777,14 @@ class Index(object):
             'routes': [],
             'static': [],
             'filters': {},
+            'collections': {},
         }
 
         for route in self.routes:
             r['routes'].append({
                 'url': route.url,
                 'file': route.file,
-                'filters': route.filters,
+                'filters': list(route.filters),
                 'context': route.context,
             })
 
@@ -260,10 +794,218 @@ class Index(object):
                 'file': static.file,
             })
 
-        for filter_id, filter_obj in self.filters.iteritems():
-            r['filters'][filter_id] = {
-                'class': '%s:%s' % (filter_obj.__module__, filter_obj.__class__.__name__),
+        r['filters'] = self._filters_dict()
+
+        if self.cache_path:
+            r['cache_path'] = self.cache_path
+
+        r['collections'] = self._collections_dict()
+
+        return r
+
+    def _collections_dict(self):
+        r = {}
+        for collection_id, conf in self._collections_conf.iteritems():
+            if callable(conf['sort_key']) or callable(conf['group_by']) or \
+                    not all(isinstance(p, basestring) for p in conf['include_only'] or ()):
+                log.debug("Not exporting collection with callables or regular expressions: %s", collection_id)
+                continue
+            r[collection_id] = conf
+
+        return r
+
+    def _filters_dict(self):
+        r = {}
+        for filter_id, (filter_cls, filter_kwargs) in self.filters.factories.iteritems():
+            r[filter_id] = {
+                'class': '%s:%s' % (filter_cls.__module__, filter_cls.__name__),
                 'kwargs': self._filters_kwargs_cache.get(filter_id, {}),
             }
 
         return r
+
+    @staticmethod
+    def from_sqlite(path, **kw):
+        return SQLiteIndex(path, **kw)
+
+    def to_sqlite(self, path):
+        """
+        Write the index into a sqlite database which can be loaded with
+        ``Index.from_sqlite``. Unlike ``to_dict``, routes are streamed into the
+        database so they never need to be in memory all at once.
+        """
+        if os.path.exists(path):
+            os.remove(path)
+
+        import sqlite3
+
+        db = sqlite3.connect(path)
+        db.executescript(SQLiteIndex.schema)
+
+        db.executemany("INSERT OR REPLACE INTO routes (key, url, file, filters, context) VALUES (?, ?, ?, ?, ?)",
+                       ((normalize_url(route.url), route.url, route.file, json.dumps(route.filters), json.dumps(route.context))
+                        for route in self.routes))
+
+        db.executemany("INSERT INTO static (url, file) VALUES (?, ?)",
+                       ((static.url, static.file) for static in self.static))
+
+        db.executemany("INSERT INTO filters (id, class, kwargs) VALUES (?, ?, ?)",
+                       ((filter_id, conf['class'], json.dumps(conf['kwargs']))
+                        for filter_id, conf in self._filters_dict().iteritems()))
+
+        db.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                       [('cache_path', json.dumps(self.cache_path)),
+                        ('collections', json.dumps(self._collections_dict()))])
+
+        db.commit()
+        db.close()
+
+
+class SQLiteIndex(Index):
+    """
+    Index backed by a sqlite database as written by ``Index.to_sqlite``.
+
+    Nothing is loaded up front: ``routes`` streams rows from the database and
+    ``get_route`` looks up a single url, so startup time and memory don't grow
+    with the number of routes. ``add_route`` and ``remove_route`` change the
+    database.
+
+    :param db_path:
+        Path of the sqlite database.
+    """
+    schema = """
+        CREATE TABLE routes (id INTEGER PRIMARY KEY, key TEXT UNIQUE, url TEXT, file TEXT, filters TEXT, context TEXT);
+        CREATE TABLE static (id INTEGER PRIMARY KEY, url TEXT, file TEXT);
+        CREATE TABLE filters (id TEXT PRIMARY KEY, class TEXT, kwargs TEXT);
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+    """
+
+    def __init__(self, db_path, **kw):
+        self.db_path = db_path
+        self._local = threading.local()
+
+        # Decoded filters and contexts, keyed by their JSON.
+        self._filters_cache = {}
+        self._contexts_cache = LRUCache(1024)
+
+        self._meta = self._load_meta()
+        kw.setdefault('cache_path', self._meta.get('cache_path'))
+
+        super(SQLiteIndex, self).__init__(**kw)
+
+    def _load_meta(self):
+        import sqlite3
+
+        try:
+            rows = self.db.execute("SELECT key, value FROM meta").fetchall()
+        except sqlite3.OperationalError:
+            return {} # Written before there was a meta table.
+
+        return dict((key, json.loads(value)) for key, value in rows)
+
+    @property
+    def db(self):
+        # Connections can't be shared across threads or forked processes.
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) != pid:
+            import sqlite3
+            self._local.db = sqlite3.connect(self.db_path)
+            self._local.pid = pid
+
+        return self._local.db
+
+    def _register_filters(self):
+        for filter_id, filter_cls, filter_kwargs in self.db.execute("SELECT id, class, kwargs FROM filters"):
+            self.register_filter(filter_id, import_object(filter_cls), filter_kwargs=json.loads(filter_kwargs))
+
+    def _register_collections(self):
+        for collection_id, conf in self._meta.get('collections', {}).iteritems():
+            self.register_collection(collection_id, **conf)
+
+    def _make_route(self, url, file, filters, context):
+        filters_obj = self._filters_cache.get(filters)
+        if filters_obj is None:
+            filters_obj = self._filters_cache[filters] = intern_filters(json.loads(filters))
+
+        context_obj = self._contexts_cache.get(context)
+        if context_obj is None:
+            context_obj = json.loads(context)
+            self._contexts_cache.set(context, context_obj)
+
+        return Route(url, self.absolute_path(file), filters=filters_obj, context=context_obj)
+
+    def _generate_routes(self):
+        for row in self.db.execute("SELECT url, file, filters, context FROM routes ORDER BY id"):
+            yield self._make_route(*row)
+
+    def _generate_static(self):
+        for url, file in self.db.execute("SELECT url, file FROM static ORDER BY id"):
+            yield Static(url, self.absolute_path(file))
+
+    def refresh_routes(self):
+        "Routes are always read from the database, nothing to refresh."
+        return set(), set(), set()
+
+    def add_route(self, route):
+        """
+        Add (or replace) a route in the database.
+        """
+        key = normalize_url(route.url)
+        row = (key, route.url, route.file, json.dumps(route.filters), json.dumps(route.context))
+        with self.db:
+            cursor = self.db.execute("UPDATE routes SET key = ?, url = ?, file = ?, filters = ?, context = ? "
+                                     "WHERE key IN (?, ?)", row + (key, route.url.lstrip('/')))
+            if not cursor.rowcount:
+                self.db.execute("INSERT INTO routes (key, url, file, filters, context) VALUES (?, ?, ?, ?, ?)", row)
+
+        self._collections = None
+
+    def remove_route(self, url):
+        """
+        Remove a route from the database.
+
+        :returns: The removed route or None.
+        """
+        route = self.get_route(url)
+        if route is None:
+            return
+
+        with self.db:
+            self.db.execute("DELETE FROM routes WHERE key IN (?, ?)", (normalize_url(url), url.lstrip('/')))
+
+        self._collections = None
+        return route
+
+    def get_route(self, url):
+        # Databases written before keys were normalized have them with
+        # trailing slashes.
+        row = self.db.execute("SELECT url, file, filters, context FROM routes WHERE key IN (?, ?) LIMIT 1",
+                              (normalize_url(url), url.lstrip('/'))).fetchone()
+        if row:
+            return self._make_route(*row)
+
+    def _iter_prefix_rows(self, columns, prefix):
+        # Keys under "foo" sort between "foo/" and "foo0", which the unique
+        # index on key answers without a scan.
+        key = normalize_url(prefix)
+        if not key:
+            return self.db.execute("SELECT %s FROM routes ORDER BY key" % columns)
+
+        return self.db.execute("SELECT %s FROM routes WHERE key = ? OR (key >= ? AND key < ?) ORDER BY key" % columns,
+                               (key, key + '/', key + '0'))
+
+    def list_routes(self, prefix=''):
+        for row in self._iter_prefix_rows('url, file, filters, context', prefix):
+            yield self._make_route(*row)
+
+    def list_dir(self, prefix=''):
+        key = normalize_url(prefix)
+        base = key + '/' if key else ''
+
+        children = {}
+        for row_key, in self._iter_prefix_rows('key', prefix):
+            name, sep, _ = row_key[len(base):].partition('/')
+            if name and row_key.startswith(base):
+                children[name] = children.get(name, False) or bool(sep)
+
+        return sorted(children.iteritems())
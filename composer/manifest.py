@@ -0,0 +1,199 @@
+# composer/manifest.py
+# Copyright 2011 Andrey Petrov
+#
+# This module is part of Composer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import hashlib
+import json
+import logging
+import os
+
+from .cache import atomic_write, hash_object, makedirs
+from .compress import EXTENSIONS
+
+
+log = logging.getLogger(__name__)
+
+
+def hash_file(path, block_size=65536):
+    h = hashlib.sha1()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(block_size), ''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def get_state_path(build_path):
+    """
+    Default directory for the bookkeeping of the builds into ``build_path``
+    (such as the ``BuildManifest``). It's kept next to the build rather than
+    in it so that it's not deployed with the site, like
+    ``.composer-state/build`` for ``build``.
+    """
+    build_path = os.path.abspath(build_path)
+    return os.path.join(os.path.dirname(build_path), '.composer-state', os.path.basename(build_path))
+
+
+class BuildManifest(object):
+    """
+    Persistent record of the inputs each route was last built from, so that a
+    build can skip the routes whose inputs haven't changed.
+
+    Each entry is keyed by the route url and remembers the source file's
+    mtime, size and content hash, the filter chain, a digest of the filter
+    kwargs and of the route context, the mtime and size of the other files it
+    depends on (such as templates) and the output file it was written to.
+
+    :param path:
+        Path of the JSON file the manifest is loaded from and saved into.
+
+    :param legacy_path:
+        Path of a manifest to load if there's none at ``path`` yet, which is
+        removed once the manifest is saved. Manifests used to be kept in the
+        build path as ``legacy_filename``.
+    """
+    filename = 'manifest.json'
+    legacy_filename = '.composer-manifest.json'
+
+    def __init__(self, path, legacy_path=None):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.entries = {}
+
+        self.load()
+
+    def load(self):
+        path = self.path
+        if not os.path.exists(path):
+            if not (self.legacy_path and os.path.exists(self.legacy_path)):
+                return
+            path = self.legacy_path
+
+        try:
+            with open(path) as fp:
+                self.entries = json.load(fp).get('routes', {})
+        except ValueError:
+            log.warn("Ignoring corrupt build manifest: %s", path)
+            self.entries = {}
+
+    def save(self):
+        makedirs(os.path.dirname(self.path) or '.')
+        atomic_write(self.path, json.dumps({'routes': self.entries}))
+
+        if self.legacy_path and os.path.exists(self.legacy_path):
+            log.info("Removing build manifest from the build path: %s", self.legacy_path)
+            os.remove(self.legacy_path)
+
+    def _config(self, route, index):
+        filters_kwargs = [index._filters_kwargs_cache.get(filter_id) for filter_id in route.filters]
+        return {
+            'filters': list(route.filters),
+            'filters_kwargs': hash_object(filters_kwargs),
+            'context': hash_object(route.context),
+        }
+
+    def is_current(self, route, index, output_path):
+        """
+        Return True if ``route`` was already built into ``output_path`` from
+        the same inputs.
+        """
+        entry = self.entries.get(route.url)
+        if not entry or entry.get('output') != output_path:
+            return False
+
+        if not os.path.exists(output_path):
+            return False
+
+        for key, value in self._config(route, index).iteritems():
+            if entry.get(key) != value:
+                return False
+
+        try:
+            stat = os.stat(route.file)
+        except OSError:
+            return False
+
+        if stat.st_size != entry.get('size'):
+            return False
+
+        for path, (mtime, size) in entry.get('deps', {}).iteritems():
+            try:
+                dep_stat = os.stat(path)
+            except OSError:
+                return False
+
+            if (dep_stat.st_mtime, dep_stat.st_size) != (mtime, size):
+                return False
+
+        if stat.st_mtime == entry.get('mtime'):
+            return True
+
+        # Touched but possibly not modified, compare the contents.
+        if hash_file(route.file) != entry.get('hash'):
+            return False
+
+        entry['mtime'] = stat.st_mtime
+        return True
+
+    def update(self, route, index, output_path, dependencies=()):
+        """
+        Record the current inputs of ``route``.
+
+        :param dependencies:
+            Paths of other files the route was rendered from.
+        """
+        stat = os.stat(route.file)
+
+        deps = {}
+        source_path = os.path.abspath(route.file)
+        for path in dependencies:
+            if path == source_path:
+                continue
+            try:
+                dep_stat = os.stat(path)
+            except OSError:
+                continue
+            deps[path] = (dep_stat.st_mtime, dep_stat.st_size)
+
+        entry = self._config(route, index)
+        entry.update({
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'hash': hash_file(route.file),
+            'deps': deps,
+            'output': output_path,
+        })
+
+        self.entries[route.url] = entry
+
+    def remove_stale(self, urls):
+        """
+        Forget the routes that aren't in ``urls`` anymore and delete their
+        outputs, along with any compressed siblings of them.
+
+        :returns: List of output paths which were removed.
+        """
+        removed = []
+
+        for url in set(self.entries) - set(urls):
+            output_path = self.entries.pop(url).get('output')
+            if not output_path or not os.path.exists(output_path):
+                continue
+
+            log.info("Removing stale route: %s", url)
+            os.remove(output_path)
+            removed.append(output_path)
+
+            for ext in EXTENSIONS:
+                if os.path.exists(output_path + ext):
+                    os.remove(output_path + ext)
+
+            # Clean up directories which were only there for this route.
+            build_path = os.path.dirname(self.path)
+            dir_path = os.path.dirname(output_path)
+            while dir_path != build_path and os.path.isdir(dir_path) and not os.listdir(dir_path):
+                os.rmdir(dir_path)
+                dir_path = os.path.dirname(dir_path)
+
+        return removed
@@ -0,0 +1,130 @@
+# composer/profiler.py
+# Copyright 2011 Andrey Petrov
+#
+# This module is part of Composer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import csv
+import json
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+class Profiler(object):
+    """
+    Collect wall time and call counts per build phase, per route and per
+    filter.
+
+    A Profiler is a Writer listener, so it can be hooked up with
+    ``writer.subscribe(profiler)``. Phases are timed with ``phase`` and
+    ``iter_phase``.
+    """
+    def __init__(self):
+        # name -> [count, seconds]
+        self.phases = {}
+        self.routes = {}
+        self.filters = {}
+
+        self._lock = threading.Lock()
+
+    def _add(self, table, key, elapsed, count=1):
+        with self._lock:
+            stats = table.setdefault(key, [0, 0.0])
+            stats[0] += count
+            stats[1] += elapsed
+
+    @contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self._add(self.phases, name, time.time() - start)
+
+    def iter_phase(self, name, iterable):
+        """
+        Yield from ``iterable``, counting the time spent producing each item
+        towards the ``name`` phase.
+        """
+        i = iter(iterable)
+        while True:
+            start = time.time()
+            try:
+                item = next(i)
+            except StopIteration:
+                return
+            finally:
+                self._add(self.phases, name, time.time() - start)
+            yield item
+
+    def __call__(self, event, route, elapsed=0.0, filters=(), **kw):
+        if event == 'render':
+            self._add(self.routes, route.url, elapsed)
+            self._add(self.phases, 'render', elapsed)
+            for filter_id, filter_elapsed in filters:
+                self._add(self.filters, filter_id, filter_elapsed)
+
+        elif event == 'write':
+            self._add(self.phases, 'write', elapsed)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'phases': dict((k, list(v)) for k, v in self.phases.iteritems()),
+                'routes': dict((k, list(v)) for k, v in self.routes.iteritems()),
+                'filters': dict((k, list(v)) for k, v in self.filters.iteritems()),
+            }
+
+    def merge(self, data):
+        """
+        Add the stats of another Profiler's ``to_dict``, such as from a build
+        worker.
+        """
+        for name in ('phases', 'routes', 'filters'):
+            table = getattr(self, name)
+            for key, (count, elapsed) in data.get(name, {}).iteritems():
+                self._add(table, key, elapsed, count=count)
+
+    def reset(self):
+        with self._lock:
+            self.phases.clear()
+            self.routes.clear()
+            self.filters.clear()
+
+    def _top(self, table, num):
+        return sorted(table.iteritems(), key=lambda item: item[1][1], reverse=True)[:num]
+
+    def report(self, top=10):
+        lines = []
+        for title, table, num in [('Phases', self.phases, None),
+                                  ('Slowest filters', self.filters, top),
+                                  ('Slowest routes', self.routes, top)]:
+            if not table:
+                continue
+
+            lines.append('%s:' % title)
+            for key, (count, elapsed) in self._top(table, num):
+                lines.append('  %10.3fs %8d  %s' % (elapsed, count, key))
+
+        return '\n'.join(lines)
+
+    def write(self, path):
+        """
+        Write all the stats to ``path`` as CSV if it ends with .csv, otherwise
+        as JSON.
+        """
+        if not path.endswith('.csv'):
+            with open(path, 'w') as fp:
+                json.dump(self.to_dict(), fp, indent=2)
+            return
+
+        with open(path, 'wb') as fp:
+            writer = csv.writer(fp)
+            writer.writerow(['kind', 'name', 'count', 'seconds'])
+            for kind, table in sorted(self.to_dict().iteritems()):
+                for key, (count, elapsed) in sorted(table.iteritems()):
+                    if isinstance(key, unicode):
+                        key = key.encode('utf8')
+                    writer.writerow([kind, key, count, '%.6f' % elapsed])
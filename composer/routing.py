@@ -0,0 +1,141 @@
+# composer/routing.py
+# Copyright 2011 Andrey Petrov
+#
+# This module is part of Composer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import re
+from collections import OrderedDict
+
+
+_re_slashes = re.compile('/{2,}')
+
+
+def normalize_url(url):
+    """
+    Get the canonical key of a url, which is the same for the variants that
+    materialize into the same file: without leading, trailing or repeated
+    slashes and without a trailing ``index.html``.
+
+    ``/foo``, ``foo/``, ``/foo//`` and ``/foo/index.html`` all become ``foo``,
+    ``/`` becomes an empty string.
+    """
+    key = url.strip('/')
+    if '//' in key:
+        key = _re_slashes.sub('/', key)
+
+    if key == 'index.html':
+        return ''
+    if key.endswith('/index.html'):
+        return key[:-len('/index.html')]
+
+    return key
+
+
+class RouteTable(object):
+    """
+    Routes by the canonical key of their url (see ``normalize_url``), along
+    with a tree of url segments for listing the routes under a prefix.
+
+    Lookups are a single dict access no matter how many routes there are.
+    Routes are kept in the order they were added in, and a replaced route
+    keeps its place.
+
+    The tree is kept as a set of child segments per directory-like key (such
+    as ``post`` for ``post/2011``), so adding and removing a route only
+    touches the keys above it which don't already (or still) exist.
+    """
+    def __init__(self, routes=()):
+        self._routes = OrderedDict() # key -> route
+        self._dirs = {} # key -> set of child segments
+
+        for route in routes:
+            self.add(route)
+
+    def __len__(self):
+        return len(self._routes)
+
+    def __iter__(self):
+        return iter(self._routes)
+
+    def __contains__(self, url):
+        return normalize_url(url) in self._routes
+
+    def itervalues(self):
+        "Iterate over the routes in the order they were added in."
+        return self._routes.itervalues()
+
+    def get(self, url, default=None):
+        return self._routes.get(normalize_url(url), default)
+
+    def add(self, route):
+        """
+        Add the route, replacing any with the same key.
+
+        :returns: The replaced route or None.
+        """
+        key = normalize_url(route.url)
+        old = self._routes.get(key)
+        self._routes[key] = route
+
+        while key:
+            parent, _, name = key.rpartition('/')
+            children = self._dirs.get(parent)
+            if children is None:
+                children = self._dirs[parent] = set()
+            elif name in children:
+                break
+            children.add(name)
+            key = parent
+
+        return old
+
+    def remove(self, url):
+        """
+        Remove the route with the key of ``url``.
+
+        :returns: The removed route or None.
+        """
+        key = normalize_url(url)
+        route = self._routes.pop(key, None)
+        if route is None:
+            return
+
+        # Prune the segments which nothing is under anymore.
+        while key and key not in self._routes and key not in self._dirs:
+            parent, _, name = key.rpartition('/')
+            children = self._dirs[parent]
+            children.discard(name)
+            if children:
+                break
+            del self._dirs[parent]
+            key = parent
+
+        return route
+
+    def list_dir(self, prefix=''):
+        """
+        List the segments directly under ``prefix`` as sorted
+        ``(name, has_children)`` tuples.
+        """
+        key = normalize_url(prefix)
+        base = key + '/' if key else ''
+        return [(name, base + name in self._dirs) for name in sorted(self._dirs.get(key, ()))]
+
+    def iter_routes(self, prefix=''):
+        """
+        Yield the route at ``prefix`` and all the routes under it, ordered by
+        url segments.
+        """
+        stack = [normalize_url(prefix)]
+        while stack:
+            key = stack.pop()
+
+            route = self._routes.get(key)
+            if route is not None:
+                yield route
+
+            children = self._dirs.get(key)
+            if children:
+                base = key + '/' if key else ''
+                stack.extend(base + name for name in sorted(children, reverse=True))
@@ -5,21 +5,64 @@
 # the MIT License: http://www.opensource.org/licenses/mit-license.php
 import logging
 
+from .watcher import Watcher
 from .writer import WSGIWriter
 
 
 log = logging.getLogger(__name__)
 
 
-def serve(index, host='localhost', port=8080, debug=True, **kw):
+def serve(index, host='localhost', port=8080, debug=True, render_cache=None,
+          watch=False, reload_index=None, reload_paths=(), profiler=None,
+          stream=False, workers=0, compress=(), watch_exclude=(), **kw):
+    """
+    :param watch:
+        Apply file changes from within the server with a ``Watcher`` rather
+        than relying on werkzeug's reloader to restart the process.
+
+    :param watch_exclude:
+        Globs of files for the ``Watcher`` to ignore, such as the build path.
+        The ``render_cache`` is ignored too.
+
+    :param reload_index:
+        Callable which returns a freshly loaded Index when one of the
+        ``reload_paths`` changes while watching.
+
+    :param stream:
+        Send response bodies as they're rendered (see ``WSGIWriter``).
+
+    Urls without a route but with routes under them get a listing of those.
+
+    :param workers:
+        Handle requests in threads, rendering up to ``workers`` routes at a
+        time. Requests for the same url share a single render and static
+        files are served without waiting for renders. By default requests are
+        handled one at a time.
+
+    :param compress:
+        Content-Encodings to send compressed bodies with to clients which
+        accept them (see ``WSGIWriter``).
+
+    :param profiler:
+        ``Profiler`` to record the timings of each rendered request into.
+    """
     from werkzeug.wsgi import SharedDataMiddleware
     from werkzeug.serving import run_simple
 
-    app = WSGIWriter(index)
+    app = writer = WSGIWriter(index, render_cache=render_cache, stream=stream,
+                              max_concurrent_renders=workers or None, compress=compress,
+                              list_dirs=True)
+    if profiler:
+        writer.subscribe(profiler)
 
     static_routes = dict((index.absolute_url(s.url), index.absolute_path(s.file)) for s in index.static)
 
     log.debug("Adding static routes: %r", static_routes)
     app = SharedDataMiddleware(app, static_routes)
 
-    run_simple(host, port, app, use_debugger=debug, **kw)
+    if watch:
+        exclude_dirs = [render_cache.path] if render_cache is not None else []
+        Watcher(writer, reload_index=reload_index, reload_paths=reload_paths,
+                exclude=watch_exclude, exclude_dirs=exclude_dirs).start()
+
+    run_simple(host, port, app, use_debugger=debug, threaded=bool(workers), **kw)
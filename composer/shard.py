@@ -0,0 +1,155 @@
+# composer/shard.py
+# Copyright 2011 Andrey Petrov
+#
+# This module is part of Composer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import hashlib
+import json
+import logging
+import os
+
+from .cache import atomic_write
+from .compress import EXTENSIONS
+
+log = logging.getLogger(__name__)
+
+
+class ShardError(Exception):
+    "Raised when shard outputs can't be merged, with the list of ``errors``."
+
+    def __init__(self, errors):
+        super(ShardError, self).__init__("Can't merge shards:\n  " + "\n  ".join(errors))
+        self.errors = errors
+
+
+def parse_shard(value):
+    """
+    Parse a shard like '2/8' into ``(shard, num_shards)``, counting shards
+    from 1.
+
+    :raises ValueError: If it's malformed or out of range.
+    """
+    try:
+        shard, num_shards = map(int, value.split('/'))
+    except ValueError:
+        raise ValueError("Shard must look like K/N: %s" % value)
+
+    if not 1 <= shard <= num_shards:
+        raise ValueError("Shard must be between 1 and %d: %s" % (num_shards, value))
+
+    return shard, num_shards
+
+
+def get_shard(url, num_shards):
+    """
+    Get which of ``num_shards`` shards ``url`` belongs to, from a hash which
+    is stable across processes, machines and Python versions.
+    """
+    url = url.lstrip('/')
+    if isinstance(url, unicode):
+        url = url.encode('utf8')
+
+    return int(hashlib.md5(url).hexdigest()[:8], 16) % num_shards + 1
+
+
+class ShardRecord(object):
+    """
+    Record in the build path of a sharded build of which shard it is and the
+    output file (relative to the build path) of each route it rendered.
+    """
+    filename = '.composer-shard.json'
+
+    def __init__(self, shard, num_shards, outputs=None):
+        self.shard = shard
+        self.num_shards = num_shards
+        self.outputs = outputs or {} # url -> path
+
+    @classmethod
+    def load(cls, build_path):
+        path = os.path.join(build_path, cls.filename)
+        try:
+            with open(path) as fp:
+                d = json.load(fp)
+        except (IOError, ValueError) as e:
+            raise ShardError(["Not a shard build: %s (%s)" % (build_path, e)])
+
+        return cls(d['shard'], d['num_shards'], d['outputs'])
+
+    def save(self, build_path):
+        path = os.path.join(build_path, self.filename)
+        atomic_write(path, json.dumps({'shard': self.shard, 'num_shards': self.num_shards, 'outputs': self.outputs}))
+
+
+def check_shards(index, records):
+    """
+    Check that ``records`` are all the shards of one build of ``index``, with
+    every route built exactly once and no two routes writing the same file.
+
+    :returns: List of error messages, empty if they can be merged.
+    """
+    errors = []
+
+    num_shards = set(record.num_shards for record in records)
+    if len(num_shards) != 1:
+        return ["Shards are from builds with different numbers of shards: %s" % sorted(num_shards)]
+    num_shards = num_shards.pop()
+
+    shards = [record.shard for record in records]
+    for shard in sorted(set(shards)):
+        if shards.count(shard) > 1:
+            errors.append("Shard %d/%d was given more than once." % (shard, num_shards))
+    for shard in sorted(set(xrange(1, num_shards + 1)) - set(shards)):
+        errors.append("Shard %d/%d is missing." % (shard, num_shards))
+
+    if errors:
+        return errors
+
+    url_shards = {}
+    path_urls = {}
+    for record in records:
+        for url, path in record.outputs.iteritems():
+            if get_shard(url, num_shards) != record.shard:
+                errors.append("Route %s doesn't belong in shard %d/%d." % (url, record.shard, num_shards))
+            url_shards[url] = record.shard
+
+            other_url = path_urls.setdefault(path, url)
+            if other_url != url:
+                errors.append("Routes %s and %s both write %s." % (other_url, url, path))
+
+    for route in index.routes:
+        shard = url_shards.pop(route.url, None)
+        if shard is None:
+            errors.append("Route %s is missing from shard %d/%d." % (route.url, get_shard(route.url, num_shards), num_shards))
+
+    for url, shard in sorted(url_shards.iteritems()):
+        errors.append("Route %s of shard %d/%d isn't in the index." % (url, shard, num_shards))
+
+    return errors
+
+
+def merge_shards(index, shard_paths, build_path, sync):
+    """
+    Check the sharded builds in ``shard_paths`` and put their outputs
+    together into ``build_path`` with the ``StaticSync`` ``sync``, including
+    any compressed siblings of the outputs.
+
+    :raises ShardError: If the shards can't be merged, see ``check_shards``.
+    """
+    records = [ShardRecord.load(path) for path in shard_paths]
+
+    errors = check_shards(index, records)
+    if errors:
+        raise ShardError(errors)
+
+    pairs = []
+    for shard_path, record in zip(shard_paths, records):
+        log.info("Merging shard %d/%d: %s", record.shard, record.num_shards, shard_path)
+        for path in record.outputs.itervalues():
+            for ext in ('',) + EXTENSIONS:
+                src = os.path.join(shard_path, path + ext)
+                if ext and not os.path.exists(src):
+                    continue
+                pairs.append((src, os.path.join(build_path, path + ext)))
+
+    sync.sync_files(pairs)
@@ -0,0 +1,234 @@
+# composer/sync.py
+# Copyright 2011 Andrey Petrov
+#
+# This module is part of Composer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import errno
+import json
+import logging
+import os
+import shutil
+
+from multiprocessing.pool import ThreadPool
+
+from .cache import atomic_write, content_key, makedirs
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = False
+
+
+log = logging.getLogger(__name__)
+
+
+FICLONE = 0x40049409 # Linux ioctl for copy-on-write clones (btrfs, xfs, ...)
+
+MODES = ('copy', 'link', 'reflink')
+
+
+def copy_file(src, dst):
+    shutil.copy2(src, dst)
+
+
+def link_file(src, dst):
+    os.link(src, dst)
+
+
+def reflink_file(src, dst):
+    if not fcntl:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported on this platform.")
+
+    with open(src, 'rb') as src_fp:
+        with open(dst, 'wb') as dst_fp:
+            fcntl.ioctl(dst_fp.fileno(), FICLONE, src_fp.fileno())
+
+    shutil.copystat(src, dst)
+
+
+class StaticSync(object):
+    """
+    Mirror static source trees into the build, only touching what changed.
+
+    Files are considered current when their size and mtime match the source
+    (or when they're already a hard link to it). Changed files are copied,
+    hard linked or reflinked depending on ``mode`` across a pool of ``jobs``
+    threads, falling back to copying when linking isn't possible (such as
+    across filesystems).
+
+    A record of the files each destination received is kept so that files
+    which disappear from the source are removed from the destination, without
+    touching anything else that lives there.
+
+    :param mode:
+        One of 'copy', 'link' or 'reflink'.
+
+    :param state_path:
+        Directory to keep the records in, outside of the build so that they
+        aren't deployed with it (see ``composer.manifest.get_state_path``).
+        Without it, they're kept in each destination as ``record_filename``,
+        where earlier builds also left them.
+    """
+    record_filename = '.composer-static.json'
+
+    def __init__(self, mode='copy', jobs=4, state_path=None):
+        if mode not in MODES:
+            raise ValueError("Invalid static sync mode: %s" % mode)
+
+        self.mode = mode
+        self.jobs = jobs
+        self.state_path = state_path
+
+        self.num_copied = 0
+        self.num_skipped = 0
+        self.num_removed = 0
+
+        self._can_link = mode != 'copy'
+
+    def _is_current(self, src_stat, dst_path):
+        try:
+            dst_stat = os.stat(dst_path)
+        except OSError:
+            return False
+
+        if (src_stat.st_ino, src_stat.st_dev) == (dst_stat.st_ino, dst_stat.st_dev):
+            return True
+
+        return src_stat.st_size == dst_stat.st_size and int(src_stat.st_mtime) == int(dst_stat.st_mtime)
+
+    def _sync_file(self, paths):
+        src, dst = paths
+
+        # Never write through an existing file, it might be a hard link to
+        # the source.
+        tmp_path = os.path.join(os.path.dirname(dst), '.composer-%s.tmp' % os.path.basename(dst))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path) # Left over from an interrupted build.
+
+        try:
+            if self._can_link:
+                try:
+                    (link_file if self.mode == 'link' else reflink_file)(src, tmp_path)
+                except (IOError, OSError) as e:
+                    if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS):
+                        log.info("Can't %s static files here, falling back to copying: %s", self.mode, e)
+                        self._can_link = False
+                    elif e.errno != errno.EXDEV:
+                        raise
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    copy_file(src, tmp_path)
+            else:
+                copy_file(src, tmp_path)
+
+            os.rename(tmp_path, dst)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def _get_record_path(self, dst):
+        if not self.state_path:
+            return os.path.join(dst, self.record_filename)
+
+        return os.path.join(self.state_path, 'static', content_key(os.path.abspath(dst)) + '.json')
+
+    def _load_record(self, dst):
+        for path in [self._get_record_path(dst), os.path.join(dst, self.record_filename)]:
+            try:
+                with open(path) as fp:
+                    return set(json.load(fp))
+            except (IOError, ValueError):
+                pass
+
+        return set()
+
+    def _save_record(self, dst, paths):
+        path = self._get_record_path(dst)
+        makedirs(os.path.dirname(path))
+        atomic_write(path, json.dumps(sorted(paths)))
+
+        legacy_path = os.path.join(dst, self.record_filename)
+        if path != legacy_path and os.path.exists(legacy_path):
+            os.remove(legacy_path)
+
+    def _sync_pending(self, pending):
+        if not pending:
+            return
+
+        pool = ThreadPool(self.jobs)
+        try:
+            pool.map(self._sync_file, pending)
+        finally:
+            pool.close()
+            pool.join()
+        self.num_copied += len(pending)
+
+    def sync_files(self, pairs):
+        """
+        Put each file of the ``(src, dst)`` pairs into place, unless the
+        destination is already current. Unlike ``sync``, nothing is removed.
+        """
+        pending = []
+        dirs = set()
+
+        for src, dst in pairs:
+            if self._is_current(os.stat(src), dst):
+                self.num_skipped += 1
+                continue
+
+            dst_dir = os.path.dirname(dst)
+            if dst_dir not in dirs:
+                makedirs(dst_dir)
+                dirs.add(dst_dir)
+
+            pending.append((src, dst))
+
+        self._sync_pending(pending)
+
+    def sync(self, src, dst):
+        """
+        Mirror the tree at ``src`` into ``dst``.
+        """
+        dst = os.path.normpath(dst)
+        makedirs(dst)
+
+        paths = set()
+        pending = []
+
+        for dirpath, dirnames, filenames in os.walk(src, followlinks=True):
+            rel_dir = os.path.relpath(dirpath, src)
+            dst_dir = os.path.normpath(os.path.join(dst, rel_dir))
+            makedirs(dst_dir)
+
+            for filename in filenames:
+                rel_path = os.path.normpath(os.path.join(rel_dir, filename))
+                src_path = os.path.join(dirpath, filename)
+                dst_path = os.path.join(dst_dir, filename)
+
+                paths.add(rel_path)
+
+                if self._is_current(os.stat(src_path), dst_path):
+                    self.num_skipped += 1
+                    continue
+
+                pending.append((src_path, dst_path))
+
+        self._sync_pending(pending)
+
+        for rel_path in self._load_record(dst) - paths:
+            dst_path = os.path.join(dst, rel_path)
+            if not os.path.exists(dst_path):
+                continue
+
+            log.debug("Removing deleted static file: %s", dst_path)
+            os.remove(dst_path)
+            self.num_removed += 1
+
+            dir_path = os.path.dirname(dst_path)
+            while dir_path != dst and not os.listdir(dir_path):
+                os.rmdir(dir_path)
+                dir_path = os.path.dirname(dir_path)
+
+        self._save_record(dst, paths)
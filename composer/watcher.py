@@ -0,0 +1,140 @@
+# composer/watcher.py
+# Copyright 2011 Andrey Petrov
+#
+# This module is part of Composer and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+import logging
+import os
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+
+class Watcher(threading.Thread):
+    """
+    Poll the files under the index's ``base_path`` from within a running
+    server and apply changes to it without restarting the process.
+
+    * Changes to any of ``reload_paths`` (such as the index.json or the indexer
+      module) reload the whole index with ``reload_index``.
+    * Files appearing or disappearing regenerate the index's routes and only
+      the routes which were added, removed or changed are dropped from the
+      app's caches.
+    * Modified files drop the cached bodies of the routes which depend on them
+      (see ``Index.dependencies``).
+
+    :param app:
+        The ``WSGIWriter`` being served.
+
+    :param reload_index:
+        Callable which returns a freshly loaded Index.
+
+    :param reload_paths:
+        Paths which trigger ``reload_index`` when changed.
+
+    :param interval:
+        Seconds to wait between polls.
+
+    :param exclude:
+        List of globs (relative to ``base_path``, like for ``Index.walk``) of
+        files to ignore, such as a build path. Directories excluded in their
+        entirety (``build/*``) aren't scanned at all. Hidden files and
+        compiled Python modules are always ignored.
+
+    :param exclude_dirs:
+        Paths of directories to ignore, such as a render cache. The index's
+        ``cache_path`` is always ignored.
+    """
+    daemon = True
+
+    default_exclude = ['.*', '*/.*', '*.pyc', '*.pyo']
+
+    def __init__(self, app, reload_index=None, reload_paths=(), interval=0.5, exclude=None, exclude_dirs=()):
+        super(Watcher, self).__init__(name='composer-watcher')
+
+        self.app = app
+        self.reload_index = reload_index
+        self.reload_paths = set(os.path.abspath(p) for p in reload_paths)
+        self.interval = interval
+        self.exclude = list(exclude or ())
+        self.exclude_dirs = list(exclude_dirs)
+
+        self._snapshot = self._scan()
+
+    def _get_exclude(self):
+        index = self.app.index # Can be replaced by reload_index.
+        exclude = self.default_exclude + self.exclude
+
+        for path in [index.cache_path] + self.exclude_dirs:
+            if not path:
+                continue
+
+            path = index.relative_path(os.path.abspath(path))
+            if not path.startswith(os.pardir):
+                exclude.append(os.path.join(path, '*'))
+
+        return exclude
+
+    def _scan(self):
+        snapshot = {}
+
+        index = self.app.index
+        for path, stat in index.walk(exclude=self._get_exclude(), stat=True):
+            snapshot[os.path.join(index.base_path, path)] = (stat.st_mtime, stat.st_size)
+
+        for path in self.reload_paths:
+            try:
+                stat = os.stat(path)
+                snapshot[path] = (stat.st_mtime, stat.st_size)
+            except OSError:
+                pass
+
+        return snapshot
+
+    def check(self):
+        """
+        Compare the files with the previous poll and apply the changes.
+        """
+        old, new = self._snapshot, self._scan()
+        self._snapshot = new
+
+        created = set(new) - set(old)
+        deleted = set(old) - set(new)
+        modified = set(p for p in set(new) & set(old) if new[p] != old[p])
+
+        if not (created or deleted or modified):
+            return
+
+        changed = created | deleted | modified
+        if self.reload_index and changed & self.reload_paths:
+            log.info("Reloading index: %s", ', '.join(changed & self.reload_paths))
+            try:
+                self.app.set_index(self.reload_index())
+            except Exception:
+                log.exception("Failed to reload index, keeping the previous one.")
+            return
+
+        if created or deleted:
+            added, removed, updated = self.app.index.refresh_routes()
+            for url in sorted(added):
+                log.info("Added route: /%s", url)
+            for url in sorted(removed):
+                log.info("Removed route: /%s", url)
+
+            self.app.invalidate(added | removed | updated)
+
+        if modified:
+            urls = self.app.index.dependencies.get_dependents(modified)
+            log.debug("Invalidating routes depending on modified files: %r", urls)
+            self.app.invalidate(urls)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception:
+                log.exception("Failed to apply file changes.")
@@ -5,23 +5,131 @@
 # the MIT License: http://www.opensource.org/licenses/mit-license.php
 
 
+import cgi
 import codecs
 import logging
 import mimetypes
 import os
+import threading
+import time
+
+from email.utils import formatdate, parsedate_tz, mktime_tz
+
+from multiprocessing.pool import ThreadPool
+
+from . import deps
+from .cache import LRUCache, atomic_write, content_key, hash_object, makedirs
+from .compress import ENCODINGS, choose_encoding, compress, get_encodings, is_compressible
+from .filters import join_chunks
+from .routing import normalize_url
 
 
 log = logging.getLogger(__name__)
 
 
+def _read_chunks(path, chunk_size=65536, binary=False):
+    deps.record(path)
+    fp = open(path, 'rb') if binary else codecs.open(path, encoding='utf8')
+    with fp:
+        while True:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _timed(chunks, timing):
+    "Yield from ``chunks``, adding the time spent producing them to ``timing[1]``."
+    chunks = iter(chunks)
+    while True:
+        start = time.time()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            return
+        finally:
+            timing[1] += time.time() - start
+        yield chunk
+
+
+def _iter_encoded(chunks):
+    for chunk in chunks:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf8')
+        if chunk:
+            yield chunk
+
+
+def _coalesce(chunks, size=65536):
+    "Join small chunks (such as template fragments) into ones of about ``size`` bytes."
+    buf = []
+    buf_size = 0
+    for chunk in chunks:
+        buf.append(chunk)
+        buf_size += len(chunk)
+        if buf_size >= size:
+            yield ''.join(buf)
+            buf = []
+            buf_size = 0
+
+    if buf:
+        yield ''.join(buf)
+
+
+class _FileWrapper(object):
+    "Fallback for servers which don't provide ``wsgi.file_wrapper``."
+
+    def __init__(self, fp, block_size=65536):
+        self.fp = fp
+        self.block_size = block_size
+
+    def __iter__(self):
+        return iter(lambda: self.fp.read(self.block_size), '')
+
+    def close(self):
+        self.fp.close()
+
+
 class Writer(object):
     """
     Writer only cares about the ``filters`` and ``base_path`` in the
     ``index``. It doesn't know anything about the routes, but only knows
     how to render them once they're received.
+
+    :param render_cache:
+        Optional cache (such as :class:`composer.cache.DiskCache`) used to
+        memoize the output of filters which are marked as ``pure``.
     """
-    def __init__(self, index):
+    def __init__(self, index, render_cache=None):
+        self.index = index
+        self.render_cache = render_cache
+
+        self.listeners = []
+        self._filter_keys = {}
+
+    def subscribe(self, callback):
+        """
+        Call ``callback(event, route, **data)`` on each render event:
+
+        * ``'render'`` once a route is rendered, with ``elapsed`` seconds and
+          ``filters``, a list of ``(filter_id, elapsed)``.
+        * ``'write'`` once a FileWriter wrote a route, with ``elapsed`` seconds
+          and the file ``path``.
+
+        See ``composer.profiler.Profiler`` for an example.
+        """
+        self.listeners.append(callback)
+
+    def _emit(self, event, route, **data):
+        for callback in self.listeners:
+            callback(event, route, **data)
+
+    def set_index(self, index):
+        """
+        Switch to rendering from a new index, such as after it's reloaded.
+        """
         self.index = index
+        self._filter_keys = {}
 
     def _guess_content_type(self, path):
         filename = os.path.basename(path)
@@ -31,15 +139,96 @@ class Writer(object):
 
         return mimetypes.guess_type(path)[0]
 
-    def render_route(self, route):
-        file_path = route.file
-        with codecs.open(file_path, encoding='utf8') as fp:
-            content = fp.read()
+    def is_binary(self, route):
+        """
+        Whether the route's content passes through only ``binary`` filters (or
+        none at all), so its file can be read as bytes without decoding it.
+        """
+        return all(getattr(self.index.filters[filter_id], 'binary', False) for filter_id in route.filters)
+
+    def _iter_route(self, route, stats=None):
+        paths = set()
 
+        # Each stage pulls from the one before it, so their timings include
+        # the time spent upstream.
+        timings = [['read', 0.0]]
+        chunks = _timed(_read_chunks(route.file, binary=self.is_binary(route)), timings[0])
         for filter_id in route.filters:
-            content = self.index.filters[filter_id](content, route=route)
+            timings.append([filter_id, 0.0])
+            chunks = _timed(self._filter_chunks(filter_id, chunks, route), timings[-1])
+
+        while True:
+            with deps.recording(paths):
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    break
+            yield chunk
+
+        self.index.dependencies.set(route.url, paths)
+
+        elapsed = timings[-1][1]
+        if stats is not None:
+            stats['elapsed'] = elapsed
+
+        if self.listeners:
+            filter_timings = [(timings[i][0], timings[i][1] - timings[i - 1][1]) for i in xrange(1, len(timings))]
+            self._emit('render', route, elapsed=elapsed, filters=filter_timings)
+
+    def iter_route(self, route):
+        """
+        Render the route through its filters as an iterator of chunks of
+        unicode or utf8 strings. Filters which support ``stream`` pass their
+        output along as they produce it, the others get the joined output of
+        the filter before them. Routes without filters yield the bytes of
+        their file as they are.
+
+        The files which were read along the way are recorded in
+        ``index.dependencies`` once the iterator is exhausted.
+        """
+        return self._iter_route(route)
+
+    def render_route(self, route):
+        """
+        Render the route through its filters. The files which were read along
+        the way are recorded in ``index.dependencies``.
+        """
+        return join_chunks(self._iter_route(route))
 
-        return content
+    def _get_filter_key(self, filter_id, filter_obj):
+        key = self._filter_keys.get(filter_id)
+        if key is None:
+            cls = filter_obj.__class__
+            filter_kwargs = self.index._filters_kwargs_cache.get(filter_id)
+            key = content_key(filter_id, cls.__module__, cls.__name__, hash_object(filter_kwargs))
+            self._filter_keys[filter_id] = key
+
+        return key
+
+    def _filter_chunks(self, filter_id, chunks, route):
+        filter_obj = self.index.filters[filter_id]
+
+        stream = getattr(filter_obj, 'stream', None)
+        if stream is None or (self.render_cache is not None and getattr(filter_obj, 'pure', False)):
+            yield self.apply_filter(filter_id, join_chunks(chunks), route)
+            return
+
+        for chunk in stream(chunks, route=route):
+            yield chunk
+
+    def apply_filter(self, filter_id, content, route):
+        filter_obj = self.index.filters[filter_id]
+
+        if self.render_cache is None or not getattr(filter_obj, 'pure', False):
+            return filter_obj(content, route=route)
+
+        key = content_key(self._get_filter_key(filter_id, filter_obj), content)
+        result = self.render_cache.get(key)
+        if result is None:
+            result = filter_obj(content, route=route)
+            self.render_cache.set(key, result)
+
+        return result
 
     def __call__(self, path):
         route = self.index.get_route(path)
@@ -47,14 +236,128 @@ class Writer(object):
             return self.render_route(route)
 
 
+class _PendingRender(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
 class WSGIWriter(Writer):
+    """
+    Writer which renders routes on request as a WSGI app.
+
+    Responses carry a strong ETag derived from the mtime and size of the
+    source file and the other files it was last rendered from (such as
+    templates), the route's filters and its context, along with a
+    Last-Modified header, so conditional requests are answered with a 304
+    without rendering. Rendered bodies of up to ``max_cached_body_size``
+    bytes are kept in ``body_cache`` (up to ``body_cache_size`` of them) until
+    their ETag changes.
+
+    When served by a threaded server, concurrent requests for the same url
+    share a single render, and at most ``max_concurrent_renders`` routes are
+    rendered at a time (if given) so that slow renders can't starve the
+    other requests.
+
+    :param stream:
+        Send bodies as they're rendered instead of rendering them whole
+        first, without a Content-Length. Streamed renders aren't shared.
+
+    :param compress:
+        Content-Encodings (see ``composer.compress.ENCODINGS``) to compress
+        bodies of compressible types with, in order of preference, when the
+        request's Accept-Encoding allows it. Compressed bodies are cached
+        along with the plain ones. Streamed bodies are sent uncompressed.
+
+    :param list_dirs:
+        Answer requests for urls which have no route but have routes under
+        them with a listing of those, like a directory.
+
+    Routes without filters are sent straight from their file through the
+    server's ``wsgi.file_wrapper`` (which can use ``sendfile``) instead of
+    being read and cached, unless they're sent compressed.
+
+    Urls are matched regardless of trailing slashes and ``index.html`` (see
+    ``Index.get_route``).
+    """
+    def __init__(self, index, body_cache_size=256, stream=False, max_cached_body_size=1024 * 1024,
+                 max_concurrent_renders=None, compress=(), list_dirs=False, **kw):
+        super(WSGIWriter, self).__init__(index, **kw)
+
+        self.list_dirs = list_dirs
+        self.body_cache = LRUCache(body_cache_size)
+        self.stream = stream
+        self.max_cached_body_size = max_cached_body_size
+        self.compress = get_encodings(compress)
+
+        self._render_slots = None
+        if max_concurrent_renders:
+            self._render_slots = threading.BoundedSemaphore(max_concurrent_renders)
+
+        self._pending = {} # url -> _PendingRender
+        self._pending_lock = threading.Lock()
+
+    def set_index(self, index):
+        super(WSGIWriter, self).set_index(index)
+        self.body_cache.clear()
+
+    def invalidate(self, urls):
+        "Drop the cached bodies of the given urls."
+        for url in urls:
+            self.body_cache.pop(normalize_url(url))
+
+    def _stat_dependencies(self, route):
+        """
+        Get the latest mtime and a list of ``(path, mtime, size)`` of the
+        route's source file and its known dependencies.
+        """
+        paths = set(self.index.dependencies.get_dependencies(route.url))
+        paths.add(os.path.abspath(route.file))
+
+        stats = []
+        for path in sorted(paths):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                if path == os.path.abspath(route.file):
+                    raise
+                continue # Removed dependency, the next render will forget it.
+            stats.append((path, stat.st_mtime, stat.st_size))
+
+        return max(mtime for _, mtime, _ in stats), stats
+
+    def get_etag(self, route, stats):
+        filters_kwargs = [self.index._filters_kwargs_cache.get(filter_id) for filter_id in route.filters]
+        key = content_key(repr(stats), ' '.join(route.filters),
+                          hash_object(filters_kwargs), hash_object(route.context))
+        return '"%s"' % key
+
+    def _is_not_modified(self, environ, etag, mtime):
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            etags = [e.strip() for e in if_none_match.split(',')]
+            return '*' in etags or etag in etags
+
+        if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since:
+            t = parsedate_tz(if_modified_since.split(';')[0])
+            return t is not None and int(mtime) <= mktime_tz(t)
+
+        return False
 
     def __call__(self, environ, start_response):
         # Translate to remove the base_url
         path = environ.get('PATH_INFO', '')
-        content = super(WSGIWriter, self).__call__(path)
+        route = self.index.get_route(path)
+
+        if route is None:
+            children = self.list_dirs and self.index.list_dir(path)
+            if children:
+                body = self._render_dir(path, children)
+                start_response('200 OK', [('Content-Type', 'text/html; charset=utf-8'),
+                                          ('Content-Length', str(len(body)))])
+                return [body]
 
-        if content is None:
             start_response('404 NOT FOUND', [('Content-Type', 'text/plain')])
             return ['Not Found']
 
@@ -64,19 +367,216 @@ class WSGIWriter(Writer):
             log.warn("Serving literal file of unknown content type: /%s  "
                      "(Hint: Add / suffix to treat it as a directory)", path)
 
-        start_response('200 OK', [('Content-Type', content_type)])
+        encoding = None
+        vary = []
+        if self.compress and is_compressible(content_type):
+            encoding = choose_encoding(environ.get('HTTP_ACCEPT_ENCODING'), self.compress)
+            vary = [('Vary', 'Accept-Encoding')]
+
+        mtime, stats = self._stat_dependencies(route)
+        etag = self.get_etag(route, stats)
+
+        if self._is_not_modified(environ, self._get_encoded_etag(etag, encoding), mtime):
+            start_response('304 NOT MODIFIED', [
+                ('ETag', self._get_encoded_etag(etag, encoding)),
+                ('Last-Modified', formatdate(mtime, usegmt=True)),
+            ] + vary)
+            return []
+
+        if not route.filters and not encoding:
+            return self._send_file(environ, start_response, route, [
+                ('Content-Type', content_type),
+                ('ETag', etag),
+                ('Last-Modified', formatdate(mtime, usegmt=True)),
+            ] + vary)
+
+        cached = self.body_cache.get(normalize_url(route.url))
+        if cached and cached[0] == etag:
+            etag, content, variants = cached
+        elif self.stream:
+            start_response('200 OK', [
+                ('Content-Type', content_type),
+                ('ETag', etag),
+                ('Last-Modified', formatdate(mtime, usegmt=True)),
+            ] + vary)
+            return self._iter_body(route)
+        else:
+            etag, mtime, content, variants = self._render_shared(route)
+
+        headers = [('Content-Type', content_type)]
+
+        if encoding:
+            encoded = variants.get(encoding)
+            if encoded is None:
+                encoded = variants[encoding] = compress(content, encoding)
+            content = encoded
+            etag = self._get_encoded_etag(etag, encoding)
+            headers.append(('Content-Encoding', encoding))
+
+        headers += [
+            ('Content-Length', str(len(content))),
+            ('ETag', etag),
+            ('Last-Modified', formatdate(mtime, usegmt=True)),
+        ] + vary
+
+        start_response('200 OK', headers)
         return [content]
 
+    def _render_dir(self, path, children):
+        def escape(s):
+            if isinstance(s, str):
+                s = s.decode('utf8', 'replace')
+            return cgi.escape(s, quote=True)
+
+        base = escape(self.index.absolute_url(normalize_url(path)).rstrip('/') + '/')
+
+        items = []
+        for name, has_children in children:
+            name = escape(name) + ('/' if has_children else '')
+            items.append(u'<li><a href="%s%s">%s</a></li>' % (base, name, name))
+
+        body = u'<html><head><title>Index of %s</title></head><body><h1>Index of %s</h1><ul>%s</ul></body></html>' % (
+            base, base, u''.join(items))
+        return body.encode('utf8')
+
+    def _send_file(self, environ, start_response, route, headers):
+        fp = open(route.file, 'rb')
+        self.index.dependencies.set(route.url, [os.path.abspath(route.file)])
+
+        headers.insert(1, ('Content-Length', str(os.fstat(fp.fileno()).st_size)))
+        start_response('200 OK', headers)
+
+        file_wrapper = environ.get('wsgi.file_wrapper', _FileWrapper)
+        return file_wrapper(fp, 65536)
+
+    def _get_encoded_etag(self, etag, encoding):
+        if not encoding:
+            return etag
+        return '%s-%s"' % (etag[:-1], encoding)
+
+    def _render(self, route):
+        if self._render_slots:
+            self._render_slots.acquire()
+        try:
+            content = self.render_route(route)
+        finally:
+            if self._render_slots:
+                self._render_slots.release()
+
+        if isinstance(content, unicode):
+            content = content.encode('utf8')
+
+        # Rendering might have discovered new dependencies.
+        mtime, stats = self._stat_dependencies(route)
+        etag = self.get_etag(route, stats)
+        variants = {} # Content-Encoding -> compressed content
+        if len(content) <= self.max_cached_body_size:
+            self.body_cache.set(normalize_url(route.url), (etag, content, variants))
+
+        return etag, mtime, content, variants
+
+    def _render_shared(self, route):
+        """
+        Render the route, or wait for the result if another request is
+        already rendering it.
+        """
+        key = normalize_url(route.url)
+
+        with self._pending_lock:
+            pending = self._pending.get(key)
+            is_owner = pending is None
+            if is_owner:
+                pending = self._pending[key] = _PendingRender()
+
+        if not is_owner:
+            pending.done.wait()
+            if pending.result is not None:
+                return pending.result
+
+            # The render failed, try again so that this request gets the
+            # error too.
+            return self._render(route)
+
+        try:
+            pending.result = self._render(route)
+            return pending.result
+        finally:
+            with self._pending_lock:
+                del self._pending[key]
+            pending.done.set()
+
+    def _iter_body(self, route):
+        body = []
+        body_size = 0
+
+        if self._render_slots:
+            self._render_slots.acquire()
+        try:
+            for chunk in _coalesce(_iter_encoded(self.iter_route(route))):
+                if body is not None:
+                    body_size += len(chunk)
+                    body.append(chunk)
+                    if body_size > self.max_cached_body_size:
+                        body = None
+                yield chunk
+        finally:
+            if self._render_slots:
+                self._render_slots.release()
+
+        if body is not None:
+            mtime, stats = self._stat_dependencies(route)
+            self.body_cache.set(normalize_url(route.url), (self.get_etag(route, stats), ''.join(body), {}))
+
 
 class FileWriter(Writer):
     """
     Writer who creates a static filesystem structure to mimic the desired url
     structures.
+
+    :param atomic:
+        Write each file into a temporary file first and rename it into place,
+        so an interrupted build never leaves half-written files behind.
+        Routes are always written this way, since they're rendered while
+        they're written and a failed render mustn't truncate the previous
+        output.
+
+    :param skip_unchanged:
+        Don't rewrite files whose content is already identical, leaving their
+        mtime alone for rsync and CDN diffing.
+
+    :param compress:
+        Content-Encodings (see ``composer.compress.ENCODINGS``) to write
+        precompressed siblings (like ``index.html.gz``) of written files with,
+        for servers like nginx's ``gzip_static``. Only files of compressible
+        types and of at least ``compress_min_size`` bytes are compressed,
+        across ``compress_jobs`` threads in the background until ``flush``.
+        Unchanged files are only compressed if a sibling is missing.
+
+    Routes are written to disk chunk by chunk as they're rendered (see
+    ``Writer.iter_route``).
+
+    The number of files written, skipped and compressed is counted in
+    ``num_written``, ``num_skipped`` and ``num_compressed``.
     """
-    def __init__(self, index, build_path='build'):
-        super(FileWriter, self).__init__(index)
+    def __init__(self, index, build_path='build', atomic=False, skip_unchanged=False,
+                 compress=(), compress_jobs=4, compress_min_size=256, **kw):
+        super(FileWriter, self).__init__(index, **kw)
 
         self.build_path = build_path
+        self.atomic = atomic
+        self.skip_unchanged = skip_unchanged
+        self.compress = get_encodings(compress)
+        self.compress_jobs = compress_jobs
+        self.compress_min_size = compress_min_size
+
+        self.num_written = 0
+        self.num_skipped = 0
+        self.num_compressed = 0
+
+        self._compress_pool = None
+        self._compress_results = []
+
+        self._prepared_dirs = set()
 
         self._prepare_dir(build_path)
 
@@ -96,13 +596,111 @@ class FileWriter(Writer):
         return url_path, index_file
 
     def _prepare_dir(self, path):
-        if not os.path.exists(path):
-            os.makedirs(path)
+        if path in self._prepared_dirs:
+            return
+
+        makedirs(path)
+        self._prepared_dirs.add(path)
+
+    def _is_unchanged(self, path, content):
+        try:
+            if os.path.getsize(path) != len(content):
+                return False
+
+            with open(path, 'rb') as fp:
+                return fp.read() == content
+        except (IOError, OSError):
+            return False
 
     def _write_file(self, path, content):
-        fp = open(path, 'w')
-        fp.write(content)
-        fp.close()
+        """
+        Write ``content`` into ``path``, either a string or an iterable of
+        chunks.
+        """
+        if not isinstance(content, basestring):
+            return self._write_file_chunks(path, content)
+
+        if isinstance(content, unicode):
+            content = content.encode('utf8')
+
+        if self.skip_unchanged and self._is_unchanged(path, content):
+            log.debug("Skipping unchanged file: %s", path)
+            self.num_skipped += 1
+            return
+
+        if not self.atomic:
+            with open(path, 'wb') as fp:
+                fp.write(content)
+            self.num_written += 1
+            return
+
+        atomic_write(path, content)
+        self.num_written += 1
+
+    def _write_file_chunks(self, path, chunks):
+        # Rendering happens while the chunks are written, so always write a
+        # temporary file first: a failed render must not truncate the previous
+        # output. The size isn't known upfront either, so compare while
+        # writing and only move it into place if it's different.
+        if not atomic_write(path, _iter_encoded(chunks), skip_unchanged=self.skip_unchanged):
+            log.debug("Skipping unchanged file: %s", path)
+            self.num_skipped += 1
+            return
+
+        self.num_written += 1
+
+    def _write_compressed(self, path, encodings):
+        with open(path, 'rb') as fp:
+            content = fp.read()
+
+        stat = os.stat(path)
+        num_compressed = 0
+
+        for encoding in encodings:
+            compressed_path = path + ENCODINGS[encoding][0]
+
+            if len(content) < self.compress_min_size:
+                # Don't leave a sibling of previous content behind.
+                if os.path.exists(compressed_path):
+                    os.remove(compressed_path)
+                continue
+
+            atomic_write(compressed_path, compress(content, encoding), times=(stat.st_atime, stat.st_mtime))
+            num_compressed += 1
+
+        return num_compressed
+
+    def compress_file(self, path, only_missing=False):
+        """
+        Write the compressed siblings of ``path`` in the background, if it's
+        of a compressible type.
+
+        :param only_missing:
+            Only write the siblings which don't exist, such as when the file
+            didn't change.
+        """
+        if not self.compress or not is_compressible(self._guess_content_type(path)):
+            return
+
+        encodings = self.compress
+        if only_missing:
+            encodings = [e for e in encodings if not os.path.exists(path + ENCODINGS[e][0])]
+            if not encodings or os.path.getsize(path) < self.compress_min_size:
+                return
+
+        if self._compress_pool is None:
+            self._compress_pool = ThreadPool(self.compress_jobs)
+
+        self._compress_results.append(self._compress_pool.apply_async(self._write_compressed, (path, encodings)))
+
+    def flush(self):
+        """
+        Wait for the compressed files being written in the background, raising
+        the first error if any failed.
+        """
+        results, self._compress_results = self._compress_results, []
+        for result in results:
+            self.num_compressed += result.get()
 
     def materialize_url(self, url, content=None, default_index_file='index.html'):
         url = url.lstrip('/')
@@ -122,16 +720,46 @@ class FileWriter(Writer):
         if not file_path or content is None:
             return url_path
 
+        num_written = self.num_written
         self._write_file(file_path, content)
-        return file_path
 
-    def __call__(self, path):
-        content = super(FileWriter, self).__call__(path)
+        if self.compress:
+            self.compress_file(file_path, only_missing=self.num_written == num_written)
 
+        return file_path
+
+    def _split_index_file(self, path):
         index_file = 'index.html'
         if path.endswith('.html'):
             # Leave .html files alone.
             # TODO: Allow other pass-through extensions like .htm?
             path, index_file = os.path.dirname(path), os.path.basename(path)
 
+        return path, index_file
+
+    def get_file_path(self, path):
+        """
+        Get the path of the file which ``path`` gets materialized into.
+        """
+        url_path, index_file = self._get_materialize_path(*self._split_index_file(path))
+        return os.path.join(url_path, index_file)
+
+    def materialize_route(self, route):
+        start = time.time()
+        stats = {}
+
+        path, index_file = self._split_index_file(route.url)
+        file_path = self.materialize_url(path, self._iter_route(route, stats), index_file)
+
+        if self.listeners:
+            # Rendering happened while writing, leave its share out.
+            elapsed = time.time() - start - stats.get('elapsed', 0.0)
+            self._emit('write', route, elapsed=elapsed, path=file_path)
+
+        return file_path
+
+    def __call__(self, path):
+        content = super(FileWriter, self).__call__(path)
+
+        path, index_file = self._split_index_file(path)
         self.materialize_url(path, content, index_file)
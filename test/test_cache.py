@@ -0,0 +1,89 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append('../')
+
+from composer.cache import LRUCache, DiskCache, atomic_write, makedirs
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_eviction(self):
+        c = LRUCache(2)
+        c.set('a', 1)
+        c.set('b', 2)
+        self.assertEqual(c.get('a'), 1)
+
+        c.set('c', 3)
+        self.assertEqual(c.get('b'), None)
+        self.assertEqual(c.get('a'), 1)
+        self.assertEqual(c.get('c'), 3)
+
+        self.assertEqual((c.hits, c.misses), (3, 1))
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_roundtrip(self):
+        c = DiskCache(self.path)
+        c.set('a' * 40, u'caf\xe9')
+        c.set('b' * 40, 'bytes')
+
+        c = DiskCache(self.path)
+        self.assertEqual(len(c), 2)
+        self.assertEqual(c.get('a' * 40), u'caf\xe9')
+        self.assertEqual(c.get('b' * 40), 'bytes')
+        self.assertEqual(c.get('c' * 40), None)
+
+    def test_eviction(self):
+        c = DiskCache(self.path, max_size=20)
+        c.set('a' * 40, 'x' * 9)
+        c.set('b' * 40, 'x' * 9)
+        c.get('a' * 40)
+        c.set('c' * 40, 'x' * 9)
+
+        self.assertEqual(c.get('b' * 40), None)
+        self.assertEqual(c.get('a' * 40), 'x' * 9)
+        self.assertEqual(len(c), 2)
+
+
+class TestAtomicWrite(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_atomic_write(self):
+        path = os.path.join(self.path, 'a', 'b', 'f')
+        makedirs(os.path.dirname(path))
+        makedirs(os.path.dirname(path))
+
+        self.assertTrue(atomic_write(path, 'foo', times=(0, 0)))
+        self.assertEqual(os.path.getmtime(path), 0)
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(os.stat(path).st_mode & 0777, 0666 & ~umask)
+
+        self.assertFalse(atomic_write(path, iter(['f', 'oo']), skip_unchanged=True))
+        self.assertTrue(atomic_write(path, iter(['f', 'o']), skip_unchanged=True))
+
+        def fail():
+            yield 'bar'
+            raise ValueError()
+
+        self.assertRaises(ValueError, atomic_write, path, fail())
+        with open(path) as fp:
+            self.assertEqual(fp.read(), 'fo')
+        self.assertEqual(os.listdir(os.path.dirname(path)), ['f'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append('../')
+
+from composer.command import _build_parallel, build_command, load_index, merge_command
+from composer.writer import FileWriter
+
+
+class TestBuild(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.build_path = os.path.join(self.path, 'build')
+
+        routes = []
+        for i in range(9):
+            with open(os.path.join(self.path, '%d.html' % i), 'w') as fp:
+                fp.write('%d' % i * 300)
+            routes.append({'url': '/%d' % i, 'file': '%d.html' % i})
+        routes.append({'url': '/missing', 'file': 'missing.html'})
+
+        self.index_path = os.path.join(self.path, 'index.json')
+        with open(self.index_path, 'w') as fp:
+            json.dump({'routes': routes}, fp)
+
+        self.index = load_index(self.index_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def assertBuilt(self, failures):
+        self.assertEqual([url for url, error in failures], ['/missing'])
+        self.assertTrue('missing.html' in failures[0][1])
+
+        for i in range(9):
+            with open(os.path.join(self.build_path, str(i), 'index.html')) as fp:
+                self.assertEqual(fp.read(), '%d' % i * 300)
+        self.assertFalse(os.path.exists(os.path.join(self.build_path, 'missing', 'index.html')))
+
+    def test_build(self):
+        self.assertBuilt(build_command(self.index, build_path=self.build_path, jobs=2,
+                                       index_args=(self.index_path,)))
+
+    def test_build_serial(self):
+        self.assertBuilt(build_command(self.index, build_path=self.build_path))
+
+    def test_state_path(self):
+        build_command(self.index, build_path=self.build_path, incremental=True, jobs=2,
+                      index_args=(self.index_path,))
+
+        self.assertEqual(sorted(os.listdir(self.build_path)), map(str, range(9)) + ['missing'])
+        state_path = os.path.join(self.path, '.composer-state', 'build')
+        self.assertEqual(os.listdir(state_path), ['manifest.json'])
+
+    def test_merge(self):
+        os.makedirs(os.path.join(self.path, 'static'))
+        with open(os.path.join(self.path, 'static', 'a.css'), 'w') as fp:
+            fp.write('a')
+
+        index_path = os.path.join(self.path, 'merge.json')
+        with open(index_path, 'w') as fp:
+            json.dump({'routes': [{'url': '/%d' % i, 'file': '%d.html' % i} for i in range(9)],
+                       'static': [{'url': '/static', 'file': 'static'}]}, fp)
+        index = load_index(index_path)
+
+        shard_paths = [os.path.join(self.path, 'shards', str(shard)) for shard in (1, 2)]
+        for shard, shard_path in enumerate(shard_paths, 1):
+            self.assertEqual(build_command(index, build_path=shard_path, shard=(shard, 2)), [])
+
+        merge_command(index, shard_paths, build_path=self.build_path)
+        self.assertEqual(sorted(os.listdir(self.build_path)), map(str, range(9)) + ['static'])
+        self.assertEqual(os.listdir(os.path.join(self.build_path, 'static')), ['a.css'])
+
+    def test_counts(self):
+        routes = list(self.index.routes)
+        writer_kw = {'skip_unchanged': True, 'compress': ('gzip',)}
+
+        writer = FileWriter(self.index, build_path=self.build_path, **writer_kw)
+        results = list(_build_parallel(routes, writer, 2, (self.index_path,), writer_kw))
+        self.assertEqual(sorted(url for url, error, deps in results), sorted(r.url for r in routes))
+        self.assertEqual((writer.num_written, writer.num_skipped, writer.num_compressed), (9, 0, 9))
+
+        writer = FileWriter(self.index, build_path=self.build_path, **writer_kw)
+        results = list(_build_parallel(routes, writer, 2, (self.index_path,), writer_kw))
+        self.assertEqual([url for url, error, deps in results if error], ['/missing'])
+        self.assertEqual((writer.num_written, writer.num_skipped, writer.num_compressed), (0, 9, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import gzip
+import io
+import sys
+import unittest
+
+sys.path.append('../')
+
+from composer.compress import choose_encoding, compress, get_encodings, is_compressible
+
+
+class TestCompress(unittest.TestCase):
+    def test_gzip(self):
+        data = 'foo' * 100
+        compressed = compress(data, 'gzip')
+        self.assertEqual(compressed, compress(data, 'gzip'))
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(compressed)).read(), data)
+
+    def test_get_encodings(self):
+        self.assertEqual(get_encodings('gzip'), ('gzip',))
+        self.assertEqual(get_encodings(' gzip, '), ('gzip',))
+        self.assertRaises(ValueError, get_encodings, 'gzip,foo')
+
+    def test_is_compressible(self):
+        self.assertTrue(is_compressible('text/html'))
+        self.assertTrue(is_compressible('image/svg+xml'))
+        self.assertFalse(is_compressible('image/png'))
+        self.assertFalse(is_compressible(None))
+
+    def test_choose_encoding(self):
+        encodings = ('br', 'gzip')
+        self.assertEqual(choose_encoding(None, encodings), None)
+        self.assertEqual(choose_encoding('gzip, deflate', encodings), 'gzip')
+        self.assertEqual(choose_encoding('gzip, br', encodings), 'br')
+        self.assertEqual(choose_encoding('br;q=0, gzip;q=0.5', encodings), 'gzip')
+        self.assertEqual(choose_encoding('*', encodings), 'br')
+        self.assertEqual(choose_encoding('identity', encodings), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,249 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append('../')
+
+from composer.index import Index, Route
+from composer.writer import Writer
+from composer import filters
+
+
+class TestMako(unittest.TestCase):
+    @unittest.skipIf(not filters.mako, "Requires Mako")
+    def test_template_cache(self):
+        f = filters.Mako(Index())
+
+        self.assertEqual(f('${1+1}'), '2')
+        self.assertEqual(f('${1+1}'), '2')
+        self.assertEqual(f('${2+2}'), '4')
+
+        self.assertEqual(f.template_cache.hits, 1)
+        self.assertEqual(f.template_cache.misses, 2)
+
+    @unittest.skipIf(not filters.mako, "Requires Mako")
+    def test_module_directory(self):
+        module_directory = tempfile.mkdtemp()
+        try:
+            f = filters.Mako(Index(), module_directory=module_directory)
+            self.assertEqual(f('${1+1}'), '2')
+
+            f = filters.Mako(Index(), module_directory=module_directory)
+            self.assertEqual(f('${1+1}'), '2')
+            self.assertEqual(f.template_cache.misses, 1)
+        finally:
+            shutil.rmtree(module_directory)
+
+    @unittest.skipIf(not filters.mako, "Requires Mako")
+    def test_module_directory_bounded(self):
+        module_directory = tempfile.mkdtemp()
+        try:
+            f = filters.Mako(Index(), template_cache_size=2, module_directory=module_directory)
+            for i in range(5):
+                self.assertEqual(f('${%d+1}' % i), str(i + 1))
+
+            f = filters.Mako(Index(), template_cache_size=2, module_directory=module_directory)
+            for i in range(5):
+                self.assertEqual(f('${%d+1}' % i), str(i + 1))
+
+            self.assertEqual([name for name in sys.modules if name.startswith('_composer_mako_')], [])
+        finally:
+            shutil.rmtree(module_directory)
+
+    @unittest.skipIf(not filters.mako, "Requires Mako")
+    def test_module_directory_magic_number(self):
+        module_directory = tempfile.mkdtemp()
+        try:
+            filters.Mako(Index(), module_directory=module_directory)('${1+1}')
+
+            module_dir = os.path.join(module_directory, '_composer')
+            module_path = os.path.join(module_dir, os.listdir(module_dir)[0])
+            with open(module_path) as fp:
+                source = fp.read()
+            with open(module_path, 'w') as fp:
+                fp.write(source.replace('_magic_number = ', '_magic_number = -1 + ', 1))
+
+            self.assertEqual(filters.Mako(Index(), module_directory=module_directory)('${1+1}'), '2')
+            with open(module_path) as fp:
+                self.assertTrue('_magic_number = -1' not in fp.read())
+        finally:
+            shutil.rmtree(module_directory)
+
+    @unittest.skipIf(not filters.mako, "Requires Mako")
+    def test_module_directory_base_path(self):
+        path = tempfile.mkdtemp()
+        try:
+            f = filters.Mako(Index(path), module_directory='modules')
+            self.assertEqual(f('${1+1}'), '2')
+            self.assertTrue(os.listdir(os.path.join(path, 'modules', '_composer')))
+        finally:
+            shutil.rmtree(path)
+
+    @unittest.skipIf(not filters.mako, "Requires Mako")
+    def test_cache_path(self):
+        path = tempfile.mkdtemp()
+        try:
+            f = filters.Mako(Index(path, cache_path='cache'))
+            self.assertEqual(f('${1+1}'), '2')
+            self.assertTrue(os.listdir(os.path.join(path, 'cache', 'mako', '_composer')))
+        finally:
+            shutil.rmtree(path)
+
+    @unittest.skipIf(not filters.mako, "Requires Mako")
+    def test_dependencies(self):
+        cwd = os.getcwd()
+        path = os.path.realpath(tempfile.mkdtemp())
+        os.chdir(path) # MakoContainer resolves its template relative to cwd.
+        try:
+            for filename, content in [('base.mako', 'base ${next.body()}'),
+                                      ('page.mako', '<%inherit file="base.mako"/>page'),
+                                      ('layout.mako', '[${body}]')]:
+                with open(os.path.join(path, filename), 'w') as fp:
+                    fp.write(content)
+
+            index = Index(path)
+            index.register_filter('mako', filters.Mako, {'directories': ['.']})
+            index.register_filter('layout', filters.MakoContainer, {'directories': ['.'], 'template': 'layout.mako'})
+
+            route = Route('/page', index.absolute_path('page.mako'), filters=['mako', 'layout'])
+            self.assertEqual(Writer(index).render_route(route), '[base page]')
+
+            self.assertEqual(index.dependencies.get_dependencies('/page'),
+                             set(os.path.join(path, f) for f in ['base.mako', 'page.mako', 'layout.mako']))
+            self.assertEqual(index.dependencies.get_dependents([os.path.join(path, 'base.mako')]), set(['/page']))
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(path)
+
+    @unittest.skipIf(not filters.mako, "Requires Mako")
+    def test_stream(self):
+        f = filters.Mako(Index())
+
+        chunks = list(f.stream([u'${1+1} ', u'caf\xe9']))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(filters.join_chunks(chunks), f(u'${1+1} caf\xe9'))
+
+    @unittest.skipIf(not (filters.mako and filters.pygments), "Requires Mako and Pygments")
+    def test_stream_into_pygments(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, 'caf\xc3\xa9 ${1+1}')
+            os.close(fd)
+
+            route = Route('/p', path, filters=['mako', 'pygments'])
+            self.assertEqual(Writer(Index()).render_route(route), 'caf\xc3\xa9 2')
+        finally:
+            os.remove(path)
+
+
+class TestJinja2(unittest.TestCase):
+    @unittest.skipIf(not filters.jinja2, "Requires Jinja2")
+    def test_template_cache(self):
+        f = filters.Jinja2(Index())
+
+        self.assertEqual(f('{{ 1+1 }}'), '2')
+        self.assertEqual(f('{{ 1+1 }}'), '2')
+
+        self.assertEqual(f.template_cache.hits, 1)
+        self.assertEqual(f.template_cache.misses, 1)
+
+    @unittest.skipIf(not filters.jinja2, "Requires Jinja2")
+    def test_stream(self):
+        f = filters.Jinja2(Index())
+
+        chunks = f.stream(['{% for i in range(3) %}{{ i }}', '{% endfor %}'])
+        self.assertEqual(list(chunks), ['0', '1', '2'])
+
+
+    @unittest.skipIf(not filters.jinja2, "Requires Jinja2")
+    def test_bytecode_cache(self):
+        path = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(path, 'base.html'), 'w') as fp:
+                fp.write('base {% block body %}{% endblock %}')
+
+            index = Index(path, cache_path='cache')
+            content = '{% extends "base.html" %}{% block body %}{{ 1+1 }}{% endblock %}'
+            self.assertEqual(filters.Jinja2(index, searchpaths=[path])(content), 'base 2')
+            self.assertEqual(len(os.listdir(os.path.join(path, 'cache', 'jinja2'))), 2)
+
+            # Another build loads the bytecode instead of compiling.
+            f = filters.Jinja2(index, searchpaths=[path])
+            f.jinja_env.compile = None
+            self.assertEqual(f(content), 'base 2')
+        finally:
+            shutil.rmtree(path)
+
+    @unittest.skipIf(not filters.jinja2, "Requires Jinja2")
+    def test_container(self):
+        path = tempfile.mkdtemp()
+        try:
+            with open(os.path.join(path, 'base.html'), 'w') as fp:
+                fp.write('<{% block body %}{% endblock %}>')
+            with open(os.path.join(path, 'layout.html'), 'w') as fp:
+                fp.write('{% extends "base.html" %}{% block body %}[{{ body }}]{% endblock %}')
+
+            index = Index(path)
+            f = filters.Jinja2Container(index, template='layout.html')
+            self.assertEqual(f('foo'), '<[foo]>')
+            self.assertEqual(''.join(f.stream(['f', 'oo'])), '<[foo]>')
+
+            with open(os.path.join(path, 'foo.txt'), 'w') as fp:
+                fp.write('foo')
+
+            index.register_filter('layout', filters.Jinja2Container, {'template': 'layout.html'})
+            route = Route('/foo', index.absolute_path('foo.txt'), filters=['layout'])
+            self.assertEqual(Writer(index).render_route(route), '<[foo]>')
+            self.assertEqual(index.dependencies.get_dependencies('/foo'),
+                             set(os.path.join(path, f) for f in ['foo.txt', 'layout.html', 'base.html']))
+        finally:
+            shutil.rmtree(path)
+
+
+class TestMarkdown(unittest.TestCase):
+    @unittest.skipIf(not filters.markdown, "Requires Markdown")
+    def test_reset(self):
+        f = filters.Markdown(Index())
+
+        r = f('[foo][1]\n\n[1]: http://example.com/')
+        self.assertTrue('href="http://example.com/"' in r)
+
+        # References don't leak into the next document.
+        self.assertFalse('href' in f('[foo][1]'))
+        self.assertEqual(f.convert_many(['*a*', '[foo][1]']), ['<p><em>a</em></p>', '<p>[foo][1]</p>'])
+
+    def test_backend(self):
+        self.assertRaises(ValueError, filters.Markdown, Index(), backend='foo')
+
+
+class TestPygments(unittest.TestCase):
+    @unittest.skipIf(not filters.pygments, "Requires Pygments")
+    def test_block_cache(self):
+        f = filters.Pygments(Index())
+
+        block = '<pre lang="python"><code>print 42</code></pre>'
+        r = f(block + block)
+        self.assertTrue('<div class="highlight">' in r)
+        self.assertEqual(r.count('print'), 2)
+        self.assertEqual((f.block_cache.hits, f.block_cache.misses), (1, 1))
+
+        self.assertEqual(f('<pre><code>plain</code></pre>'), '<pre><code>plain</code></pre>')
+
+    @unittest.skipIf(not filters.pygments, "Requires Pygments")
+    def test_disk_cache(self):
+        path = tempfile.mkdtemp()
+        try:
+            block = '<pre lang="python"><code>print 42</code></pre>'
+            r = filters.Pygments(Index(), cache_path=path)(block)
+
+            f = filters.Pygments(Index(), cache_path=path)
+            self.assertEqual(f(block), r)
+            self.assertEqual(f.disk_cache.hits, 1)
+        finally:
+            shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,15 @@
+import datetime
+import os
+import re
+import shutil
 import sys
+import tempfile
 import unittest
 
 sys.path.append('../')
 
 
-from composer.index import Index, Route
+from composer.index import Index, Route, Static
 
 class TestIndex(unittest.TestCase):
     def test_routes(self):
@@ -23,6 +28,245 @@ class TestIndex(unittest.TestCase):
         ])
 
 
+    def test_from_dict_shares_data(self):
+        index = Index.from_dict({'routes': [
+            {'url': '/a', 'file': 'a', 'filters': ['x', 'y'], 'context': {'title': 'Hi'}},
+            {'url': '/b', 'file': 'b', 'filters': ['x', 'y'], 'context': {'title': 'Hi'}},
+        ]})
+
+        a, b = index.routes
+        self.assertTrue(a._filters is b._filters)
+        self.assertTrue(a.context is b.context)
+
+    def test_from_dict_keeps_input(self):
+        d = {'routes': [
+            {'url': '/a', 'file': 'a', 'context': {'date': datetime.date(2011, 10, 15)}},
+            {'url': '/b', 'file': 'b', 'context': {'title': 'Hi'}},
+            {'url': '/c', 'file': 'c', 'context': {'title': 'Hi'}},
+        ]}
+        contexts = [route_kw['context'] for route_kw in d['routes']]
+
+        index = Index.from_dict(d)
+        a, b, c = index.routes
+        self.assertEqual(a.context, {'date': datetime.date(2011, 10, 15)})
+        self.assertTrue(b.context is c.context)
+        self.assertEqual([route_kw['context'] for route_kw in d['routes']], contexts)
+        self.assertTrue(d['routes'][2]['context'] is contexts[2])
+
+    def test_route_api(self):
+        a = Route('/a', 'a', filters=['x'])
+        b = Route('/b', 'b', filters=['x'])
+
+        a.filters.append('y')
+        self.assertEqual(a.filters, ['x', 'y'])
+        self.assertEqual(b.filters, ['x'])
+        self.assertTrue(isinstance(a.filters, list))
+
+        a.filters[0] = 'z'
+        a.filters += ['w']
+        del a.filters[1]
+        self.assertEqual(a.filters, ['z', 'w'])
+
+        b.filters = ['x', 'y']
+        self.assertTrue(b._filters is Route('/c', 'c', filters=['x', 'y'])._filters)
+
+        a.date = '2011-10-15'
+        self.assertEqual(a.date, '2011-10-15')
+        s = Static('/static', 'static')
+        s.extra = True
+        self.assertTrue(s.extra)
+
+    def test_lazy_filters(self):
+        created = []
+        def upper(index, **kw):
+            created.append(kw)
+            return lambda content, route=None: content.upper()
+
+        index = Index()
+        index.register_filter('upper', upper, {'foo': 1})
+        self.assertEqual(created, [])
+        self.assertTrue('upper' in index.filters)
+
+        self.assertEqual(index.filters['upper']('a'), 'A')
+        self.assertEqual(index.filters['upper']('b'), 'B')
+        self.assertEqual(created, [{'foo': 1}])
+
+        self.assertFalse('missing' in index.filters)
+        self.assertRaises(KeyError, lambda: index.filters['missing'])
+
+        self.assertEqual(index.filters.get('upper')('c'), 'C')
+        self.assertEqual(index.filters.get('missing'), None)
+        self.assertTrue('upper' in index.filters.keys())
+        self.assertEqual(dict(index.filters.iteritems())['upper']('d'), 'D')
+        self.assertEqual(created, [{'foo': 1}])
+
+    def test_filter_looks_up_filter(self):
+        def wrapper(index, **kw):
+            inner = index.filters['upper']
+            return lambda content, route=None: '<%s>' % inner(content)
+
+        index = Index()
+        index.register_filter('upper', lambda index: lambda content, route=None: content.upper())
+        index.register_filter('wrapper', wrapper)
+        self.assertEqual(index.filters['wrapper']('a'), '<A>')
+
+    def test_collections(self):
+        generated = []
+
+        class TestIndex(Index):
+            def _register_collections(self):
+                self.register_collection('posts', include_only=['/post/*'], sort_key='date',
+                                         reverse=True, group_by='tags')
+
+            def _generate_routes(self):
+                generated.append(True)
+                yield Route('/post/a', 'a', context={'date': '2011-01-01', 'tags': ['x', 'y']})
+                yield Route('/post/b', 'b', context={'date': '2011-03-01', 'tags': ['x']})
+                yield Route('/post/c', 'c', context={'date': '2011-02-01', 'tags': []})
+                yield Route('/about', 'd')
+
+        index = TestIndex()
+        posts = index.collections['posts']
+        self.assertEqual([r.url for r in posts], ['/post/b', '/post/c', '/post/a'])
+        self.assertEqual(posts.next('/post/b').url, '/post/c')
+        self.assertEqual(posts.prev('/post/b'), None)
+        self.assertEqual(posts.next('post/a'), None)
+        self.assertEqual(posts.position('/about'), None)
+        self.assertEqual([r.url for r in posts.page(2, 2)], ['/post/a'])
+        self.assertEqual(posts.num_pages(2), 2)
+
+        self.assertEqual([r.url for r in posts.group('x')], ['/post/b', '/post/a'])
+        self.assertEqual(posts.group('x').next('/post/b').url, '/post/a')
+        self.assertEqual(sorted(posts.groups), ['x', 'y'])
+        self.assertEqual(len(posts.group('z')), 0)
+
+        index.get_route('/about')
+        self.assertTrue(index.collections['posts'] is posts)
+        self.assertEqual(len(generated), 2)
+
+        index.remove_route('/post/a')
+        index.add_route(Route('/post/z', 'z', context={'date': '2011-04-01', 'tags': ['x']}))
+        self.assertFalse(index.collections['posts'] is posts)
+        self.assertEqual([r.url for r in index.collections['posts']], ['/post/z', '/post/b', '/post/c'])
+        self.assertEqual([r.url for r in index.collections['posts'].group('x')], ['/post/z', '/post/b'])
+        self.assertEqual(len(generated), 2)
+
+        d = index.to_dict()
+        self.assertEqual(d['collections']['posts']['group_by'], 'tags')
+        other = Index.from_dict(d)
+        self.assertEqual([r.url for r in other.collections['posts']], ['/post/b', '/post/c', '/post/a'])
+
+    def test_get_route(self):
+        index = Index.from_dict({'routes': [{'url': url, 'file': 'x'} for url in
+                                            ['/', '/post/a', '/post/2011/b/', '/post/2011/c.html']]})
+
+        self.assertEqual(index.get_route('/post/a/').url, '/post/a')
+        self.assertEqual(index.get_route('post/2011/b/index.html').url, '/post/2011/b/')
+        self.assertEqual(index.get_route('/index.html').url, '/')
+        self.assertEqual(index.get_route('/post'), None)
+
+        self.assertEqual(index.list_dir('/post/'), [('2011', True), ('a', False)])
+        self.assertEqual([r.url for r in index.list_routes('/post/2011')], ['/post/2011/b/', '/post/2011/c.html'])
+        self.assertEqual([r.url for r in index.find_routes('/post/*.html')], ['/post/2011/c.html'])
+        self.assertEqual([r.url for r in index.find_routes('/post/a')], ['/post/a'])
+
+        fresh = Index.from_dict(index.to_dict())
+        self.assertEqual(fresh.remove_route('/post/a').url, '/post/a')
+        self.assertEqual(fresh.get_route('/post/a'), None)
+
+        index.add_route(Route('/post/2011/d', 'x'))
+        self.assertEqual(index.list_dir('/post/2011'), [('b', False), ('c.html', False), ('d', False)])
+        index.remove_route('/post/a/')
+        self.assertEqual(index.list_dir('/post'), [('2011', True)])
+
+    def test_walk(self):
+        path = tempfile.mkdtemp()
+        try:
+            for filename in ['a.md', 'b.mako', 'posts/1.md', 'posts/2.txt', 'node_modules/x/y.md']:
+                file_path = os.path.join(path, filename)
+                if not os.path.exists(os.path.dirname(file_path)):
+                    os.makedirs(os.path.dirname(file_path))
+                open(file_path, 'w').close()
+
+            index = Index(path)
+            self.assertEqual(sorted(index.walk()),
+                             ['a.md', 'b.mako', 'node_modules/x/y.md', 'posts/1.md', 'posts/2.txt'])
+            self.assertEqual(sorted(index.walk(include_only=['*.md'], exclude=['node_modules/*'])),
+                             ['a.md', 'posts/1.md'])
+            self.assertEqual(sorted(index.walk('posts', exclude=[re.compile(r'.*\.TXT$', re.I)])),
+                             ['posts/1.md'])
+
+            paths = dict(index.walk('posts', stat=True))
+            self.assertEqual(paths['posts/2.txt'].st_size, 0)
+        finally:
+            shutil.rmtree(path)
+
+    def test_sqlite(self):
+        class TestIndex(Index):
+            def _generate_routes(self):
+                yield Route('/foo', 'bar', filters=['baz'], context={'quux': 42})
+                yield Route('/a', 'b')
+                yield Route('/a/b/', 'c')
+
+        path = tempfile.mkdtemp()
+        try:
+            db_path = os.path.join(path, 'index.sqlite')
+            TestIndex().to_sqlite(db_path)
+
+            index = Index.from_sqlite(db_path, base_path=path)
+            self.assertEqual([r.url for r in index.routes], ['/foo', '/a', '/a/b/'])
+
+            route = index.get_route('foo')
+            self.assertEqual(route.file, index.absolute_path('bar'))
+            self.assertEqual(route.filters, ['baz'])
+            self.assertEqual(route.context, {'quux': 42})
+            self.assertEqual(index.get_route('/nope'), None)
+            self.assertEqual(index.get_route('/a/b/index.html').url, '/a/b/')
+
+            self.assertEqual(index.list_dir(), [('a', True), ('foo', False)])
+            self.assertEqual([r.url for r in index.list_routes('/a')], ['/a', '/a/b/'])
+            self.assertEqual([r.url for r in index.find_routes('/a/*')], ['/a/b/'])
+            self.assertEqual(index.to_dict()['filters'], TestIndex().to_dict()['filters'])
+
+            index.add_route(Route('/a', 'd'))
+            index.add_route(Route('/new', 'e'))
+            self.assertEqual(index.get_route('/a').file, index.absolute_path('d'))
+            self.assertEqual(index.remove_route('/foo/').url, '/foo')
+            self.assertEqual(index.remove_route('/foo'), None)
+
+            index = Index.from_sqlite(db_path, base_path=path)
+            self.assertEqual([r.url for r in index.routes], ['/a', '/a/b/', '/new'])
+        finally:
+            shutil.rmtree(path)
+
+    def test_sqlite_meta(self):
+        class TestIndex(Index):
+            def _register_collections(self):
+                self.register_collection('posts', include_only=['/post/*'], sort_key='date')
+
+            def _generate_routes(self):
+                yield Route('/post/a', 'a', context={'date': '2011-02-01'})
+                yield Route('/post/b', 'b', context={'date': '2011-01-01'})
+
+        path = tempfile.mkdtemp()
+        try:
+            db_path = os.path.join(path, 'index.sqlite')
+            TestIndex(path, cache_path='cache').to_sqlite(db_path)
+
+            index = Index.from_sqlite(db_path, base_path=path)
+            self.assertEqual(os.path.normpath(index.cache_path), os.path.join(path, 'cache'))
+            self.assertEqual([r.url for r in index.collections['posts']], ['/post/b', '/post/a'])
+
+            index.add_route(Route('/post/c', 'c', context={'date': '2010-01-01'}))
+            self.assertEqual([r.url for r in index.collections['posts']], ['/post/c', '/post/b', '/post/a'])
+
+            # Databases written before the meta table.
+            index.db.execute("DROP TABLE meta")
+            index.db.commit()
+            self.assertEqual(Index.from_sqlite(db_path, base_path=path).cache_path, None)
+        finally:
+            shutil.rmtree(path)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,87 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.append('../')
+
+from composer.index import Index, Route
+from composer.manifest import BuildManifest, get_state_path
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+        self.source = os.path.join(self.path, 'foo.md')
+        self.output = os.path.join(self.path, 'build', 'foo', 'index.html')
+
+        with open(self.source, 'w') as fp:
+            fp.write('foo')
+
+        os.makedirs(os.path.dirname(self.output))
+        with open(self.output, 'w') as fp:
+            fp.write('foo')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_is_current(self):
+        index = Index()
+        route = Route('/foo', self.source, context={'a': 1})
+
+        manifest_path = os.path.join(get_state_path(os.path.join(self.path, 'build')), BuildManifest.filename)
+        manifest = BuildManifest(manifest_path)
+        self.assertFalse(manifest.is_current(route, index, self.output))
+
+        manifest.update(route, index, self.output)
+        manifest.save()
+
+        manifest = BuildManifest(manifest_path)
+        self.assertTrue(manifest.is_current(route, index, self.output))
+
+        # Touched without changes
+        t = time.time() + 10
+        os.utime(self.source, (t, t))
+        self.assertTrue(manifest.is_current(route, index, self.output))
+
+        route.context = {'a': 2}
+        self.assertFalse(manifest.is_current(route, index, self.output))
+
+    def test_remove_stale(self):
+        index = Index()
+        route = Route('/foo', self.source)
+
+        manifest = BuildManifest(os.path.join(self.path, 'build', BuildManifest.filename))
+        manifest.update(route, index, self.output)
+
+        self.assertEqual(manifest.remove_stale(['/foo']), [])
+        self.assertEqual(manifest.remove_stale([]), [self.output])
+        self.assertFalse(os.path.exists(os.path.dirname(self.output)))
+        self.assertEqual(manifest.entries, {})
+
+    def test_legacy_path(self):
+        index = Index()
+        route = Route('/foo', self.source)
+
+        build_path = os.path.join(self.path, 'build')
+        legacy_path = os.path.join(build_path, BuildManifest.legacy_filename)
+        manifest = BuildManifest(legacy_path)
+        manifest.update(route, index, self.output)
+        manifest.save()
+
+        state_path = get_state_path(build_path)
+        self.assertEqual(state_path, os.path.join(self.path, '.composer-state', 'build'))
+
+        manifest = BuildManifest(os.path.join(state_path, BuildManifest.filename), legacy_path=legacy_path)
+        self.assertTrue(manifest.is_current(route, index, self.output))
+        manifest.save()
+
+        self.assertFalse(os.path.exists(legacy_path))
+        self.assertTrue(os.path.exists(os.path.join(state_path, BuildManifest.filename)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import sys
+import unittest
+
+sys.path.append('../')
+
+from composer.index import Route
+from composer.routing import RouteTable, normalize_url
+
+
+class TestRouting(unittest.TestCase):
+    def test_normalize_url(self):
+        for url in ['/foo', 'foo', '/foo/', '//foo//', '/foo/index.html']:
+            self.assertEqual(normalize_url(url), 'foo')
+
+        self.assertEqual(normalize_url('/a//b/'), 'a/b')
+        self.assertEqual(normalize_url('/'), '')
+        self.assertEqual(normalize_url('/index.html'), '')
+        self.assertEqual(normalize_url('/foo.html'), 'foo.html')
+
+    def test_table(self):
+        table = RouteTable([Route(url) for url in ['/', '/a', '/a/b/c', '/a/d/', '/e.html']])
+
+        self.assertEqual(len(table), 5)
+        self.assertEqual(table.get('/a/d/index.html').url, '/a/d/')
+        self.assertEqual(table.get('/a/b'), None)
+        self.assertTrue('/a/' in table)
+
+        self.assertEqual(table.list_dir(), [('a', True), ('e.html', False)])
+        self.assertEqual(table.list_dir('/a/'), [('b', True), ('d', False)])
+        self.assertEqual(table.list_dir('/nope'), [])
+
+        self.assertEqual([r.url for r in table.iter_routes()], ['/', '/a', '/a/b/c', '/a/d/', '/e.html'])
+        self.assertEqual([r.url for r in table.iter_routes('a/b')], ['/a/b/c'])
+
+        self.assertEqual(table.add(Route('/a/index.html')).url, '/a')
+        self.assertEqual(len(table), 5)
+
+        # Removing routes prunes the segments nothing is under anymore.
+        self.assertEqual(table.remove('/a/b/c').url, '/a/b/c')
+        self.assertEqual(table.remove('/a/b/c'), None)
+        self.assertEqual(table.list_dir('/a'), [('d', False)])
+
+        table.remove('/a/d')
+        self.assertEqual(table.list_dir(), [('a', False), ('e.html', False)])
+        table.remove('/a')
+        table.remove('/e.html')
+        self.assertEqual(table.list_dir(), [])
+        self.assertEqual(table._dirs, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
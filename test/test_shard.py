@@ -0,0 +1,46 @@
+import sys
+import unittest
+
+sys.path.append('../')
+
+from composer.index import Index
+from composer.shard import ShardRecord, check_shards, get_shard, parse_shard
+
+
+class TestShard(unittest.TestCase):
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard('2/8'), (2, 8))
+        self.assertRaises(ValueError, parse_shard, '0/8')
+        self.assertRaises(ValueError, parse_shard, '9/8')
+        self.assertRaises(ValueError, parse_shard, 'foo')
+
+    def test_get_shard(self):
+        # Must never change, shards may be built by different versions.
+        self.assertEqual(get_shard('/foo', 1000), 820)
+        self.assertEqual(get_shard('foo', 1000), 820)
+        self.assertEqual(get_shard(u'/caf\xe9', 1000), get_shard('/caf\xc3\xa9', 1000))
+
+    def test_check_shards(self):
+        urls = ['/%d' % i for i in range(20)]
+        index = Index.from_dict({'routes': [{'url': url, 'file': 'x'} for url in urls]})
+
+        records = [ShardRecord(shard, 3) for shard in (1, 2, 3)]
+        for url in urls:
+            records[get_shard(url, 3) - 1].outputs[url] = url.lstrip('/') + '/index.html'
+        self.assertEqual(check_shards(index, records), [])
+
+        self.assertEqual(check_shards(index, records[:2]), ["Shard 3/3 is missing."])
+        self.assertEqual(check_shards(index, records + [ShardRecord(1, 4)]),
+                         ["Shards are from builds with different numbers of shards: [3, 4]"])
+
+        url = records[0].outputs.popitem()[0]
+        path = records[0].outputs.values()[0]
+        records[1].outputs[records[1].outputs.keys()[0]] = path
+        errors = check_shards(index, records)
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(errors[0].endswith("both write %s." % path))
+        self.assertTrue(errors[1].startswith("Route %s is missing" % url))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append('../')
+
+from composer.sync import StaticSync
+
+
+class TestStaticSync(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.src = os.path.join(self.path, 'src')
+        self.dst = os.path.join(self.path, 'build', 'static')
+
+        for filename in ['a.css', 'img/b.png']:
+            self.write(os.path.join(self.src, filename), filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, path, content):
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write(content)
+
+    def test_sync(self):
+        s = StaticSync()
+        s.sync(self.src, self.dst)
+        self.assertEqual(s.num_copied, 2)
+        with open(os.path.join(self.dst, 'img', 'b.png')) as fp:
+            self.assertEqual(fp.read(), 'img/b.png')
+
+        # Unrelated files in the destination are left alone.
+        self.write(os.path.join(self.dst, 'other.txt'), 'other')
+
+        os.remove(os.path.join(self.src, 'img', 'b.png'))
+        s = StaticSync()
+        s.sync(self.src, self.dst)
+        self.assertEqual((s.num_copied, s.num_skipped, s.num_removed), (0, 1, 1))
+        self.assertEqual(sorted(os.listdir(self.dst)), ['.composer-static.json', 'a.css', 'other.txt'])
+
+    def test_state_path(self):
+        state_path = os.path.join(self.path, 'state')
+        StaticSync().sync(self.src, self.dst)
+
+        # Records of earlier builds are moved out of the destination.
+        os.remove(os.path.join(self.src, 'img', 'b.png'))
+        s = StaticSync(state_path=state_path)
+        s.sync(self.src, self.dst)
+        self.assertEqual(s.num_removed, 1)
+        self.assertEqual(sorted(os.listdir(self.dst)), ['a.css'])
+        self.assertEqual(len(os.listdir(os.path.join(state_path, 'static'))), 1)
+
+        os.remove(os.path.join(self.src, 'a.css'))
+        s = StaticSync(state_path=state_path)
+        s.sync(self.src, self.dst)
+        self.assertEqual(s.num_removed, 1)
+        self.assertEqual(os.listdir(self.dst), ['img'])
+
+    def test_link(self):
+        StaticSync(mode='link').sync(self.src, self.dst)
+
+        src_stat = os.stat(os.path.join(self.src, 'a.css'))
+        dst_stat = os.stat(os.path.join(self.dst, 'a.css'))
+        self.assertEqual(src_stat.st_ino, dst_stat.st_ino)
+
+        s = StaticSync(mode='link')
+        s.sync(self.src, self.dst)
+        self.assertEqual(s.num_skipped, 2)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append('../')
+
+from composer.index import Index, Route
+from composer.watcher import Watcher
+from composer.writer import WSGIWriter
+
+
+class MarkdownIndex(Index):
+    def _register_filters(self):
+        # Routes without filters are served straight from their files.
+        self.register_filter('noop', lambda index: lambda content, route=None: content)
+
+    def _generate_routes(self):
+        for path in self.walk(include_only=['*.md']):
+            yield Route(path.split('.')[0], self.absolute_path(path), filters=['noop'])
+
+
+class TestWatcher(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.write('a.md', 'a')
+
+        self.app = WSGIWriter(MarkdownIndex(self.path))
+        self.watcher = Watcher(self.app)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, filename, content):
+        path = os.path.join(self.path, filename)
+        with open(path, 'w') as fp:
+            fp.write(content)
+        return path
+
+    def test_routes(self):
+        index = self.app.index
+        self.assertNotEqual(index.get_route('a'), None)
+        self.assertEqual(index.get_route('b'), None)
+
+        self.write('b.md', 'b')
+        self.watcher.check()
+        self.assertNotEqual(index.get_route('b'), None)
+
+        os.remove(os.path.join(self.path, 'a.md'))
+        self.watcher.check()
+        self.assertEqual(index.get_route('a'), None)
+
+    def test_exclude(self):
+        os.makedirs(os.path.join(self.path, 'build', 'a'))
+        os.makedirs(os.path.join(self.path, 'cache'))
+        self.write('build/a/index.md', 'a')
+        self.write('cache/c.md', 'c')
+        self.write('.b.md', 'b')
+
+        watcher = Watcher(self.app, exclude=['build/*'], exclude_dirs=[os.path.join(self.path, 'cache')])
+        self.assertEqual(sorted(watcher._snapshot), [os.path.join(self.path, 'a.md')])
+
+        self.write('build/a/index.md', 'aa')
+        watcher.check()
+        self.assertEqual(sorted(watcher._snapshot), [os.path.join(self.path, 'a.md')])
+
+    def test_modified(self):
+        self.app({'PATH_INFO': '/a'}, lambda status, headers: None)
+        self.assertTrue('a' in self.app.body_cache)
+
+        self.write('a.md', 'aa')
+        self.watcher.check()
+        self.assertFalse('a' in self.app.body_cache)
+
+    def test_reload_index(self):
+        index_path = self.write('index.json', '{}')
+        new_index = MarkdownIndex(self.path)
+
+        watcher = Watcher(self.app, reload_index=lambda: new_index, reload_paths=[index_path])
+        self.write('index.json', '{"routes": []}')
+        watcher.check()
+        self.assertTrue(self.app.index is new_index)
+
+
+if __name__ == '__main__':
+    unittest.main()
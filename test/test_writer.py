@@ -1,10 +1,19 @@
+import gzip
+import io
+import os
+import shutil
 import sys
+import tempfile
+import threading
+import time
 import unittest
 
 sys.path.append('../')
 
-from composer.index import Index
-from composer.writer import FileWriter
+from composer.filters import Filter
+from composer.index import Index, Route
+from composer.profiler import Profiler
+from composer.writer import FileWriter, WSGIWriter
 
 
 class DummyFileWriter(FileWriter):
@@ -24,6 +33,10 @@ class DummyFileWriter(FileWriter):
     def _write_file(self, path, content):
         self._written_files.append(path)
 
+        # Rendering happens while the chunks are consumed.
+        if not isinstance(content, basestring):
+            list(content)
+
 
 class TestWriter(unittest.TestCase):
     def test_file_materialize_path(self):
@@ -45,6 +58,319 @@ class TestWriter(unittest.TestCase):
             self.assertEqual(w._made_dirs, made_dirs)
             self.assertEqual(w._written_files, written_files)
 
+    def test_skip_unchanged(self):
+        path = tempfile.mkdtemp()
+        try:
+            w = FileWriter(Index(), build_path=path, atomic=True, skip_unchanged=True)
+
+            w.materialize_url('/foo', u'caf\xe9')
+            w.materialize_url('/foo', u'caf\xe9')
+            w.materialize_url('/foo', 'bar')
+
+            self.assertEqual((w.num_written, w.num_skipped), (2, 1))
+            self.assertEqual(os.listdir(os.path.join(path, 'foo')), ['index.html'])
+            with open(os.path.join(path, 'foo', 'index.html')) as fp:
+                self.assertEqual(fp.read(), 'bar')
+        finally:
+            shutil.rmtree(path)
+
+    def test_profile(self):
+        index = Index()
+        index.register_filter('upper', type('Upper', (Filter,), {'__call__': lambda self, content, route=None: content.upper()}))
+
+        w = DummyFileWriter(index)
+        profiler = Profiler()
+        w.subscribe(profiler)
+
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, 'foo')
+            os.close(fd)
+
+            route = Route('/foo', path, filters=['upper'])
+            w.materialize_route(route)
+            w.materialize_route(route)
+        finally:
+            os.remove(path)
+
+        self.assertEqual(profiler.routes['/foo'][0], 2)
+        self.assertEqual(profiler.filters['upper'][0], 2)
+        self.assertEqual(sorted(profiler.phases), ['render', 'write'])
+
+        other = Profiler()
+        other.merge(profiler.to_dict())
+        other.merge(profiler.to_dict())
+        self.assertEqual(other.filters['upper'][0], 4)
+
+    def test_write_chunks(self):
+        path = tempfile.mkdtemp()
+        try:
+            source = os.path.join(path, 'source.txt')
+            with open(source, 'w') as fp:
+                fp.write('x' * 200000)
+
+            w = FileWriter(Index(path), build_path=os.path.join(path, 'build'), skip_unchanged=True)
+            route = Route('/foo', source)
+
+            file_path = w.materialize_route(route)
+            w.materialize_route(route)
+            self.assertEqual((w.num_written, w.num_skipped), (1, 1))
+            self.assertEqual(os.path.getsize(file_path), 200000)
+
+            with open(source, 'a') as fp:
+                fp.write('y')
+
+            w.materialize_route(route)
+            self.assertEqual((w.num_written, w.num_skipped), (2, 1))
+            with open(file_path) as fp:
+                self.assertEqual(fp.read()[-2:], 'xy')
+            self.assertEqual(sorted(os.listdir(os.path.dirname(file_path))), ['index.html'])
+        finally:
+            shutil.rmtree(path)
+
+
+    def test_render_error(self):
+        path = tempfile.mkdtemp()
+        try:
+            source = os.path.join(path, 'p.txt')
+            with open(source, 'w') as fp:
+                fp.write('good')
+
+            def fail(content, route=None):
+                if content == 'bad':
+                    raise ValueError(content)
+                return content
+
+            index = Index(path)
+            index.register_filter('fail', lambda index: fail)
+
+            w = FileWriter(index, build_path=os.path.join(path, 'build'))
+            route = Route('/p', source, filters=['fail'])
+            file_path = w.materialize_route(route)
+
+            with open(source, 'w') as fp:
+                fp.write('bad')
+            self.assertRaises(ValueError, w.materialize_route, route)
+
+            with open(file_path) as fp:
+                self.assertEqual(fp.read(), 'good')
+            self.assertEqual(os.listdir(os.path.dirname(file_path)), ['index.html'])
+        finally:
+            shutil.rmtree(path)
+
+    def test_passthrough(self):
+        path = tempfile.mkdtemp()
+        try:
+            source = os.path.join(path, 'feed.xml')
+            with open(source, 'wb') as fp:
+                fp.write('\xff\xfe not utf8')
+
+            index = Index(path)
+            received = []
+            index.register_filter('bytes', type('Bytes', (Filter,), {
+                'binary': True,
+                '__call__': lambda self, content, route=None: received.append(content) or content,
+            }))
+
+            w = FileWriter(index, build_path=os.path.join(path, 'build'))
+            for route in [Route('/feed.xml', source), Route('/feed2.xml', source, filters=['bytes'])]:
+                with open(w.materialize_route(route), 'rb') as fp:
+                    self.assertEqual(fp.read(), '\xff\xfe not utf8')
+
+            self.assertEqual(received, ['\xff\xfe not utf8'])
+            self.assertEqual(index.dependencies.get_dependencies('/feed.xml'), set([source]))
+        finally:
+            shutil.rmtree(path)
+
+    def test_compress(self):
+        path = tempfile.mkdtemp()
+        try:
+            w = FileWriter(Index(), build_path=path, skip_unchanged=True, compress=['gzip'])
+
+            content = 'foo' * 100
+            w.materialize_url('/foo', content)
+            w.materialize_url('/small', 'foo')
+            w.materialize_url('/foo.png', content)
+            w.flush()
+            self.assertEqual(w.num_compressed, 1)
+            self.assertEqual(sorted(os.listdir(os.path.join(path, 'foo'))), ['index.html', 'index.html.gz'])
+
+            gz_path = os.path.join(path, 'foo', 'index.html.gz')
+            with open(gz_path, 'rb') as fp:
+                self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(fp.read())).read(), content)
+
+            # Unchanged files are only compressed when their sibling is missing.
+            w.materialize_url('/foo', content)
+            w.flush()
+            self.assertEqual(w.num_compressed, 1)
+
+            os.remove(gz_path)
+            w.materialize_url('/foo', content)
+            w.flush()
+            self.assertEqual(w.num_compressed, 2)
+            self.assertTrue(os.path.exists(gz_path))
+
+            # Shrinking below the minimum size removes the stale sibling.
+            w.materialize_url('/foo', 'foo')
+            w.flush()
+            self.assertFalse(os.path.exists(gz_path))
+        finally:
+            shutil.rmtree(path)
+
+
+class TestWSGIWriter(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        with open(os.path.join(self.path, 'foo.html'), 'w') as fp:
+            fp.write('foo')
+
+        class TestIndex(Index):
+            def _register_filters(self):
+                self.register_filter('noop', lambda index: lambda content, route=None: content)
+
+            def _generate_routes(self):
+                yield Route('/foo', self.absolute_path('foo.html'), filters=['noop'])
+                yield Route('/raw', self.absolute_path('foo.html'))
+
+        self.app = WSGIWriter(TestIndex(self.path))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def request(self, path, **environ):
+        response = {}
+        def start_response(status, headers):
+            response['status'] = status
+            response['headers'] = dict(headers)
+
+        environ['PATH_INFO'] = path
+        response['body'] = ''.join(self.app(environ, start_response))
+        return response
+
+    def test_conditional(self):
+        r = self.request('/foo')
+        self.assertEqual(r['status'], '200 OK')
+        self.assertEqual(r['body'], 'foo')
+        self.assertEqual(r['headers']['Content-Length'], '3')
+
+        etag = r['headers']['ETag']
+        r = self.request('/foo', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r['status'], '304 NOT MODIFIED')
+        self.assertEqual(r['body'], '')
+
+        r = self.request('/foo', HTTP_IF_MODIFIED_SINCE=r['headers']['Last-Modified'])
+        self.assertEqual(r['status'], '304 NOT MODIFIED')
+
+        r = self.request('/foo', HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(r['status'], '200 OK')
+        self.assertEqual(self.app.body_cache.hits, 1)
+
+        self.assertEqual(self.request('/missing')['status'], '404 NOT FOUND')
+
+    def test_max_cached_body_size(self):
+        self.app.max_cached_body_size = 2
+
+        self.assertEqual(self.request('/foo')['body'], 'foo')
+        self.assertFalse('foo' in self.app.body_cache)
+
+        r = self.request('/foo', HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(r['body'], 'foo')
+        self.assertEqual(self.app.body_cache.hits, 0)
+
+    def test_compress(self):
+        self.app.compress = ('gzip',)
+
+        r = self.request('/foo', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(r['headers']['Content-Encoding'], 'gzip')
+        self.assertEqual(r['headers']['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(r['body'])).read(), 'foo')
+
+        etag = r['headers']['ETag']
+        r = self.request('/foo')
+        self.assertFalse('Content-Encoding' in r['headers'])
+        self.assertEqual(r['headers']['Vary'], 'Accept-Encoding')
+        self.assertEqual(r['body'], 'foo')
+        self.assertNotEqual(r['headers']['ETag'], etag)
+
+        r = self.request('/foo', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r['status'], '304 NOT MODIFIED')
+
+    def test_passthrough(self):
+        wrapped = []
+        def file_wrapper(fp, block_size):
+            wrapped.append(os.path.normpath(fp.name))
+            return iter(lambda: fp.read(block_size), '')
+
+        r = self.request('/raw', **{'wsgi.file_wrapper': file_wrapper})
+        self.assertEqual(r['body'], 'foo')
+        self.assertEqual(r['headers']['Content-Length'], '3')
+        self.assertEqual(wrapped, [os.path.join(self.path, 'foo.html')])
+
+        r = self.request('/raw', HTTP_IF_NONE_MATCH=r['headers']['ETag'])
+        self.assertEqual(r['status'], '304 NOT MODIFIED')
+        self.assertFalse('raw' in self.app.body_cache)
+
+    def test_variants(self):
+        for path in ['/foo/', '/foo/index.html']:
+            self.assertEqual(self.request(path)['body'], 'foo')
+
+        self.assertEqual(self.request('/')['status'], '404 NOT FOUND')
+
+        self.app.list_dirs = True
+        r = self.request('/')
+        self.assertEqual(r['status'], '200 OK')
+        self.assertTrue('<a href="/foo">foo</a>' in r['body'])
+        self.assertTrue('<a href="/raw">raw</a>' in r['body'])
+
+    def test_stream(self):
+        self.app.stream = True
+
+        r = self.request('/foo')
+        self.assertEqual(r['status'], '200 OK')
+        self.assertEqual(r['body'], 'foo')
+        self.assertFalse('Content-Length' in r['headers'])
+
+        # Small bodies are still cached.
+        r = self.request('/foo')
+        self.assertEqual(r['body'], 'foo')
+        self.assertEqual(r['headers']['Content-Length'], '3')
+        self.assertEqual(self.app.body_cache.hits, 1)
+
+    def test_shared_render(self):
+        renders = []
+        started = threading.Event()
+        finish = threading.Event()
+
+        def slow(content, route=None):
+            renders.append(route.url)
+            started.set()
+            finish.wait()
+            return content
+
+        self.app.index.register_filter('slow', lambda index: slow)
+        self.app.index.get_route('/foo').filters = ('slow',)
+
+        responses = []
+        threads = [threading.Thread(target=lambda: responses.append(self.request('/foo'))) for _ in range(3)]
+        threads[0].start()
+        started.wait()
+
+        waiting = []
+        pending = self.app._pending['foo']
+        wait = pending.done.wait
+        pending.done.wait = lambda: waiting.append(True) or wait()
+
+        for t in threads[1:]:
+            t.start()
+        while len(waiting) < 2:
+            time.sleep(0.001)
+        finish.set()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(renders, ['/foo'])
+        self.assertEqual([r['body'] for r in responses], ['foo'] * 3)
+
 
 if __name__ == '__main__':
     unittest.main()